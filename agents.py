@@ -9,6 +9,8 @@ from langchain_core.tools import tool
 from langgraph.prebuilt import create_react_agent
 from langchain_core.output_parsers import PydanticOutputParser
 from tools import KnowledgeBaseSystem
+from history import HistoryPolicy
+from cache import ResponseCache
 from pydantic import BaseModel, Field
 
 class AgentState(TypedDict):
@@ -21,13 +23,43 @@ class AgentState(TypedDict):
     agent1_turn: bool
     agent2_turn: bool
     agent3_turn: bool
+    history_summary: str
+    summarized_messages: int
 
-class Agent:
+def render_history(state: AgentState, history: HistoryPolicy = None):
+    """Message history as sent to the LLM: compacted when a HistoryPolicy is configured, otherwise in full."""
+    return history.render(state) if history else state["messages"]
+
+class CachedResponses:
+    """Mixin for nodes whose LLM output may be served from a ResponseCache keyed on model, system prompt and rendered messages."""
+    response_cache: ResponseCache = None
+
+    def _setup_cache(self, llm, prompt: str, response_cache: ResponseCache):
+        self.response_cache = response_cache
+        self.model_id = f"{getattr(llm, 'model_name', type(llm).__name__)}@{getattr(llm, 'temperature', None)}"
+        self.prompt_text = prompt
+
+    def _cache_key(self, agent_input: dict):
+        if self.response_cache is None:
+            return None
+        messages = self.runnable.first.format_messages(**agent_input)
+        return self.response_cache.make_key(self.model_id, self.prompt_text, messages)
+
+    def _cache_get(self, key):
+        return self.response_cache.get(key) if key else None
+
+    def _cache_put(self, key, value):
+        if key:
+            self.response_cache.put(key, value)
+
+class Agent(CachedResponses):
     """Specialized agent. Recieves Agregator message list, his previous answer and critic response. Returns his answer"""
-    def __init__(self, llm: ChatOpenAI, prompt: str, agent_name: str, kb_system: KnowledgeBaseSystem):
+    def __init__(self, llm: ChatOpenAI, prompt: str, agent_name: str, kb_system: KnowledgeBaseSystem, history: HistoryPolicy = None, response_cache: ResponseCache = None):
         self.knowledge_base = kb_system
         self.agent_name = agent_name
+        self.history = history
         self.runnable = self._setUpAgent(llm, prompt)
+        self._setup_cache(llm, prompt, response_cache)
     
     def _setUpAgent(self, llm: ChatOpenAI, prompt_text: str):
         # messages = [
@@ -47,30 +79,50 @@ class Agent:
 
         prompt = ChatPromptTemplate.from_messages(messages)
         return prompt | llm
-    def __call__(self, state: AgentState):
-        agent_input = {
+    def _build_input(self, state: AgentState):
+        return {
             "question": [
                 {"role": "user", "content": "Oryginal question: " + state["question"]}
             ],
             f"{self.agent_name}_answer": [
                 {"role": "assistant", "content": "Your previous response: " + state[f"{self.agent_name}_answer"]}
             ],
-            "messages": state["messages"],
+            "messages": render_history(state, self.history),
             "critic_answer": [
                 {"role": "assistant", "content": "Critic response: " + state["critic_answer"]}
             ]
         }
-        result = self.runnable.invoke(agent_input)
-        last_message = result.content
-        self.knowledge_base.add_to_kb(last_message)
+
+    def __call__(self, state: AgentState):
+        agent_input = self._build_input(state)
+        key = self._cache_key(agent_input)
+        last_message = self._cache_get(key)
+        if last_message is None:
+            last_message = self.runnable.invoke(agent_input).content
+            self._cache_put(key, last_message)
+        self.knowledge_base.submit(last_message)
+        return {
+            f"{self.agent_name}_answer": last_message,
+        }
+
+    async def acall(self, state: AgentState):
+        agent_input = self._build_input(state)
+        key = self._cache_key(agent_input)
+        last_message = self._cache_get(key)
+        if last_message is None:
+            last_message = (await self.runnable.ainvoke(agent_input)).content
+            self._cache_put(key, last_message)
+        await self.knowledge_base.asubmit(last_message)
         return {
             f"{self.agent_name}_answer": last_message,
         }
     
-class Critic:
-    def __init__(self, llm: ChatOpenAI, prompt: str, kb_system: KnowledgeBaseSystem):
+class Critic(CachedResponses):
+    def __init__(self, llm: ChatOpenAI, prompt: str, kb_system: KnowledgeBaseSystem, history: HistoryPolicy = None, response_cache: ResponseCache = None):
         self.knowledge_base = kb_system
+        self.history = history
         self.runnable = self._setUpAgent(llm, prompt)
+        self._setup_cache(llm, prompt, response_cache)
     
     def _setUpAgent(self, llm: ChatOpenAI, prompt_text: str):
         messages = [
@@ -85,13 +137,12 @@ class Critic:
         prompt = ChatPromptTemplate.from_messages(messages)
         return prompt | llm
 
-    def __call__(self, state: AgentState):
-
-        agent_input = {
+    def _build_input(self, state: AgentState):
+        return {
             "question": [
                 {"role": "user", "content": "Oryginal question: " + state["question"]}
             ],
-            "messages": state["messages"],
+            "messages": render_history(state, self.history),
             "agent1_answer": [
                 {"role": "assistant", "content": "Agent1 response: " + state["agent1_answer"]}
             ],
@@ -102,9 +153,28 @@ class Critic:
                 {"role": "assistant", "content": "Agent3 response: " + state["agent3_answer"]}
             ]
         }
-        result = self.runnable.invoke(agent_input)
-        last_message = result.content
-        self.knowledge_base.add_to_kb(last_message)
+
+    def __call__(self, state: AgentState):
+        agent_input = self._build_input(state)
+        key = self._cache_key(agent_input)
+        last_message = self._cache_get(key)
+        if last_message is None:
+            last_message = self.runnable.invoke(agent_input).content
+            self._cache_put(key, last_message)
+        self.knowledge_base.submit(last_message)
+
+        return {
+            "critic_answer": last_message
+        }
+
+    async def acall(self, state: AgentState):
+        agent_input = self._build_input(state)
+        key = self._cache_key(agent_input)
+        last_message = self._cache_get(key)
+        if last_message is None:
+            last_message = (await self.runnable.ainvoke(agent_input)).content
+            self._cache_put(key, last_message)
+        await self.knowledge_base.asubmit(last_message)
 
         return {
             "critic_answer": last_message
@@ -113,9 +183,10 @@ class Critic:
 
 
 class Aggregator:
-    def __init__(self, llm: ChatOpenAI, prompt: str, tools: List[tool], kb_system: KnowledgeBaseSystem):
+    def __init__(self, llm: ChatOpenAI, prompt: str, tools: List[tool], kb_system: KnowledgeBaseSystem, history: HistoryPolicy = None):
         self.runnable = self._setUpAgent(llm, prompt, tools)
         self.knowledge_base = kb_system
+        self.history = history
         self.first_turn = True
 
     def _setUpAgent(self, llm: ChatOpenAI, prompt_text: str, tools):
@@ -133,13 +204,12 @@ class Aggregator:
         agent = create_react_agent(llm, tools=tools)
         return prompt | agent
 
-    def __call__(self, state: AgentState):
-
-        agent_input = {
+    def _build_input(self, state: AgentState):
+        return {
             "question": [
                 {"role": "user", "content": "Oryginal question: " + state["question"]}
             ],
-            "messages": state["messages"],
+            "messages": render_history(state, self.history),
             "agent1_answer": [
                 {"role": "assistant", "content": "Agent1 response: " + state["agent1_answer"]}
             ],
@@ -153,9 +223,20 @@ class Aggregator:
                 {"role": "assistant", "content": "Critic response: " + state["critic_answer"]}
             ]
         }
-        result = self.runnable.invoke(agent_input)
+
+    def __call__(self, state: AgentState):
+        result = self.runnable.invoke(self._build_input(state))
         last_message = result["messages"][-1].content
-        self.knowledge_base.add_to_kb(last_message)
+        self.knowledge_base.submit(last_message)
+
+        return {
+            "messages": AIMessage(last_message)
+        }
+
+    async def acall(self, state: AgentState):
+        result = await self.runnable.ainvoke(self._build_input(state))
+        last_message = result["messages"][-1].content
+        await self.knowledge_base.asubmit(last_message)
 
         return {
             "messages": AIMessage(last_message)
@@ -167,9 +248,11 @@ class RouterResponse(BaseModel):
     agent2_turn: bool = Field(description="Should agent2 take the next turn?")
     agent3_turn: bool = Field(description="Should agent3 take the next turn?")
 
-class Router:
-    def __init__(self, llm: ChatOpenAI, prompt: str):
+class Router(CachedResponses):
+    def __init__(self, llm: ChatOpenAI, prompt: str, history: HistoryPolicy = None, response_cache: ResponseCache = None):
         self.runnable = self._setUpAgent(llm, prompt)
+        self.history = history
+        self._setup_cache(llm, prompt, response_cache)
 
     def _setUpAgent(self, llm: ChatOpenAI, prompt_text: str):
         messages = [
@@ -185,12 +268,12 @@ class Router:
         prompt = ChatPromptTemplate.from_messages(messages)
         return prompt | llm.with_structured_output(RouterResponse)
 
-    def __call__(self, state: AgentState):
-        agent_input = {
+    def _build_input(self, state: AgentState):
+        return {
             "question": [
                 {"role": "user", "content": state["question"]}
             ],
-            "messages": state["messages"],
+            "messages": render_history(state, self.history),
             "agent1_answer": [
                 {"role": "assistant", "content": state["agent1_answer"]}
             ],
@@ -204,8 +287,8 @@ class Router:
                 {"role": "assistant", "content": state["critic_answer"]}
             ]
         }
-        result = self.runnable.invoke(agent_input)
 
+    def _build_output(self, result: RouterResponse):
         return {
             "messages": SystemMessage(result.message),
             "agent1_turn": result.agent1_turn,
@@ -213,3 +296,27 @@ class Router:
             "agent3_turn": result.agent3_turn
         }
 
+    def __call__(self, state: AgentState):
+        # Each round starts at the router, so it is the one node that folds old turns into the summary
+        update = self.history.compact(state) if self.history else {}
+        agent_input = self._build_input({**state, **update})
+        key = self._cache_key(agent_input)
+        cached = self._cache_get(key)
+        if cached is None:
+            result = self.runnable.invoke(agent_input)
+            self._cache_put(key, result.model_dump())
+        else:
+            result = RouterResponse(**cached)
+        return {**update, **self._build_output(result)}
+
+    async def acall(self, state: AgentState):
+        update = await self.history.acompact(state) if self.history else {}
+        agent_input = self._build_input({**state, **update})
+        key = self._cache_key(agent_input)
+        cached = self._cache_get(key)
+        if cached is None:
+            result = await self.runnable.ainvoke(agent_input)
+            self._cache_put(key, result.model_dump())
+        else:
+            result = RouterResponse(**cached)
+        return {**update, **self._build_output(result)}
@@ -0,0 +1,505 @@
+# asp.py
+import re
+import threading
+import time
+from typing import Iterable, List, Set, Tuple
+
+from clingo import Control, Function, MessageCode, Number, String, Symbol
+from clingo.ast import ASTType, Transformer, UnaryOperator, parse_string
+
+QUERY_GUARD = "__query"
+SHOW_TERM = "__show"
+
+class ASPError(RuntimeError):
+    """Parsing or grounding of an ASP program failed; `messages` holds Clingo's diagnostics."""
+    def __init__(self, message: str, messages: List[str] = None):
+        super().__init__(message)
+        self.messages = messages or []
+
+# Predicates of the session facts; result columns with these names get a prefix
+RESERVED_PREDICATES = {"node", "edge", "property", "row"}
+# Text up to this size becomes a constant (Product Design -> product_design); longer text stays a quoted string
+MAX_CONSTANT_CHARS = 50
+MAX_CONSTANT_WORDS = 6
+# Words the Clingo parser treats as keywords, so they cannot be used as bare constants
+KEYWORDS = {"not"}
+
+def constant(text: str) -> str:
+    """Sanitize text into an ASP constant: lowercase, runs of other characters replaced by underscores."""
+    name = re.sub(r"[^a-z0-9]+", "_", str(text).lower()).strip("_")
+    return name if name[:1].isalpha() and name not in KEYWORDS else f"c_{name}"
+
+def asp_term(value):
+    """Map a graph value to a Clingo symbol: integers to numbers, short text to constants, other text to strings."""
+    if isinstance(value, bool):
+        return Function(str(value).lower())
+    if isinstance(value, int):
+        return Number(value)
+    if isinstance(value, float):
+        return Number(int(value)) if value.is_integer() else String(str(value))
+    text = str(value)
+    if re.fullmatch(r"-?\d{1,9}", text.strip()):
+        return Number(int(text))
+    if len(text) <= MAX_CONSTANT_CHARS and len(text.split()) <= MAX_CONSTANT_WORDS and re.search(r"[A-Za-z0-9]", text):
+        return Function(constant(text))
+    return String(text)
+
+def fact(predicate: str, *arguments) -> str:
+    """Render a fact with sanitized arguments, e.g. fact("edge", "Alice", "KNOWS", "Bob") -> edge(alice,knows,bob)."""
+    return f"{Function(predicate, [argument if isinstance(argument, Symbol) else asp_term(argument) for argument in arguments])}."
+
+def graph_document_facts(documents: List[dict]) -> List[str]:
+    """
+    Facts for graph documents in the payload format of KnowledgeBaseSystem._write_graph_documents:
+    node(Id, Type), edge(Source, Type, Target) and property(Id, Key, Value).
+    """
+    facts = []
+    for document in documents:
+        for node in document["nodes"]:
+            facts.append(fact("node", node["id"], node["type"]))
+            for key, value in (node.get("properties") or {}).items():
+                if isinstance(value, (str, int, float, bool)):
+                    facts.append(fact("property", node["id"], constant(key), value))
+        for rel in document["relationships"]:
+            facts.append(fact("edge", rel["source"], rel["type"], rel["target"]))
+    return facts
+
+def _is_node(value) -> bool:
+    return isinstance(value, dict) and "id" in value
+
+def _is_relationship(value) -> bool:
+    # Neo4jGraph returns relationships as (start properties, type, end properties)
+    return isinstance(value, (list, tuple)) and len(value) == 3 and _is_node(value[0]) and isinstance(value[1], str) and _is_node(value[2])
+
+def _node_facts(node: dict) -> List[str]:
+    facts = []
+    for key, value in node.items():
+        if key not in ("id", "run_id") and isinstance(value, (str, int, float, bool)):
+            facts.append(fact("property", node["id"], constant(key), value))
+    return facts
+
+def compile_result_facts(rows: List[dict]) -> dict:
+    """
+    Deterministically compile Cypher result rows into ASP facts. Every row gets row(R); a scalar column `c`
+    becomes c(R, Value) (one fact per element for lists), a node column c(R, Id) plus property(Id, Key, Value)
+    facts, a relationship column c(R, Source, Type, Target) plus edge(Source, Type, Target), and a map column
+    one c_key(R, Value) per entry. Returns {"facts": [...], "predicates": {name/arity: {"count", "examples"}}}.
+    """
+    facts = []
+    for index, row in enumerate(rows):
+        facts.append(fact("row", index))
+        for column, value in row.items():
+            name = constant(column)
+            if name in RESERVED_PREDICATES:
+                name = f"col_{name}"
+            values = value if isinstance(value, list) and not _is_relationship(value) else [value]
+            for item in values:
+                if item is None:
+                    continue
+                if _is_relationship(item):
+                    start, rel_type, end = item
+                    facts.append(fact(name, index, start["id"], rel_type, end["id"]))
+                    facts.append(fact("edge", start["id"], rel_type, end["id"]))
+                    facts.extend(_node_facts(start) + _node_facts(end))
+                elif _is_node(item):
+                    facts.append(fact(name, index, item["id"]))
+                    facts.extend(_node_facts(item))
+                elif isinstance(item, dict):
+                    for key, entry in item.items():
+                        if isinstance(entry, (str, int, float, bool)):
+                            facts.append(fact(f"{name}_{constant(key)}", index, entry))
+                elif isinstance(item, (str, int, float, bool)):
+                    facts.append(fact(name, index, item))
+    facts = list(dict.fromkeys(facts))
+
+    predicates = {}
+    for text in facts:
+        stms = []
+        parse_string(text, stms.append)
+        symbol = stms[1].head.atom.symbol
+        summary = predicates.setdefault(f"{symbol.name}/{len(symbol.arguments)}", {"count": 0, "examples": []})
+        summary["count"] += 1
+        if len(summary["examples"]) < 3 and len(text) <= 120:
+            summary["examples"].append(text)
+    return {"facts": facts, "predicates": predicates}
+
+def describe_facts(predicates: dict) -> str:
+    """One line per compiled predicate with its size and a few example facts, for the rule-writing prompt."""
+    return "\n".join(
+        f"{signature} ({summary['count']} facts), e.g. {' '.join(summary['examples'])}"
+        for signature, summary in predicates.items()
+    )
+
+class _PredicateRenamer(Transformer):
+    """Give every atom of a query part a per-step predicate name, since Clingo forbids redefining atoms across steps."""
+    def __init__(self, suffix: str):
+        self.suffix = suffix
+        self.signatures: Set[Tuple[str, int]] = set()
+
+    def _rename(self, function):
+        self.signatures.add((function.name, len(function.arguments)))
+        return function.update(name=function.name + self.suffix)
+
+    def visit_SymbolicAtom(self, atom):
+        symbol = atom.symbol
+        if symbol.ast_type == ASTType.Function:
+            return atom.update(symbol=self._rename(symbol))
+        if symbol.ast_type == ASTType.UnaryOperation and symbol.operator_type == UnaryOperator.Minus:
+            return atom.update(symbol=symbol.update(argument=self._rename(symbol.argument)))
+        return atom
+
+def _head_signatures(rule) -> Set[Tuple[str, int]]:
+    collector = _PredicateRenamer("")
+    collector(rule.head)
+    return collector.signatures
+
+def split_statements(program: str) -> List[str]:
+    """
+    Split a program into statements at terminating periods, skipping strings, comments and `..` ranges.
+    A period followed by `[` continues a weak constraint up to the closing bracket (`:~ body. [w@p]`).
+    """
+    statements = []
+    start = index = 0
+    length = len(program)
+    while index < length:
+        char = program[index]
+        if char == '"':
+            index += 1
+            while index < length and program[index] != '"':
+                index += 2 if program[index] == "\\" else 1
+        elif program.startswith("%*", index):
+            end = program.find("*%", index + 2)
+            index = length if end < 0 else end + 1
+        elif char == "%":
+            end = program.find("\n", index)
+            index = length if end < 0 else end
+        elif char == ".":
+            if program.startswith("..", index):
+                index += 1
+            else:
+                end = index
+                if program[index + 1:].lstrip().startswith("["):
+                    close = program.find("]", index)
+                    end = length - 1 if close < 0 else close
+                statement = program[start:end + 1].strip()
+                if statement:
+                    statements.append(statement)
+                start = index = end + 1
+                continue
+        index += 1
+    rest = program[start:].strip()
+    if rest and not re.fullmatch(r"(%[^\n]*\s*)*", rest):
+        statements.append(rest)
+    return statements
+
+class _VariableCollector(Transformer):
+    def __init__(self):
+        self.found = False
+
+    def visit_Variable(self, variable):
+        self.found = True
+        return variable
+
+def _body_signatures(statement) -> Set[Tuple[str, int]]:
+    collector = _PredicateRenamer("")
+    for literal in statement.body:
+        collector(literal)
+    return collector.signatures
+
+def _check_statement(statement: str):
+    """Parse and ground one statement in a scratch control; returns (parsed AST, error message or None)."""
+    messages = []
+    parsed = []
+    try:
+        parse_string(statement, parsed.append, logger=lambda code, message: messages.append(message.strip()))
+    except RuntimeError:
+        return None, "; ".join(messages) or "syntax error"
+    # Clingo >= 5.7 also reports comments as statements
+    parsed = [ast for ast in parsed if ast.ast_type.name not in ("Program", "Comment")]
+    if len(parsed) != 1:
+        return None, "expected exactly one statement"
+    variables = _VariableCollector()
+    variables(parsed[0])
+    if not variables.found:
+        return parsed[0], None
+    # Safety (every variable bound by a positive body literal) is checked by the grounder
+    control = Control(["--warn=none"], logger=lambda code, message: messages.append(message.strip()))
+    try:
+        control.add("base", [], statement)
+        control.ground([("base", [])])
+    except RuntimeError:
+        return parsed[0], "; ".join(messages) or "grounding error"
+    return parsed[0], None
+
+def validate_program(program: str, known_signatures: Iterable[Tuple[str, int]] = ()) -> List[dict]:
+    """
+    Validate a program statement by statement with Clingo's parser and grounder. Returns one
+    {"statement", "error"} entry per failing statement: syntax errors, unsafe variables, and (given the
+    signatures of the loaded facts) body predicates that neither the facts nor any rule define.
+    """
+    errors = []
+    parsed = []
+    for statement in split_statements(program):
+        ast, error = _check_statement(statement)
+        if error:
+            errors.append({"statement": statement, "error": error})
+        else:
+            parsed.append((statement, ast))
+
+    defined = set(known_signatures)
+    for _, ast in parsed:
+        if ast.ast_type == ASTType.Rule:
+            defined |= _head_signatures(ast)
+    for statement, ast in parsed:
+        if ast.ast_type not in (ASTType.Rule, ASTType.Minimize, ASTType.ShowTerm):
+            continue
+        undefined = {signature for signature in _body_signatures(ast) if signature not in defined}
+        if undefined:
+            names = ", ".join(f"{name}/{arity}" for name, arity in sorted(undefined))
+            errors.append({"statement": statement, "error": f"undefined predicate(s) {names}: not among the loaded facts or rule heads"})
+    return errors
+
+class ASPSession:
+    """
+    Long-lived Clingo control for the knowledge base. Graph facts are added as incremental program parts and
+    grounded once; each query is added as its own part whose rules are guarded by `#external __query(k)`, solved
+    with that external set to true and then released, so it never affects later queries. After `max_queries`
+    query parts, or after any grounding error, the control is rebuilt from the accumulated facts.
+
+    Solving is bounded: at most `max_models` answer sets are collected and the search is cancelled after
+    `timeout` seconds. With `optimal_only`, programs with #minimize/#maximize only report proven optimal
+    models, or the best model found if the timeout hits first (stats then say optimality_proven: False),
+    and `threads` > 1 runs Clingo's parallel (competing) solvers.
+    """
+    def __init__(self, max_models: int = 10, timeout: float = 10.0, optimal_only: bool = True, threads: int = 1,
+                 max_queries: int = 200):
+        self.max_models = max_models
+        self.timeout = timeout
+        self.optimal_only = optimal_only
+        self.threads = threads
+        self.max_queries = max_queries
+        self._lock = threading.RLock()
+        self._facts = []
+        self._fact_set = set()
+        self._step = 0
+        self._reset()
+
+    def close(self):
+        """Release the Clingo control and its grounded facts; the session cannot solve afterwards."""
+        with self._lock:
+            self.control = None
+            self._facts = []
+            self._fact_set = set()
+
+    def _on_message(self, code, message):
+        if code in (MessageCode.RuntimeError, MessageCode.OperationUndefined, MessageCode.AtomUndefined, MessageCode.GlobalVariable):
+            self.messages.append(f"{code.name}: {message.strip()}")
+
+    def _reset(self):
+        self.messages = []
+        arguments = ["--warn=none", "--models=0"]
+        if self.threads > 1:
+            arguments.append(f"--parallel-mode={self.threads},compete")
+        self.control = Control(arguments, logger=self._on_message)
+        self._queries = 0
+        self._fact_signatures = set()
+        self._ground_facts(self._facts)
+
+    def _ground_facts(self, facts: List[str]):
+        if not facts:
+            return
+        self._step += 1
+        part = f"facts_{self._step}"
+        text = "\n".join(facts)
+        self.control.add(part, [], text)
+        self.control.ground([(part, [])])
+        parse_string(text, lambda statement: self._fact_signatures.update(
+            _head_signatures(statement) if statement.ast_type == ASTType.Rule else ()
+        ))
+
+    def fact_version(self) -> int:
+        """Number of session facts; facts are only ever added, so this identifies their state."""
+        with self._lock:
+            return len(self._facts)
+
+    def fact_signatures(self) -> Set[Tuple[str, int]]:
+        with self._lock:
+            return set(self._fact_signatures)
+
+    def add_facts(self, facts: Iterable[str]):
+        """Ground facts that are not in the session yet; facts that fail to ground are not kept."""
+        with self._lock:
+            new_facts = [f for f in dict.fromkeys(facts) if f not in self._fact_set]
+            if not new_facts:
+                return
+            self.messages = []
+            try:
+                self._ground_facts(new_facts)
+            except RuntimeError as e:
+                messages = list(self.messages) or [str(e)]
+                # A failed add/ground leaves the control unusable; rebuild it from the facts grounded so far
+                self._reset()
+                raise ASPError(f"Grounding facts failed: {e}", messages) from e
+            self._fact_set.update(new_facts)
+            self._facts.extend(new_facts)
+
+    def _compile_query(self, program: str, step: int):
+        """
+        Rename, guard and translate #show directives of a query program.
+        Returns (text, shown signatures, whether the program optimizes).
+        """
+        suffix = f"__q{step}"
+        statements = []
+        messages = []
+        try:
+            parse_string(program, statements.append, logger=lambda code, message: messages.append(message.strip()))
+        except RuntimeError as e:
+            raise ASPError(f"Failed to parse ASP program: {e}", messages) from e
+
+        guard_statements = []
+        parse_string(f"{SHOW_TERM} :- {QUERY_GUARD}({step}).", guard_statements.append)
+        guard = guard_statements[1].body[0]
+
+        renamer = _PredicateRenamer(suffix)
+        shown = None
+        heads = set()
+        optimizes = False
+        compiled = [f"#external {QUERY_GUARD}({step})."]
+        for statement in statements:
+            kind = statement.ast_type
+            if kind == ASTType.Program:
+                continue
+            if kind == ASTType.ShowSignature:
+                shown = shown or set()
+                if statement.name:
+                    shown.add((statement.name, statement.arity))
+                continue
+            if kind == ASTType.ShowTerm:
+                shown = shown or set()
+                body = ", ".join(str(literal) for literal in statement.body)
+                rule = f"{SHOW_TERM}({statement.term})" + (f" :- {body}." if body else ".")
+                converted = []
+                parse_string(rule, converted.append)
+                statement = converted[1]
+                shown.add((SHOW_TERM, 1))
+                kind = statement.ast_type
+            if kind == ASTType.Script:
+                raise ASPError("Scripts are not allowed in query programs")
+            if kind == ASTType.Rule:
+                heads |= _head_signatures(statement)
+            optimizes = optimizes or kind == ASTType.Minimize
+            statement = renamer(statement)
+            if "body" in statement.keys():
+                statement = statement.update(body=list(statement.body) + [guard])
+            compiled.append(str(statement))
+
+        # Bridge renamed predicates to the session facts of the same signature
+        for name, arity in sorted(renamer.signatures & self._fact_signatures):
+            variables = ", ".join(f"X{i}" for i in range(arity))
+            arguments = f"({variables})" if arity else ""
+            compiled.append(f"{name}{suffix}{arguments} :- {name}{arguments}, {QUERY_GUARD}({step}).")
+        return "\n".join(compiled), heads if shown is None else shown, optimizes
+
+    def solve(self, program: str) -> dict:
+        """
+        Solve a query program on top of the session facts. Returns {"models": [...], "stats": {...}} with one
+        sorted list of shown atoms per answer set; without #show directives the atoms of predicates the
+        program defines are shown. The stats report timing, model counts and whether a budget was hit.
+        """
+        with self._lock:
+            if self._queries >= self.max_queries:
+                self._reset()
+            self._step += 1
+            step = self._step
+            suffix = f"__q{step}"
+            text, shown, optimizes = self._compile_query(program, step)
+            part = f"query_{step}"
+            guard = Function(QUERY_GUARD, [Number(step)])
+            self.messages = []
+            started = time.perf_counter()
+            try:
+                self.control.add(part, [], text)
+                self.control.ground([(part, [])])
+            except RuntimeError as e:
+                messages = list(self.messages) or [str(e)]
+                # A failed add/ground leaves the control unusable
+                self._reset()
+                raise ASPError(f"Grounding failed: {e}", messages) from e
+            self._queries += 1
+            grounded = time.perf_counter()
+
+            try:
+                self.control.assign_external(guard, True)
+                # Released queries keep their (inactive) #minimize statements, so optimization is switched per query
+                self.control.configuration.solve.opt_mode = ("optN" if self.optimal_only else "opt") if optimizes else "ignore"
+                models, stats = self._bounded_solve(suffix, shown, optimizes)
+            finally:
+                self.control.release_external(guard)
+            stats.update({
+                "ground_seconds": round(grounded - started, 4),
+                "solve_seconds": round(time.perf_counter() - grounded, 4),
+                "threads": self.threads,
+            })
+            return {"models": models, "stats": stats}
+
+    def _bounded_solve(self, suffix: str, shown, optimizes: bool):
+        models = []
+        found = 0
+        timed_out = truncated = proven = False
+        # Under optN every unproven model improves on the previous one, so the latest is the best found so far
+        best = None
+        deadline = time.perf_counter() + self.timeout if self.timeout else None
+        with self.control.solve(yield_=True, async_=True) as handle:
+            while True:
+                handle.resume()
+                if deadline is None:
+                    handle.wait()
+                elif not handle.wait(max(deadline - time.perf_counter(), 0)):
+                    timed_out = True
+                    handle.cancel()
+                    break
+                model = handle.model()
+                if model is None:
+                    break
+                found += 1
+                proven = proven or model.optimality_proven
+                # Under optN, models are reported while the optimum is still being searched for
+                if optimizes and self.optimal_only and not model.optimality_proven:
+                    best = self._shown_atoms(model.symbols(atoms=True), suffix, shown)
+                    continue
+                if self.max_models and len(models) >= self.max_models:
+                    # Only an answer set beyond the budget shows the search was cut short
+                    truncated = True
+                    handle.cancel()
+                    break
+                models.append(self._shown_atoms(model.symbols(atoms=True), suffix, shown))
+            result = handle.get()
+        if not models and best is not None:
+            # The budget ran out before the optimum was proven; the best model beats reporting no solution
+            models.append(best)
+        stats = {
+            "models_found": found,
+            "models_returned": len(models),
+            "satisfiable": result.satisfiable if not timed_out or models else None,
+            "exhausted": result.exhausted and not truncated and not timed_out,
+            "timed_out": timed_out,
+            "truncated": truncated,
+        }
+        if optimizes:
+            stats["optimality_proven"] = proven
+        return models, stats
+
+    @staticmethod
+    def _shown_atoms(symbols, suffix: str, shown) -> List[str]:
+        atoms = []
+        for symbol in symbols:
+            if not symbol.name.endswith(suffix):
+                continue
+            name = symbol.name[: -len(suffix)]
+            if (name, len(symbol.arguments)) not in shown:
+                continue
+            if name == SHOW_TERM:
+                atoms.append(str(symbol.arguments[0]))
+            else:
+                atoms.append(str(Function(name, symbol.arguments, symbol.positive)))
+        return sorted(atoms)
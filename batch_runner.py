@@ -0,0 +1,189 @@
+# batch_runner.py
+import argparse
+import asyncio
+import json
+import time
+from pathlib import Path
+
+from langchain_core.messages import AIMessage, SystemMessage
+
+from config_loader import load_config, get_all_config_values
+from main import WorkflowManager, clear_checkpoints, setup_environment
+
+# Ablation name -> (use_ToM, use_critic), matching the four prompt variants in WorkflowManager._setup_workflow
+ABLATIONS = {
+    "tom_critic": (True, True),
+    "no_tom_critic": (False, True),
+    "tom_no_critic": (True, False),
+    "no_tom_no_critic": (False, False),
+}
+
+def load_problems(path: str):
+    """Read problems from a JSONL file. Each line holds {"id": ..., "problem": ...}; the id defaults to the line number."""
+    problems = []
+    with open(path, 'r', encoding="utf-8") as file:
+        for line_number, line in enumerate(file, start=1):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            problems.append({"id": str(record.get("id", line_number)), "problem": record["problem"]})
+    return problems
+
+class BatchRunner:
+    """Runs every problem x ablation combination with at most `concurrency` discussions in flight."""
+    def __init__(self, config_values, problems, ablations, output_path, concurrency=4, parallel_agents=True, resume=False):
+        self.config_values = config_values
+        self.problems = problems
+        self.ablations = ablations
+        self.output_path = Path(output_path)
+        self.concurrency = concurrency
+        self.parallel_agents = parallel_agents
+        self.resume = resume
+        self.checkpoint_prefix = f"{self.output_path.stem}:"
+        self.finished_runs = self._load_finished_runs() if resume else set()
+        self.completed = 0
+        self.failed = 0
+        self.total = 0
+        self.started_at = None
+
+    def _load_finished_runs(self):
+        """Run ids that already have a successful record in the output file."""
+        if not self.output_path.exists():
+            return set()
+        finished = set()
+        with open(self.output_path, 'r', encoding="utf-8") as file:
+            for line in file:
+                if line.strip():
+                    record = json.loads(line)
+                    if record.get("status") == "ok":
+                        finished.add(record["run_id"])
+        return finished
+
+    def _summarize_state(self, state):
+        messages = state["messages"]
+        final_answer = next((m.content for m in reversed(messages) if isinstance(m, AIMessage)), "")
+        return {
+            "final_answer": final_answer,
+            "agent1_answer": state["agent1_answer"],
+            "agent2_answer": state["agent2_answer"],
+            "agent3_answer": state["agent3_answer"],
+            "critic_answer": state["critic_answer"],
+            "rounds": sum(isinstance(m, SystemMessage) for m in messages),
+        }
+
+    async def _run_one(self, semaphore, problem, ablation):
+        use_ToM, use_critic = ABLATIONS[ablation]
+        record = {
+            "run_id": f"{problem['id']}:{ablation}",
+            "problem_id": problem["id"],
+            "ablation": ablation,
+            "use_ToM": use_ToM,
+            "use_critic": use_critic,
+            "parallel_agents": self.parallel_agents,
+        }
+        async with semaphore:
+            start = time.perf_counter()
+            workflow_manager = None
+            try:
+                # Each run gets its own WorkflowManager, so no LLM, node or KB object is shared between runs
+                workflow_manager = await asyncio.to_thread(
+                    WorkflowManager, self.config_values,
+                    use_ToM=use_ToM, use_critic=use_critic, parallel_agents=self.parallel_agents
+                )
+                # Checkpoints are keyed by output file and run id, so --resume continues exactly this sweep
+                final_state = await workflow_manager.arun_phase(
+                    problem["problem"], verbose=False,
+                    run_id=f"{self.checkpoint_prefix}{record['run_id']}", resume=self.resume
+                )
+                record.update(status="ok", **self._summarize_state(final_state))
+            except Exception as e:
+                record.update(status="error", error=f"{type(e).__name__}: {e}")
+            finally:
+                # Stops the run's ingestion worker and releases its graph connection before the next run starts
+                if workflow_manager is not None:
+                    await asyncio.to_thread(workflow_manager.close)
+            record["duration_s"] = round(time.perf_counter() - start, 3)
+        self._record_result(record)
+        return record
+
+    def _record_result(self, record):
+        with open(self.output_path, 'a', encoding="utf-8") as file:
+            file.write(json.dumps(record) + "\n")
+
+        self.completed += 1
+        if record["status"] != "ok":
+            self.failed += 1
+        elapsed = time.perf_counter() - self.started_at
+        throughput = self.completed / elapsed
+        eta = (self.total - self.completed) / throughput if throughput else 0.0
+        print(f"[{self.completed}/{self.total}] {record['run_id']} {record['status']} in {record['duration_s']:.1f}s "
+              f"| {throughput * 60:.2f} runs/min | ETA {eta / 60:.1f} min")
+
+    async def run(self):
+        self.output_path.parent.mkdir(parents=True, exist_ok=True)
+        if not self.resume:
+            # A new sweep into this output file must not trip over checkpoints left by an earlier one
+            removed = clear_checkpoints(self.config_values['CHECKPOINT_DB'], self.checkpoint_prefix)
+            if removed:
+                print(f"Cleared {removed} stale checkpoint rows for {self.output_path}")
+        self.started_at = time.perf_counter()
+        semaphore = asyncio.Semaphore(self.concurrency)
+        pending = [
+            (problem, ablation)
+            for problem in self.problems
+            for ablation in self.ablations
+            if f"{problem['id']}:{ablation}" not in self.finished_runs
+        ]
+        self.total = len(pending)
+        skipped = len(self.problems) * len(self.ablations) - self.total
+        if skipped:
+            print(f"Skipping {skipped} runs already finished in {self.output_path}")
+        records = await asyncio.gather(*(
+            self._run_one(semaphore, problem, ablation)
+            for problem, ablation in pending
+        ))
+        self._print_summary(records)
+        return records
+
+    def _print_summary(self, records):
+        if not records:
+            print("Nothing to run")
+            return
+        wall_time = time.perf_counter() - self.started_at
+        run_time = sum(r["duration_s"] for r in records)
+        print("==== Batch summary ====")
+        print(f"Runs: {len(records)} ({len(records) - self.failed} ok, {self.failed} failed)")
+        print(f"Wall time: {wall_time:.1f}s, throughput: {len(records) / wall_time * 60:.2f} runs/min")
+        print(f"Mean run time: {run_time / len(records):.1f}s, effective parallelism: {run_time / wall_time:.2f}x")
+        print(f"Results written to {self.output_path}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Run every problem x ToM/critic ablation through the multi-agent workflow.")
+    parser.add_argument("problems", help="JSONL file with one {\"id\", \"problem\"} record per line")
+    parser.add_argument("--output", default="batch_results.jsonl", help="JSONL file receiving one result record per run")
+    parser.add_argument("--ablations", nargs="+", choices=list(ABLATIONS), default=list(ABLATIONS))
+    parser.add_argument("--concurrency", type=int, default=4, help="Maximum number of discussions in flight")
+    parser.add_argument("--sequential-agents", action="store_true", help="Chain the agents instead of running them in parallel")
+    parser.add_argument("--resume", action="store_true", help="Skip runs already finished in --output and continue interrupted runs from their checkpoints")
+    args = parser.parse_args()
+
+    if not args.resume and Path(args.output).exists() and Path(args.output).stat().st_size:
+        parser.error(f"{args.output} already contains results; pass --resume to continue that sweep or choose another --output")
+
+    config = load_config()
+    config_values = get_all_config_values(config)
+    setup_environment(config_values)
+
+    runner = BatchRunner(
+        config_values,
+        load_problems(args.problems),
+        args.ablations,
+        args.output,
+        concurrency=args.concurrency,
+        parallel_agents=not args.sequential_agents,
+        resume=args.resume
+    )
+    asyncio.run(runner.run())
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,256 @@
+# benchmark.py
+import argparse
+import asyncio
+import json
+import random
+import statistics
+import threading
+import time
+import tracemalloc
+import uuid
+from collections import defaultdict
+from typing import Any, List, Optional
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from langchain_core.runnables import RunnableLambda
+from langchain_core.utils.function_calling import convert_to_openai_tool
+from pydantic import PrivateAttr
+
+from main import WorkflowManager
+from tools import IngestionQueue
+
+BENCHMARK_PROBLEM = "Our mid-sized tech firm must choose one emerging technology to prioritize: Edge Computing, Quantum Computing, or Blockchain. Which option offers the best balance of feasibility, market potential and financial viability?"
+
+VARIANTS = {
+    "tom_critic": (True, True),
+    "no_tom_critic": (False, True),
+    "tom_no_critic": (True, False),
+    "no_tom_no_critic": (False, False),
+}
+
+class FakeChatModel(BaseChatModel):
+    """
+    Chat model with simulated latency and output length. Router calls (structured output) keep all agents
+    active for `rounds` rounds and then end the discussion; every other call returns filler text. Rounds are
+    counted per model instance, since compacted histories do not show how many rounds have passed.
+    """
+    latency_mean: float = 0.05
+    latency_stddev: float = 0.02
+    output_tokens: int = 200
+    output_tokens_stddev: int = 50
+    rounds: int = 2
+    seed: int = 0
+    _rng: Any = PrivateAttr(default=None)
+    _rng_lock: Any = PrivateAttr(default_factory=threading.Lock)
+    _router_calls: int = PrivateAttr(default=0)
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-benchmark"
+
+    def bind_tools(self, tools, **kwargs):
+        return self.bind(tools=[convert_to_openai_tool(t) for t in tools], **kwargs)
+
+    def _sample(self, mean: float, stddev: float) -> float:
+        with self._rng_lock:
+            if self._rng is None:
+                self._rng = random.Random(self.seed)
+            return max(0.0, self._rng.gauss(mean, stddev))
+
+    def _respond(self, messages: List[BaseMessage], tools: Optional[list]) -> ChatResult:
+        tool_names = [t["function"]["name"] for t in tools or []]
+        if "RouterResponse" in tool_names:
+            with self._rng_lock:
+                round_number = self._router_calls
+                self._router_calls += 1
+            active = round_number < self.rounds
+            message = AIMessage(content="", tool_calls=[{
+                "name": "RouterResponse",
+                "args": {
+                    "message": f"Objective for round {round_number + 1}",
+                    "agent1_turn": active,
+                    "agent2_turn": active,
+                    "agent3_turn": active,
+                },
+                "id": f"call_{uuid.uuid4().hex[:12]}",
+            }])
+        else:
+            length = int(self._sample(self.output_tokens, self.output_tokens_stddev))
+            message = AIMessage(content=" ".join(f"token{i % 97}" for i in range(length)))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        time.sleep(self._sample(self.latency_mean, self.latency_stddev))
+        return self._respond(messages, kwargs.get("tools"))
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        await asyncio.sleep(self._sample(self.latency_mean, self.latency_stddev))
+        return self._respond(messages, kwargs.get("tools"))
+
+class LocalKnowledgeBase:
+    """Stand-in for KnowledgeBaseSystem: keeps ingested texts in memory instead of extracting them into Neo4j."""
+    def __init__(self, ingest_latency: float = 0.0):
+        self.ingest_latency = ingest_latency
+        self.texts = []
+        self._lock = threading.Lock()
+        self.ingestion = IngestionQueue(self.add_texts_to_kb)
+
+    def add_texts_to_kb(self, texts):
+        # One simulated round-trip per batch, as in KnowledgeBaseSystem.add_texts_to_kb
+        time.sleep(self.ingest_latency)
+        with self._lock:
+            self.texts.extend(texts)
+
+    def add_to_kb(self, text):
+        self.add_texts_to_kb([text])
+
+    def submit(self, text):
+        return self.ingestion.submit(text)
+
+    async def asubmit(self, text):
+        return self.ingestion.try_submit(text) or await asyncio.to_thread(self.ingestion.submit, text)
+
+    def flush(self, seq=None, timeout=None):
+        return self.ingestion.wait_for(seq, timeout)
+
+    async def aflush(self, seq=None, timeout=None):
+        return await asyncio.to_thread(self.ingestion.wait_for, seq, timeout)
+
+    def query_knowledge_base(self, query: str):
+        self.flush()
+        return {"result": "No relevant data was found in the database.", "source": "graph_database"}
+
+    def cache_stats(self):
+        return {}
+
+    def close(self):
+        self.ingestion.close()
+
+class BenchmarkWorkflowManager(WorkflowManager):
+    """WorkflowManager wired to fake LLMs and the local knowledge base, with every node timed."""
+    def __init__(self, llm_settings: dict, kb_latency: float, config: dict = None, **workflow_options):
+        self.llm_settings = llm_settings
+        self.kb_latency = kb_latency
+        self.node_timings = defaultdict(list)
+        self.state_sizes = []
+        self._timings_lock = threading.Lock()
+        super().__init__(config or {}, **workflow_options)
+
+    def _setup_agent_llm(self):
+        return FakeChatModel(**self.llm_settings)
+
+    def _setup_advanced_llm(self):
+        return FakeChatModel(**self.llm_settings)
+
+    def _setup_kb_system(self):
+        return LocalKnowledgeBase(self.kb_latency)
+
+    def _record(self, name, state, elapsed):
+        with self._timings_lock:
+            self.node_timings[name].append(elapsed)
+            if name == "router":
+                # The router runs once per round, so its input is the state at the start of each round
+                self.state_sizes.append(len(json.dumps(state, default=str)))
+
+    def _node(self, node):
+        name = getattr(node, "agent_name", type(node).__name__.lower())
+
+        def timed(state):
+            start = time.perf_counter()
+            result = node(state)
+            self._record(name, state, time.perf_counter() - start)
+            return result
+
+        async def atimed(state):
+            start = time.perf_counter()
+            result = await node.acall(state)
+            self._record(name, state, time.perf_counter() - start)
+            return result
+
+        return RunnableLambda(timed, afunc=atimed)
+
+def run_benchmark(variant: str, parallel: bool, args) -> dict:
+    use_ToM, use_critic = VARIANTS[variant]
+    llm_settings = {
+        "latency_mean": args.latency_mean,
+        "latency_stddev": args.latency_stddev,
+        "output_tokens": args.output_tokens,
+        "output_tokens_stddev": args.output_tokens_stddev,
+        "rounds": args.rounds,
+        "seed": args.seed,
+    }
+    config = {}
+    if args.history_keep_turns is not None:
+        config = {"HISTORY_ENABLED": True, "HISTORY_KEEP_TURNS": args.history_keep_turns, "HISTORY_TOKEN_BUDGET": args.history_token_budget}
+    manager = BenchmarkWorkflowManager(
+        llm_settings, args.kb_latency, config,
+        use_ToM=use_ToM, use_critic=use_critic, parallel_agents=parallel
+    )
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        if args.use_async:
+            asyncio.run(manager.arun_phase(BENCHMARK_PROBLEM, verbose=False))
+        else:
+            manager.run_phase(BENCHMARK_PROBLEM, verbose=False)
+        wall_time = time.perf_counter() - start
+        _, peak_memory = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+        manager.close()
+
+    rounds = len(manager.state_sizes)
+    return {
+        "variant": variant,
+        "topology": "parallel" if parallel else "sequential",
+        "wall_time_s": wall_time,
+        "rounds": rounds,
+        "rounds_per_s": rounds / wall_time if wall_time else 0.0,
+        "peak_memory_mib": peak_memory / 2**20,
+        "state_bytes_per_round": manager.state_sizes,
+        "history_savings": manager.history_policy.savings if manager.history_policy else [],
+        "node_ms": {name: statistics.mean(t) * 1000 for name, t in sorted(manager.node_timings.items())},
+    }
+
+def print_report(results):
+    header = f"{'variant':<18}{'topology':<12}{'wall s':>8}{'rounds/s':>10}{'peak MiB':>10}{'state B (last)':>16}  node mean ms"
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        last_state = r["state_bytes_per_round"][-1] if r["state_bytes_per_round"] else 0
+        nodes = ", ".join(f"{name}={ms:.1f}" for name, ms in r["node_ms"].items())
+        print(f"{r['variant']:<18}{r['topology']:<12}{r['wall_time_s']:>8.3f}{r['rounds_per_s']:>10.2f}"
+              f"{r['peak_memory_mib']:>10.2f}{last_state:>16}  {nodes}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the orchestration of WorkflowManager.run_phase with a fake LLM and a local knowledge base.")
+    parser.add_argument("--variants", nargs="+", choices=list(VARIANTS), default=list(VARIANTS))
+    parser.add_argument("--topologies", nargs="+", choices=["parallel", "sequential"], default=["parallel", "sequential"])
+    parser.add_argument("--rounds", type=int, default=2, help="Rounds before the fake router ends the discussion")
+    parser.add_argument("--latency-mean", type=float, default=0.05, help="Mean simulated LLM latency in seconds")
+    parser.add_argument("--latency-stddev", type=float, default=0.02)
+    parser.add_argument("--output-tokens", type=int, default=200, help="Mean length of simulated answers")
+    parser.add_argument("--output-tokens-stddev", type=int, default=50)
+    parser.add_argument("--kb-latency", type=float, default=0.0, help="Simulated knowledge base ingestion latency in seconds")
+    parser.add_argument("--history-keep-turns", type=int, help="Enable history compaction keeping this many turns verbatim")
+    parser.add_argument("--history-token-budget", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--async", dest="use_async", action="store_true", help="Drive arun_phase instead of run_phase")
+    parser.add_argument("--json", help="Also write the raw results to this file")
+    args = parser.parse_args()
+
+    results = [
+        run_benchmark(variant, topology == "parallel", args)
+        for variant in args.variants
+        for topology in args.topologies
+    ]
+    print_report(results)
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump(results, file, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+# cache.py
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Optional, Sequence
+
+from langchain_core.messages import BaseMessage
+
+class LRUCache:
+    """Thread-safe in-memory LRU mapping with hit/miss counters."""
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def items(self):
+        with self._lock:
+            return list(self._entries.items())
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+class ResponseCache:
+    """
+    Content-addressed cache of LLM responses. Lookups go through an in-memory LRU tier first and then an
+    on-disk tier (one JSON file per key) whose total size is bounded by evicting the least recently used files.
+    """
+    def __init__(self, directory: Optional[str] = None, max_entries: int = 1024, max_disk_bytes: int = 256 * 2**20):
+        self.memory = LRUCache(max_entries)
+        self.directory = Path(directory) if directory else None
+        self.max_disk_bytes = max_disk_bytes
+        self.disk_hits = 0
+        self._lock = threading.Lock()
+        self._disk_bytes = 0
+        if self.directory:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            self._disk_bytes = sum(path.stat().st_size for path in self.directory.glob("*.json"))
+
+    @staticmethod
+    def make_key(model: str, system_prompt: str, messages: Sequence[BaseMessage]) -> str:
+        rendered = json.dumps([(message.type, message.content) for message in messages])
+        digest = hashlib.sha256()
+        for part in (model, system_prompt or "", rendered):
+            digest.update(part.encode("utf-8"))
+            digest.update(b"\x00")
+        return digest.hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.directory / f"{key}.json"
+
+    def get(self, key: str) -> Any:
+        value = self.memory.get(key)
+        if value is not None or not self.directory:
+            return value
+        path = self._path(key)
+        try:
+            with open(path, 'r', encoding="utf-8") as file:
+                value = json.load(file)
+            os.utime(path)  # Refresh the LRU position of the file
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        with self._lock:
+            self.disk_hits += 1
+        self.memory.put(key, value)
+        return value
+
+    def put(self, key: str, value: Any):
+        self.memory.put(key, value)
+        if not self.directory:
+            return
+        path = self._path(key)
+        tmp_path = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(tmp_path, 'w', encoding="utf-8") as file:
+            json.dump(value, file)
+        os.replace(tmp_path, path)
+        with self._lock:
+            self._disk_bytes += path.stat().st_size
+            if self._disk_bytes > self.max_disk_bytes:
+                self._evict()
+
+    def _evict(self):
+        files = sorted(self.directory.glob("*.json"), key=lambda p: p.stat().st_mtime)
+        self._disk_bytes = sum(path.stat().st_size for path in files)
+        # Evict down to 90% of the limit so that a full cache does not evict on every write
+        for path in files:
+            if self._disk_bytes <= 0.9 * self.max_disk_bytes:
+                break
+            size = path.stat().st_size
+            path.unlink(missing_ok=True)
+            self._disk_bytes -= size
+
+    def stats(self) -> dict:
+        memory_stats = self.memory.stats()
+        lookups = memory_stats["hits"] + memory_stats["misses"]
+        # Every disk hit was first counted as a memory miss
+        misses = memory_stats["misses"] - self.disk_hits
+        return {
+            "memory_hits": memory_stats["hits"],
+            "disk_hits": self.disk_hits,
+            "misses": misses,
+            "hit_rate": (lookups - misses) / lookups if lookups else 0.0,
+            "memory_entries": memory_stats["entries"],
+            "disk_bytes": self._disk_bytes,
+        }
@@ -0,0 +1,106 @@
+# cassette.py
+import hashlib
+import json
+import os
+import threading
+from collections import defaultdict
+from pathlib import Path
+from typing import Any, Optional
+
+from langchain_core.caches import BaseCache, RETURN_VAL_TYPE
+from langchain_core.globals import set_llm_cache
+from langchain_core.load import dumps, loads
+
+class CassetteMissError(KeyError):
+    """Raised in replay mode when a request was never recorded."""
+
+class LLMCassette(BaseCache):
+    """
+    Records every chat model response into a JSONL cassette, or replays them without network access.
+    Plugged in as LangChain's global LLM cache, so it covers all ChatOpenAI instances (workflow agents,
+    KnowledgeBaseSystem and RAGSystem) without wrapping any of them.
+    """
+    def __init__(self, path: str, mode: str = "record"):
+        if mode not in ("record", "replay"):
+            raise ValueError(f"Unknown cassette mode: {mode}")
+        self.path = Path(path)
+        self.mode = mode
+        self._lock = threading.Lock()
+        self._recordings = defaultdict(list)
+        self._replay_position = defaultdict(int)
+        if mode == "replay":
+            self._load()
+
+    def _load(self):
+        if not self.path.exists():
+            raise FileNotFoundError(f"Cassette {self.path} does not exist; record it first")
+        with open(self.path, 'r', encoding="utf-8") as file:
+            for line in file:
+                if line.strip():
+                    entry = json.loads(line)
+                    self._recordings[entry["key"]].append(entry["generations"])
+        print(f"Loaded {sum(len(v) for v in self._recordings.values())} recorded LLM responses from {self.path}")
+
+    @staticmethod
+    def _normalize_prompt(node: Any) -> Any:
+        # Message ids are random uuids assigned by the add_messages reducer, so they must not be part of the key
+        if isinstance(node, dict):
+            normalized = {k: LLMCassette._normalize_prompt(v) for k, v in node.items()}
+            if normalized.get("lc") == 1 and isinstance(normalized.get("kwargs"), dict):
+                normalized["kwargs"].pop("id", None)
+            return normalized
+        if isinstance(node, list):
+            return [LLMCassette._normalize_prompt(v) for v in node]
+        return node
+
+    def _key(self, prompt: str, llm_string: str) -> str:
+        try:
+            prompt = json.dumps(self._normalize_prompt(json.loads(prompt)), sort_keys=True)
+        except json.JSONDecodeError:
+            pass
+        return hashlib.sha256(f"{llm_string}\x00{prompt}".encode("utf-8")).hexdigest()
+
+    def lookup(self, prompt: str, llm_string: str) -> Optional[RETURN_VAL_TYPE]:
+        if self.mode == "record":
+            return None
+        key = self._key(prompt, llm_string)
+        with self._lock:
+            recordings = self._recordings.get(key)
+            if not recordings:
+                raise CassetteMissError(f"No recorded response for LLM request {key[:12]} in {self.path}")
+            # Identical requests replay their recorded responses in order; the last one repeats once exhausted
+            position = self._replay_position[key]
+            self._replay_position[key] = position + 1
+        return [loads(generation) for generation in recordings[min(position, len(recordings) - 1)]]
+
+    def update(self, prompt: str, llm_string: str, return_val: RETURN_VAL_TYPE) -> None:
+        if self.mode != "record":
+            return
+        entry = {
+            "key": self._key(prompt, llm_string),
+            "llm_string": llm_string,
+            "prompt": prompt,
+            "generations": [dumps(generation) for generation in return_val],
+        }
+        with self._lock:
+            with open(self.path, 'a', encoding="utf-8") as file:
+                file.write(json.dumps(entry) + "\n")
+
+    def clear(self, **kwargs: Any) -> None:
+        with self._lock:
+            self._recordings.clear()
+            self._replay_position.clear()
+            if self.mode == "record" and self.path.exists():
+                self.path.unlink()
+
+def install_cassette(mode: str, path: str) -> Optional[LLMCassette]:
+    """Install a record/replay cassette as the global LLM cache. mode is 'off', 'record' or 'replay'."""
+    if mode == "off":
+        return None
+    if mode == "replay":
+        # ChatOpenAI refuses to start without a key even though replay never reaches the API
+        os.environ.setdefault("OPENAI_API_KEY", "cassette-replay")
+    cassette = LLMCassette(path, mode)
+    set_llm_cache(cassette)
+    print(f"LLM cassette mode: {mode} ({path})")
+    return cassette
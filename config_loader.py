@@ -25,19 +25,33 @@ def get_config_value(config, section, key, env_var=None, default=None):
         return str(Path(__file__).parent / value)
     return value
 
+def get_optional_value(config, section, key, env_var=None):
+    """Like get_config_value, but None when the key is neither in the environment nor in config.ini."""
+    if env_var and os.getenv(env_var):
+        return os.getenv(env_var)
+    return config.get(section, key, fallback=None)
+
 # Define default paths
 DEFAULT_PATHS = {
     'CHROMA_DB_DIR': 'chroma_db',
     'MRA_DATA_PATH': 'rag/MRA',
     'PD_DATA_PATH': 'rag/PD',
-    'SM_DATA_PATH': 'rag/SM'
+    'SM_DATA_PATH': 'rag/SM',
+    'CHECKPOINT_DB': 'checkpoints.sqlite',
+    'CASSETTE_PATH': 'llm_cassette.jsonl',
+    'RESPONSE_CACHE_DIR': 'response_cache',
+    'CYPHER_CACHE_PATH': 'cypher_cache.jsonl',
+    'KB_QUERY_LOG': 'knowledge_base_queries.jsonl'
 }
 
 # Function to get all necessary config values
 def get_all_config_values(config):
+    cassette_mode = os.getenv('LLM_CASSETTE_MODE') or config.get('LLM_CASSETTE', 'MODE', fallback='off')
+    # Replayed runs never reach the OpenAI or LangSmith APIs, so their keys may be left unset
+    get_key = get_optional_value if cassette_mode == "replay" else get_config_value
     return {
-        'OPENAI_API_KEY': get_config_value(config, 'API_KEYS', 'OPENAI_API_KEY', 'OPENAI_API_KEY'),
-        'LANGCHAIN_API_KEY': get_config_value(config, 'API_KEYS', 'LANGCHAIN_API_KEY', 'LANGCHAIN_API_KEY'),
+        'OPENAI_API_KEY': get_key(config, 'API_KEYS', 'OPENAI_API_KEY', 'OPENAI_API_KEY'),
+        'LANGCHAIN_API_KEY': get_key(config, 'API_KEYS', 'LANGCHAIN_API_KEY', 'LANGCHAIN_API_KEY'),
         'LANGCHAIN_PROJECT': get_config_value(config, 'LANGCHAIN', 'LANGCHAIN_PROJECT'),
         'LANGCHAIN_TRACING_V2': config.getboolean('LANGCHAIN', 'LANGCHAIN_TRACING_V2', fallback=False),
         'OPENAI_MODEL': get_config_value(config, 'MODELS', 'OPENAI_MODEL'),
@@ -45,6 +59,36 @@ def get_all_config_values(config):
         'MRA_DATA_PATH': get_config_value(config, 'PATHS', 'MRA_DATA_PATH', default=DEFAULT_PATHS['MRA_DATA_PATH']),
         'PD_DATA_PATH': get_config_value(config, 'PATHS', 'PD_DATA_PATH', default=DEFAULT_PATHS['PD_DATA_PATH']),
         'SM_DATA_PATH': get_config_value(config, 'PATHS', 'SM_DATA_PATH', default=DEFAULT_PATHS['SM_DATA_PATH']),
+        'CHECKPOINT_DB': get_config_value(config, 'PATHS', 'CHECKPOINT_DB', default=DEFAULT_PATHS['CHECKPOINT_DB']),
+        'CASSETTE_PATH': get_config_value(config, 'PATHS', 'CASSETTE_PATH', default=DEFAULT_PATHS['CASSETTE_PATH']),
+        'CASSETTE_MODE': cassette_mode,
+        'HISTORY_ENABLED': config.getboolean('HISTORY', 'ENABLED', fallback=False),
+        'HISTORY_KEEP_TURNS': config.getint('HISTORY', 'KEEP_TURNS', fallback=2),
+        'HISTORY_TOKEN_BUDGET': config.getint('HISTORY', 'TOKEN_BUDGET', fallback=2000),
+        'RESPONSE_CACHE_ENABLED': config.getboolean('RESPONSE_CACHE', 'ENABLED', fallback=False),
+        'RESPONSE_CACHE_DIR': get_config_value(config, 'PATHS', 'RESPONSE_CACHE_DIR', default=DEFAULT_PATHS['RESPONSE_CACHE_DIR']),
+        'RESPONSE_CACHE_MAX_ENTRIES': config.getint('RESPONSE_CACHE', 'MAX_ENTRIES', fallback=1024),
+        'RESPONSE_CACHE_MAX_DISK_MB': config.getint('RESPONSE_CACHE', 'MAX_DISK_MB', fallback=256),
+        'CYPHER_CACHE_SIZE': config.getint('KNOWLEDGE_BASE', 'CYPHER_CACHE_SIZE', fallback=256),
+        'PERSIST_CYPHER_CACHE': config.getboolean('KNOWLEDGE_BASE', 'PERSIST_CYPHER_CACHE', fallback=False),
+        'CYPHER_CACHE_PATH': get_config_value(config, 'PATHS', 'CYPHER_CACHE_PATH', default=DEFAULT_PATHS['CYPHER_CACHE_PATH']),
+        'KB_RUN_RETENTION_HOURS': config.getfloat('KNOWLEDGE_BASE', 'RUN_RETENTION_HOURS', fallback=24),
+        'KB_QUERY_LOG': get_config_value(config, 'PATHS', 'KB_QUERY_LOG', default=DEFAULT_PATHS['KB_QUERY_LOG']),
+        'KB_QUERY_LOG_MAX_MB': config.getint('KNOWLEDGE_BASE', 'QUERY_LOG_MAX_MB', fallback=10),
+        'KB_QUERY_LOG_BACKUPS': config.getint('KNOWLEDGE_BASE', 'QUERY_LOG_BACKUPS', fallback=5),
+        'PLANNER_DIRECT_MAX_ROWS': config.getint('KNOWLEDGE_BASE', 'PLANNER_DIRECT_MAX_ROWS', fallback=20),
+        'PLANNER_ROW_PENALTY': config.getfloat('KNOWLEDGE_BASE', 'PLANNER_ROW_PENALTY', fallback=1.0),
+        'PLANNER_NUMERIC_PENALTY': config.getfloat('KNOWLEDGE_BASE', 'PLANNER_NUMERIC_PENALTY', fallback=3.0),
+        'KB_CONTEXT_TOKEN_BUDGET': config.getint('KNOWLEDGE_BASE', 'CONTEXT_TOKEN_BUDGET', fallback=1500),
+        'KB_MAX_VALUE_CHARS': config.getint('KNOWLEDGE_BASE', 'MAX_VALUE_CHARS', fallback=300),
+        'CLINGO_MAX_MODELS': config.getint('CLINGO', 'MAX_MODELS', fallback=10),
+        'CLINGO_TIMEOUT_SECONDS': config.getfloat('CLINGO', 'TIMEOUT_SECONDS', fallback=10),
+        'CLINGO_OPTIMAL_ONLY': config.getboolean('CLINGO', 'OPTIMAL_ONLY', fallback=True),
+        'CLINGO_THREADS': config.getint('CLINGO', 'THREADS', fallback=1),
+        'CLINGO_CACHE_SIZE': config.getint('CLINGO', 'CACHE_SIZE', fallback=128),
+        'RAG_GRADING_MODE': config.get('RAG', 'GRADING_MODE', fallback='sequential'),
+        'RAG_GRADING_CONCURRENCY': config.getint('RAG', 'GRADING_CONCURRENCY', fallback=4),
+        'GRAPH_BACKEND': os.getenv('KB_GRAPH_BACKEND') or config.get('KNOWLEDGE_BASE', 'GRAPH_BACKEND', fallback='neo4j'),
         'NEO4J_URL': get_config_value(config, 'NEO4J', 'NEO4J_URL'),
         'NEO4J_USERNAME': get_config_value(config, 'NEO4J', 'NEO4J_USERNAME'),
         'NEO4J_PASSWORD': get_config_value(config, 'NEO4J', 'NEO4J_PASSWORD'),
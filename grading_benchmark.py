@@ -0,0 +1,116 @@
+# grading_benchmark.py
+import argparse
+import itertools
+import json
+import statistics
+import time
+
+from config_loader import load_config, get_all_config_values
+from main import setup_environment
+from rag import GRADING_MODES, RAGSystem
+
+DEFAULT_QUESTIONS = [
+    "What are the main technical risks of adopting quantum computing?",
+    "How mature is the market for edge computing solutions?",
+    "What resources are needed to implement a blockchain platform?",
+    "Which emerging technology offers the fastest return on investment?",
+]
+
+COLLECTIONS = {
+    "MRA": "MRA_DATA_PATH",
+    "PD": "PD_DATA_PATH",
+    "SM": "SM_DATA_PATH",
+}
+
+def _count_agreement(counts, pairs):
+    for left, right in pairs:
+        counts[0] += sum(a == b for a, b in zip(left, right))
+        counts[1] += min(len(left), len(right))
+
+def run_benchmark(rag_system: RAGSystem, questions, collections, modes, repeats: int) -> dict:
+    """
+    Grade the same retrieved documents `repeats` times with every mode. "agreement" compares every repeat of a
+    mode with every sequential repeat; "self_agreement" compares a mode's repeats with each other. The grader
+    samples at the model's default temperature, so the sequential self-agreement is the noise floor that
+    the other modes' agreement should be read against.
+    """
+    latencies = {mode: [] for mode in modes}
+    agreement = {mode: [0, 0] for mode in modes}
+    self_agreement = {mode: [0, 0] for mode in modes}
+    for name, data_path in collections.items():
+        retriever = rag_system.create_vectorstore(data_path, name)
+        for question in questions:
+            docs = retriever.invoke(question)
+            runs = {}
+            for mode in modes:
+                runs[mode] = []
+                for _ in range(repeats):
+                    start = time.perf_counter()
+                    runs[mode].append(rag_system.grade_documents(question, docs, mode=mode))
+                    latencies[mode].append(time.perf_counter() - start)
+            for mode in modes:
+                _count_agreement(self_agreement[mode], itertools.combinations(runs[mode], 2))
+                if mode != "sequential":
+                    _count_agreement(agreement[mode], itertools.product(runs[mode], runs["sequential"]))
+    # Against itself, the sequential grader's agreement is its self-agreement
+    agreement["sequential"] = self_agreement["sequential"]
+    return {
+        mode: {
+            "mean_ms": statistics.mean(latencies[mode]) * 1000 if latencies[mode] else 0.0,
+            "p95_ms": sorted(latencies[mode])[int(0.95 * (len(latencies[mode]) - 1))] * 1000 if latencies[mode] else 0.0,
+            "calls": len(latencies[mode]),
+            "agreement": agreement[mode][0] / agreement[mode][1] if agreement[mode][1] else None,
+            "self_agreement": self_agreement[mode][0] / self_agreement[mode][1] if self_agreement[mode][1] else None,
+        }
+        for mode in modes
+    }
+
+def print_report(results):
+    header = f"{'mode':<12}{'calls':>7}{'mean ms':>10}{'p95 ms':>10}{'vs sequential':>15}{'self':>8}"
+    print(header)
+    print("-" * len(header))
+    for mode, r in results.items():
+        agreement, self_agreement = (f"{r[key]:.1%}" if r[key] is not None else "n/a" for key in ("agreement", "self_agreement"))
+        print(f"{mode:<12}{r['calls']:>7}{r['mean_ms']:>10.1f}{r['p95_ms']:>10.1f}{agreement:>15}{self_agreement:>8}")
+    noise_floor = results.get("sequential", {}).get("self_agreement")
+    if noise_floor is not None:
+        print(f"Noise floor: repeated sequential grading agrees with itself on {noise_floor:.1%} of documents")
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare relevance grading modes of RAGSystem on the agent document collections.")
+    parser.add_argument("--questions", help="File with one question per line (defaults to a built-in set)")
+    parser.add_argument("--collections", nargs="+", choices=list(COLLECTIONS), default=list(COLLECTIONS))
+    parser.add_argument("--modes", nargs="+", choices=GRADING_MODES, default=list(GRADING_MODES))
+    parser.add_argument("--concurrency", type=int, help="Concurrent grader calls (defaults to GRADING_CONCURRENCY)")
+    parser.add_argument("--repeats", type=int, default=3, help="Grading passes per question and mode; 2 or more measure the sequential noise floor")
+    parser.add_argument("--json", help="Also write the raw results to this file")
+    args = parser.parse_args()
+
+    config_values = get_all_config_values(load_config())
+    setup_environment(config_values)
+
+    questions = DEFAULT_QUESTIONS
+    if args.questions:
+        with open(args.questions, encoding="utf-8") as file:
+            questions = [line.strip() for line in file if line.strip()]
+    # Sequential grading is the reference, so it always runs first
+    modes = ["sequential"] + [mode for mode in args.modes if mode != "sequential"]
+
+    rag_system = RAGSystem(
+        chroma_db_dir=config_values['CHROMA_DB_DIR'],
+        mra_data_path=config_values['MRA_DATA_PATH'],
+        pd_data_path=config_values['PD_DATA_PATH'],
+        sm_data_path=config_values['SM_DATA_PATH'],
+        model_name=config_values['OPENAI_MODEL'],
+        grading_concurrency=args.concurrency or config_values['RAG_GRADING_CONCURRENCY']
+    )
+    collections = {name: config_values[COLLECTIONS[name]] for name in args.collections}
+
+    results = run_benchmark(rag_system, questions, collections, modes, args.repeats)
+    print_report(results)
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump(results, file, indent=2)
+
+if __name__ == "__main__":
+    main()
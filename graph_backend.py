@@ -0,0 +1,1343 @@
+# graph_backend.py
+import itertools
+import math
+import re
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import defaultdict
+from decimal import Decimal, ROUND_HALF_EVEN, ROUND_HALF_UP, ROUND_HALF_DOWN, ROUND_CEILING, ROUND_FLOOR, ROUND_UP, ROUND_DOWN
+from typing import Any, Dict, List, Optional
+
+from langchain_community.graphs import Neo4jGraph
+
+# Writes a whole batch of graph documents (source documents, entities, relationships) in a single transaction.
+# Everything is keyed by run_id, so concurrent runs sharing one database never merge into each other's nodes.
+GRAPH_IMPORT_QUERY = """
+UNWIND $documents AS document
+MERGE (d:Document {id: document.id, run_id: $run_id})
+SET d.text = document.text
+WITH d, document
+CALL {
+    WITH d, document
+    UNWIND document.nodes AS node
+    MERGE (n:__Entity__ {id: node.id, run_id: $run_id})
+    SET n += node.properties
+    WITH d, n, node
+    CALL apoc.create.addLabels(n, [node.type]) YIELD node AS labeled
+    MERGE (d)-[:MENTIONS {run_id: $run_id}]->(n)
+    RETURN count(*) AS node_count
+}
+CALL {
+    WITH document
+    UNWIND document.relationships AS rel
+    MATCH (source:__Entity__ {id: rel.source, run_id: $run_id}), (target:__Entity__ {id: rel.target, run_id: $run_id})
+    CALL apoc.merge.relationship(source, rel.type, {run_id: $run_id}, rel.properties, target) YIELD rel AS merged
+    RETURN count(*) AS rel_count
+}
+RETURN sum(node_count) AS nodes, sum(rel_count) AS relationships
+"""
+
+# Labels that are bookkeeping rather than domain schema
+INTERNAL_LABELS = {"__Entity__", "__KBRun__"}
+SCOPED_LABELS = ("__Entity__", "Document")
+
+class GraphBackend(ABC):
+    """
+    Storage used by KnowledgeBaseSystem. Documents are passed in the payload built by
+    KnowledgeBaseSystem._write_graph_documents: {"id", "text", "nodes": [...], "relationships": [...]}.
+    """
+    @abstractmethod
+    def register_run(self, run_id: str):
+        """Record the start time of `run_id`, so expired_runs() can find it later."""
+
+    @abstractmethod
+    def add_graph_documents(self, documents: List[dict], run_id: str):
+        """Merge a batch of document payloads into the scope of `run_id`."""
+
+    @abstractmethod
+    def query(self, query: str, params: Optional[dict] = None) -> List[Dict[str, Any]]:
+        """Run a Cypher query; rows are returned as Neo4jGraph.query returns them."""
+
+    @abstractmethod
+    def get_structured_schema(self) -> dict:
+        """Full schema introspection in Neo4jGraph.get_structured_schema format."""
+
+    @abstractmethod
+    def expired_runs(self, retention_ms: int, exclude_run_id: str) -> List[str]:
+        """Runs registered more than `retention_ms` ago, other than `exclude_run_id`."""
+
+    @abstractmethod
+    def drop_run(self, run_id: str, batch_size: int = 5000):
+        """Delete every node and relationship in the scope of `run_id`."""
+
+    @abstractmethod
+    def delete_unscoped(self, batch_size: int = 5000):
+        """Delete data written without a run_id (by versions that wiped the database instead of scoping runs)."""
+
+    def close(self):
+        """Release connections held by the backend; backends without any keep this no-op."""
+
+class Neo4jBackend(GraphBackend):
+    """Production backend on a Neo4j database with the APOC plugin."""
+    def __init__(self, url: str, username: str, password: str):
+        self.graph = Neo4jGraph(url=url, username=username, password=password)
+
+    def register_run(self, run_id: str):
+        self.graph.query("CREATE INDEX kb_entity_scope IF NOT EXISTS FOR (n:__Entity__) ON (n.run_id, n.id)")
+        self.graph.query("CREATE INDEX kb_document_scope IF NOT EXISTS FOR (n:Document) ON (n.run_id, n.id)")
+        self.graph.query(
+            "MERGE (r:__KBRun__ {run_id: $run_id}) ON CREATE SET r.started_at = timestamp()",
+            {"run_id": run_id}
+        )
+
+    def add_graph_documents(self, documents: List[dict], run_id: str):
+        self.graph.query(GRAPH_IMPORT_QUERY, {"documents": documents, "run_id": run_id})
+
+    def close(self):
+        self.graph._driver.close()
+
+    def query(self, query: str, params: Optional[dict] = None) -> List[Dict[str, Any]]:
+        return self.graph.query(query, params or {})
+
+    def get_structured_schema(self) -> dict:
+        self.graph.refresh_schema()
+        return self.graph.get_structured_schema
+
+    def expired_runs(self, retention_ms: int, exclude_run_id: str) -> List[str]:
+        records = self.graph.query(
+            "MATCH (r:__KBRun__) WHERE r.started_at < timestamp() - $retention_ms AND r.run_id <> $run_id RETURN r.run_id AS run_id",
+            {"retention_ms": retention_ms, "run_id": exclude_run_id}
+        )
+        return [record["run_id"] for record in records]
+
+    def _delete_in_batches(self, match: str, params: dict, batch_size: int):
+        while self.graph.query(
+            f"{match} WITH n LIMIT $batch_size DETACH DELETE n RETURN count(*) AS deleted",
+            {**params, "batch_size": batch_size}
+        )[0]["deleted"]:
+            pass
+
+    def drop_run(self, run_id: str, batch_size: int = 5000):
+        for label in SCOPED_LABELS:
+            self._delete_in_batches(f"MATCH (n:{label} {{run_id: $run_id}})", {"run_id": run_id}, batch_size)
+        self.graph.query("MATCH (r:__KBRun__ {run_id: $run_id}) DELETE r", {"run_id": run_id})
+
+    def delete_unscoped(self, batch_size: int = 5000):
+        for label in SCOPED_LABELS:
+            self._delete_in_batches(f"MATCH (n:{label}) WHERE n.run_id IS NULL", {}, batch_size)
+
+class CypherError(ValueError):
+    """Raised for Cypher outside the subset supported by InMemoryGraphBackend."""
+
+class _Node:
+    __slots__ = ("id", "labels", "properties")
+
+    def __init__(self, node_id: int, labels: set, properties: dict):
+        self.id = node_id
+        self.labels = labels
+        self.properties = properties
+
+class _Relationship:
+    __slots__ = ("id", "type", "start", "end", "properties")
+
+    def __init__(self, rel_id: int, rel_type: str, start: _Node, end: _Node, properties: dict):
+        self.id = rel_id
+        self.type = rel_type
+        self.start = start
+        self.end = end
+        self.properties = properties
+
+class _Path:
+    """A matched path: its start node and the relationships walked from it, in order."""
+    __slots__ = ("start", "relationships")
+
+    def __init__(self, start: _Node, relationships: List[_Relationship]):
+        self.start = start
+        self.relationships = relationships
+
+    @property
+    def nodes(self) -> List[_Node]:
+        nodes = [self.start]
+        for rel in self.relationships:
+            nodes.append(rel.end if rel.start is nodes[-1] else rel.start)
+        return nodes
+
+class InMemoryGraphBackend(GraphBackend):
+    """
+    Pure-Python graph for tests, benchmarks and single-process runs. Nodes are indexed by label and by
+    (run_id, id), relationships by type and by start/end node and type, and queries are answered by a small
+    interpreter for the read-only Cypher subset that Cypher generation produces (MATCH, OPTIONAL MATCH,
+    WHERE, WITH, UNWIND, RETURN with aggregation, ORDER BY, SKIP and LIMIT, path variables and pattern
+    predicates).
+    """
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._ids = itertools.count()
+        self.nodes: Dict[int, _Node] = {}
+        self.relationships: Dict[int, _Relationship] = {}
+        self.nodes_by_label = defaultdict(set)
+        self.nodes_by_key = {}
+        self.relationships_by_type = defaultdict(set)
+        # node id -> relationship type -> relationship ids
+        self.outgoing = defaultdict(lambda: defaultdict(set))
+        self.incoming = defaultdict(lambda: defaultdict(set))
+        self.runs = {}
+
+    # --- writes -----------------------------------------------------------------------------------------
+
+    def register_run(self, run_id: str):
+        with self._lock:
+            self.runs.setdefault(run_id, time.time() * 1000)
+
+    def _merge_node(self, labels: set, node_id: str, run_id: str, properties: dict) -> _Node:
+        key = (frozenset(labels & {"Document", "__Entity__"}), run_id, node_id)
+        node = self.nodes_by_key.get(key)
+        if node is None:
+            node = _Node(next(self._ids), set(), {"id": node_id, "run_id": run_id})
+            self.nodes[node.id] = node
+            self.nodes_by_key[key] = node
+        node.properties.update(properties)
+        for label in labels - node.labels:
+            node.labels.add(label)
+            self.nodes_by_label[label].add(node.id)
+        return node
+
+    def _merge_relationship(self, start: _Node, rel_type: str, end: _Node, run_id: str, properties: dict):
+        for rel_id in self.outgoing[start.id][rel_type]:
+            rel = self.relationships[rel_id]
+            if rel.end is end:
+                rel.properties.update(properties)
+                return rel
+        rel = _Relationship(next(self._ids), rel_type, start, end, {"run_id": run_id, **properties})
+        self.relationships[rel.id] = rel
+        self.relationships_by_type[rel_type].add(rel.id)
+        self.outgoing[start.id][rel_type].add(rel.id)
+        self.incoming[end.id][rel_type].add(rel.id)
+        return rel
+
+    def add_graph_documents(self, documents: List[dict], run_id: str):
+        with self._lock:
+            for document in documents:
+                source = self._merge_node({"Document"}, document["id"], run_id, {"text": document["text"]})
+                for node in document["nodes"]:
+                    entity = self._merge_node({"__Entity__", node["type"]}, node["id"], run_id, node["properties"])
+                    self._merge_relationship(source, "MENTIONS", entity, run_id, {})
+                for rel in document["relationships"]:
+                    start = self.nodes_by_key.get((frozenset({"__Entity__"}), run_id, rel["source"]))
+                    end = self.nodes_by_key.get((frozenset({"__Entity__"}), run_id, rel["target"]))
+                    if start is not None and end is not None:
+                        self._merge_relationship(start, rel["type"], end, run_id, rel["properties"])
+
+    def _delete_node(self, node: _Node):
+        adjacent = [rel_id for index in (self.outgoing, self.incoming) for ids in index.pop(node.id, {}).values() for rel_id in ids]
+        for rel_id in adjacent:
+            rel = self.relationships.pop(rel_id, None)
+            if rel is None:
+                continue
+            self.relationships_by_type[rel.type].discard(rel_id)
+            if rel.start.id in self.outgoing:
+                self.outgoing[rel.start.id][rel.type].discard(rel_id)
+            if rel.end.id in self.incoming:
+                self.incoming[rel.end.id][rel.type].discard(rel_id)
+        for label in node.labels:
+            self.nodes_by_label[label].discard(node.id)
+        self.nodes_by_key.pop((frozenset(node.labels & {"Document", "__Entity__"}), node.properties.get("run_id"), node.properties.get("id")), None)
+        del self.nodes[node.id]
+
+    def expired_runs(self, retention_ms: int, exclude_run_id: str) -> List[str]:
+        cutoff = time.time() * 1000 - retention_ms
+        with self._lock:
+            return [run_id for run_id, started_at in self.runs.items() if started_at < cutoff and run_id != exclude_run_id]
+
+    def drop_run(self, run_id: str, batch_size: int = 5000):
+        with self._lock:
+            for node in [n for n in self.nodes.values() if n.properties.get("run_id") == run_id]:
+                self._delete_node(node)
+            self.runs.pop(run_id, None)
+
+    def delete_unscoped(self, batch_size: int = 5000):
+        with self._lock:
+            for node in [n for n in self.nodes.values() if n.properties.get("run_id") is None]:
+                self._delete_node(node)
+
+    # --- schema -----------------------------------------------------------------------------------------
+
+    @staticmethod
+    def _type_name(value) -> str:
+        if isinstance(value, bool):
+            return "BOOLEAN"
+        if isinstance(value, int):
+            return "INTEGER"
+        if isinstance(value, float):
+            return "FLOAT"
+        if isinstance(value, list):
+            return "LIST"
+        return "STRING"
+
+    def get_structured_schema(self) -> dict:
+        node_props = defaultdict(dict)
+        rel_props = defaultdict(dict)
+        relationships = set()
+        with self._lock:
+            for node in self.nodes.values():
+                for label in node.labels - INTERNAL_LABELS:
+                    for key, value in node.properties.items():
+                        node_props[label].setdefault(key, self._type_name(value))
+            for rel in self.relationships.values():
+                for key, value in rel.properties.items():
+                    rel_props[rel.type].setdefault(key, self._type_name(value))
+                for start in rel.start.labels - INTERNAL_LABELS:
+                    for end in rel.end.labels - INTERNAL_LABELS:
+                        relationships.add((start, rel.type, end))
+        return {
+            "node_props": {label: [{"property": k, "type": t} for k, t in props.items()] for label, props in node_props.items()},
+            "rel_props": {rel_type: [{"property": k, "type": t} for k, t in props.items()] for rel_type, props in rel_props.items()},
+            "relationships": [{"start": s, "type": t, "end": e} for s, t, e in sorted(relationships)],
+            "metadata": {"constraint": [], "index": []},
+        }
+
+    # --- queries ----------------------------------------------------------------------------------------
+
+    def query(self, query: str, params: Optional[dict] = None) -> List[Dict[str, Any]]:
+        clauses = _CypherParser(query).parse()
+        with self._lock:
+            return _CypherExecutor(self, params or {}).run(clauses)
+
+# --- Cypher subset: tokenizer ---------------------------------------------------------------------------
+
+_TOKEN = re.compile(r"""
+    (?P<ws>\s+|//[^\n]*)
+  | (?P<string>'(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*")
+  | (?P<name>`[^`]+`)
+  | (?P<number>\d+\.\d+|\d+)
+  | (?P<param>\$\w+)
+  | (?P<word>[A-Za-z_]\w*)
+  | (?P<op>->|<-|<>|<=|>=|=~|\.\.|[()\[\]{}:,.\-+*/%=<>|;^])
+""", re.VERBOSE)
+
+_ESCAPES = {"n": "\n", "t": "\t", "r": "\r", "\\": "\\", "'": "'", '"': '"'}
+
+def _tokenize(query: str):
+    tokens = []
+    position = 0
+    while position < len(query):
+        match = _TOKEN.match(query, position)
+        if not match:
+            raise CypherError(f"Unexpected character {query[position]!r} at {position}")
+        kind = match.lastgroup
+        text = match.group(kind)
+        if kind == "string":
+            value = re.sub(r"\\(.)", lambda m: _ESCAPES.get(m.group(1), m.group(1)), text[1:-1])
+            tokens.append(("string", value, match.start(), match.end()))
+        elif kind == "name":
+            tokens.append(("name", text[1:-1], match.start(), match.end()))
+        elif kind == "number":
+            tokens.append(("number", float(text) if "." in text else int(text), match.start(), match.end()))
+        elif kind == "param":
+            tokens.append(("param", text[1:], match.start(), match.end()))
+        elif kind == "word":
+            tokens.append(("name", text, match.start(), match.end()))
+        elif kind == "op":
+            tokens.append(("op", text, match.start(), match.end()))
+        position = match.end()
+    tokens.append(("eof", None, len(query), len(query)))
+    return tokens
+
+AGGREGATES = {"count", "collect", "sum", "avg", "min", "max"}
+
+# Modes of round(value, precision, mode); with a precision Neo4j defaults to HALF_UP (half away from zero)
+ROUNDING_MODES = {
+    "HALF_UP": ROUND_HALF_UP,
+    "HALF_DOWN": ROUND_HALF_DOWN,
+    "HALF_EVEN": ROUND_HALF_EVEN,
+    "CEILING": ROUND_CEILING,
+    "FLOOR": ROUND_FLOOR,
+    "UP": ROUND_UP,
+    "DOWN": ROUND_DOWN,
+}
+
+# --- Cypher subset: parser ------------------------------------------------------------------------------
+
+class _CypherParser:
+    """Recursive descent parser producing clauses as tuples; expressions are nested tuples tagged by kind."""
+    def __init__(self, query: str):
+        self.query = query
+        self.tokens = _tokenize(query)
+        self.position = 0
+
+    # token helpers
+    def _peek(self, offset: int = 0):
+        return self.tokens[min(self.position + offset, len(self.tokens) - 1)]
+
+    def _is_keyword(self, *words, offset: int = 0) -> bool:
+        kind, value, _, _ = self._peek(offset)
+        return kind == "name" and value.upper() in words
+
+    def _is_op(self, *ops, offset: int = 0) -> bool:
+        kind, value, _, _ = self._peek(offset)
+        return kind == "op" and value in ops
+
+    def _advance(self):
+        token = self.tokens[self.position]
+        self.position += 1
+        return token
+
+    def _expect_keyword(self, word: str):
+        if not self._is_keyword(word):
+            raise CypherError(f"Expected {word} at {self._peek()[2]}")
+        return self._advance()
+
+    def _expect_op(self, op: str):
+        if not self._is_op(op):
+            raise CypherError(f"Expected '{op}' at {self._peek()[2]}, found {self._peek()[1]!r}")
+        return self._advance()
+
+    def _name(self) -> str:
+        kind, value, start, _ = self._advance()
+        if kind != "name":
+            raise CypherError(f"Expected a name at {start}")
+        return value
+
+    # clauses
+    def parse(self):
+        clauses = []
+        while self._peek()[0] != "eof":
+            if self._is_op(";"):
+                self._advance()
+            elif self._is_keyword("OPTIONAL"):
+                self._advance()
+                self._expect_keyword("MATCH")
+                clauses.append(self._match(optional=True))
+            elif self._is_keyword("MATCH"):
+                self._advance()
+                clauses.append(self._match(optional=False))
+            elif self._is_keyword("WHERE"):
+                # A WHERE directly after a clause that does not own one (e.g. UNWIND) acts as a filter
+                self._advance()
+                clauses.append(("filter", self._expression()))
+            elif self._is_keyword("UNWIND"):
+                self._advance()
+                expression = self._expression()
+                self._expect_keyword("AS")
+                clauses.append(("unwind", expression, self._name()))
+            elif self._is_keyword("WITH"):
+                self._advance()
+                clauses.append(self._projection("with"))
+            elif self._is_keyword("RETURN"):
+                self._advance()
+                clauses.append(self._projection("return"))
+            else:
+                kind, value, start, _ = self._peek()
+                raise CypherError(f"Unsupported Cypher clause {value!r} at {start}; the in-memory graph is read-only")
+        if not clauses or clauses[-1][0] != "return":
+            raise CypherError("Query must end with RETURN")
+        return clauses
+
+    def _match(self, optional: bool):
+        patterns = [self._pattern()]
+        while self._is_op(","):
+            self._advance()
+            patterns.append(self._pattern())
+        where = None
+        if self._is_keyword("WHERE"):
+            self._advance()
+            where = self._expression()
+        return ("match", optional, patterns, where)
+
+    def _pattern(self):
+        """A comma-separated MATCH part: (path variable or None, [node, rel, node, ...])."""
+        path_variable = None
+        if self._peek()[0] == "name" and self._is_op("=", offset=1):
+            path_variable = self._name()
+            self._advance()
+        if self._is_keyword("SHORTESTPATH", "ALLSHORTESTPATHS"):
+            raise CypherError(f"{self._peek()[1]}() is not supported by the in-memory graph")
+        return (path_variable, self._pattern_elements())
+
+    def _pattern_elements(self):
+        elements = [self._node_pattern()]
+        while self._is_op("-", "<-"):
+            rel = self._rel_pattern()
+            elements.append(rel)
+            elements.append(self._node_pattern())
+        return elements
+
+    def _try_relationship_pattern(self):
+        """Parse a pattern predicate such as (a)-[:R]->() if one starts here; otherwise leave the position unchanged."""
+        saved = self.position
+        try:
+            elements = self._pattern_elements()
+            if len(elements) > 1:
+                return elements
+        except CypherError:
+            pass
+        self.position = saved
+        return None
+
+    def _exists_subquery(self):
+        # EXISTS { [MATCH] pattern, ... [WHERE condition] }
+        self._expect_op("{")
+        if self._is_keyword("MATCH"):
+            self._advance()
+        patterns = [self._pattern()]
+        while self._is_op(","):
+            self._advance()
+            patterns.append(self._pattern())
+        where = None
+        if self._is_keyword("WHERE"):
+            self._advance()
+            where = self._expression()
+        self._expect_op("}")
+        return ("exists", patterns, where)
+
+    def _labels(self):
+        labels = []
+        while self._is_op(":"):
+            self._advance()
+            labels.append(self._name())
+        return labels
+
+    def _properties(self):
+        if not self._is_op("{"):
+            return None
+        return self._map_literal()
+
+    def _node_pattern(self):
+        self._expect_op("(")
+        variable = None
+        if self._peek()[0] == "name":
+            variable = self._name()
+        labels = self._labels()
+        properties = self._properties()
+        self._expect_op(")")
+        return ("node", variable, labels, properties)
+
+    def _rel_pattern(self):
+        incoming = False
+        if self._is_op("<-"):
+            self._advance()
+            incoming = True
+        else:
+            self._expect_op("-")
+        variable, types, properties, length = None, [], None, None
+        if self._is_op("["):
+            self._advance()
+            if self._peek()[0] == "name":
+                variable = self._name()
+            if self._is_op(":"):
+                self._advance()
+                types.append(self._name())
+                while self._is_op("|"):
+                    self._advance()
+                    if self._is_op(":"):
+                        self._advance()
+                    types.append(self._name())
+            if self._is_op("*"):
+                self._advance()
+                length = self._length()
+            properties = self._properties()
+            self._expect_op("]")
+        outgoing = False
+        if self._is_op("->"):
+            self._advance()
+            outgoing = True
+        else:
+            self._expect_op("-")
+        if incoming and outgoing:
+            raise CypherError("Relationship cannot point both ways")
+        direction = "in" if incoming else "out" if outgoing else "both"
+        return ("rel", variable, types, properties, direction, length)
+
+    def _length(self):
+        minimum, maximum = 1, None
+        if self._peek()[0] == "number":
+            minimum = maximum = self._advance()[1]
+        if self._is_op(".."):
+            self._advance()
+            maximum = self._advance()[1] if self._peek()[0] == "number" else None
+        return (minimum, maximum)
+
+    def _projection(self, kind: str):
+        distinct = False
+        if self._is_keyword("DISTINCT"):
+            self._advance()
+            distinct = True
+        items = []
+        if self._is_op("*"):
+            self._advance()
+            items.append(("*", None))
+        else:
+            items.append(self._projection_item())
+        while self._is_op(","):
+            self._advance()
+            items.append(self._projection_item())
+        order_by, skip, limit, where = [], None, None, None
+        if self._is_keyword("ORDER"):
+            self._advance()
+            self._expect_keyword("BY")
+            order_by.append(self._sort_item())
+            while self._is_op(","):
+                self._advance()
+                order_by.append(self._sort_item())
+        if self._is_keyword("SKIP"):
+            self._advance()
+            skip = self._expression()
+        if self._is_keyword("LIMIT"):
+            self._advance()
+            limit = self._expression()
+        if kind == "with" and self._is_keyword("WHERE"):
+            self._advance()
+            where = self._expression()
+        return (kind, distinct, items, order_by, skip, limit, where)
+
+    def _projection_item(self):
+        start = self._peek()[2]
+        expression = self._expression()
+        end = self.tokens[self.position - 1][3]
+        if self._is_keyword("AS"):
+            self._advance()
+            return (expression, self._name())
+        # Unaliased columns are named after their source text, as in Neo4j
+        return (expression, self.query[start:end].strip())
+
+    def _sort_item(self):
+        expression = self._expression()
+        descending = False
+        if self._is_keyword("DESC", "DESCENDING"):
+            self._advance()
+            descending = True
+        elif self._is_keyword("ASC", "ASCENDING"):
+            self._advance()
+        return (expression, descending)
+
+    # expressions, lowest precedence first
+    def _expression(self):
+        return self._or()
+
+    def _or(self):
+        left = self._xor()
+        while self._is_keyword("OR"):
+            self._advance()
+            left = ("or", left, self._xor())
+        return left
+
+    def _xor(self):
+        left = self._and()
+        while self._is_keyword("XOR"):
+            self._advance()
+            left = ("xor", left, self._and())
+        return left
+
+    def _and(self):
+        left = self._not()
+        while self._is_keyword("AND"):
+            self._advance()
+            left = ("and", left, self._not())
+        return left
+
+    def _not(self):
+        if self._is_keyword("NOT"):
+            self._advance()
+            return ("not", self._not())
+        return self._comparison()
+
+    def _comparison(self):
+        left = self._additive()
+        while True:
+            if self._is_op("=", "<>", "<", ">", "<=", ">=", "=~"):
+                op = self._advance()[1]
+                left = ("compare", op, left, self._additive())
+            elif self._is_keyword("IN"):
+                self._advance()
+                left = ("in", left, self._additive())
+            elif self._is_keyword("CONTAINS"):
+                self._advance()
+                left = ("string", "contains", left, self._additive())
+            elif self._is_keyword("STARTS") and self._is_keyword("WITH", offset=1):
+                self._advance()
+                self._advance()
+                left = ("string", "starts", left, self._additive())
+            elif self._is_keyword("ENDS") and self._is_keyword("WITH", offset=1):
+                self._advance()
+                self._advance()
+                left = ("string", "ends", left, self._additive())
+            elif self._is_keyword("IS"):
+                self._advance()
+                negated = False
+                if self._is_keyword("NOT"):
+                    self._advance()
+                    negated = True
+                self._expect_keyword("NULL")
+                left = ("is_null", negated, left)
+            else:
+                return left
+
+    def _additive(self):
+        left = self._multiplicative()
+        while self._is_op("+", "-"):
+            op = self._advance()[1]
+            left = ("arith", op, left, self._multiplicative())
+        return left
+
+    def _multiplicative(self):
+        left = self._power()
+        while self._is_op("*", "/", "%"):
+            op = self._advance()[1]
+            left = ("arith", op, left, self._power())
+        return left
+
+    def _power(self):
+        # As in openCypher, ^ binds tighter than * / % but looser than unary minus, and associates to the left
+        left = self._unary()
+        while self._is_op("^"):
+            self._advance()
+            left = ("arith", "^", left, self._unary())
+        return left
+
+    def _unary(self):
+        if self._is_op("-"):
+            self._advance()
+            return ("negate", self._unary())
+        if self._is_op("+"):
+            self._advance()
+        return self._postfix()
+
+    def _postfix(self):
+        expression = self._atom()
+        while True:
+            if self._is_op("."):
+                self._advance()
+                expression = ("property", expression, self._name())
+            elif self._is_op("["):
+                self._advance()
+                index = self._expression()
+                self._expect_op("]")
+                expression = ("index", expression, index)
+            else:
+                return expression
+
+    def _map_literal(self):
+        self._expect_op("{")
+        entries = []
+        while not self._is_op("}"):
+            key = self._name()
+            self._expect_op(":")
+            entries.append((key, self._expression()))
+            if self._is_op(","):
+                self._advance()
+        self._expect_op("}")
+        return entries
+
+    def _atom(self):
+        kind, value, start, _ = self._peek()
+        if kind in ("string", "number"):
+            self._advance()
+            return ("literal", value)
+        if kind == "param":
+            self._advance()
+            return ("param", value)
+        if self._is_op("("):
+            elements = self._try_relationship_pattern()
+            if elements is not None:
+                return ("exists", [(None, elements)], None)
+            self._advance()
+            expression = self._expression()
+            self._expect_op(")")
+            return expression
+        if self._is_op("["):
+            self._advance()
+            items = []
+            while not self._is_op("]"):
+                items.append(self._expression())
+                if self._is_op(","):
+                    self._advance()
+            self._expect_op("]")
+            return ("list", items)
+        if self._is_op("{"):
+            return ("map", self._map_literal())
+        if kind == "name":
+            upper = value.upper()
+            if upper in ("TRUE", "FALSE"):
+                self._advance()
+                return ("literal", upper == "TRUE")
+            if upper == "NULL":
+                self._advance()
+                return ("literal", None)
+            if upper == "CASE":
+                return self._case()
+            if upper == "EXISTS" and self._is_op("{", offset=1):
+                self._advance()
+                return self._exists_subquery()
+            self._advance()
+            if self._is_op("("):
+                return self._function(value)
+            return ("variable", value)
+        raise CypherError(f"Unexpected {value!r} at {start}")
+
+    def _function(self, name: str):
+        self._expect_op("(")
+        lowered = name.lower()
+        if lowered == "count" and self._is_op("*"):
+            self._advance()
+            self._expect_op(")")
+            return ("aggregate", "count", False, None)
+        distinct = False
+        if self._is_keyword("DISTINCT"):
+            self._advance()
+            distinct = True
+        args = []
+        while not self._is_op(")"):
+            args.append(self._expression())
+            if self._is_op(","):
+                self._advance()
+        self._expect_op(")")
+        if lowered == "exists" and len(args) == 1 and args[0][0] == "exists":
+            # exists((a)-[:R]->()) is the pattern predicate itself
+            return args[0]
+        if lowered in AGGREGATES:
+            if len(args) != 1:
+                raise CypherError(f"{name}() takes exactly one argument")
+            return ("aggregate", lowered, distinct, args[0])
+        return ("call", lowered, args)
+
+    def _case(self):
+        self._expect_keyword("CASE")
+        subject = None
+        if not self._is_keyword("WHEN"):
+            subject = self._expression()
+        branches = []
+        while self._is_keyword("WHEN"):
+            self._advance()
+            condition = self._expression()
+            self._expect_keyword("THEN")
+            branches.append((condition, self._expression()))
+        default = None
+        if self._is_keyword("ELSE"):
+            self._advance()
+            default = self._expression()
+        self._expect_keyword("END")
+        return ("case", subject, branches, default)
+
+# --- Cypher subset: executor ----------------------------------------------------------------------------
+
+def _contains_aggregate(expression) -> bool:
+    if not isinstance(expression, tuple):
+        return False
+    if expression[0] == "aggregate":
+        return True
+    return any(
+        _contains_aggregate(part) or (isinstance(part, list) and any(_contains_aggregate(p) for p in part))
+        for part in expression[1:]
+    )
+
+def _sort_key(value):
+    # Neo4j orders nulls last in ascending order; mixed types are grouped by type name
+    if value is None:
+        return (2, "", 0)
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return (0, "number", value)
+    return (1, type(value).__name__, str(value))
+
+class _CypherExecutor:
+    def __init__(self, graph: InMemoryGraphBackend, params: dict):
+        self.graph = graph
+        self.params = params
+
+    def run(self, clauses) -> List[Dict[str, Any]]:
+        rows = [{}]
+        for clause in clauses:
+            kind = clause[0]
+            if kind == "match":
+                rows = self._match(rows, *clause[1:])
+            elif kind == "filter":
+                rows = [row for row in rows if self._evaluate(clause[1], row) is True]
+            elif kind == "unwind":
+                rows = [
+                    {**row, clause[2]: item}
+                    for row in rows
+                    for item in (self._evaluate(clause[1], row) or [])
+                ]
+            else:
+                rows = self._project(rows, *clause[1:])
+        return [{key: self._export(value) for key, value in row.items()} for row in rows]
+
+    def _export(self, value):
+        """Convert graph objects to what Neo4jGraph.query returns: nodes as property dicts, relationships as triples."""
+        if isinstance(value, _Node):
+            return dict(value.properties)
+        if isinstance(value, _Relationship):
+            return (dict(value.start.properties), value.type, dict(value.end.properties))
+        if isinstance(value, _Path):
+            # The Neo4j driver exports a path as [start node, type, node, type, ..., end node]
+            exported = [dict(value.start.properties)]
+            for rel, node in zip(value.relationships, value.nodes[1:]):
+                exported.extend([rel.type, dict(node.properties)])
+            return exported
+        if isinstance(value, list):
+            return [self._export(v) for v in value]
+        if isinstance(value, dict):
+            return {k: self._export(v) for k, v in value.items()}
+        return value
+
+    # MATCH
+
+    def _match(self, rows, optional, patterns, where):
+        matched = []
+        for row in rows:
+            extensions = [row]
+            for pattern in patterns:
+                extensions = [extended for partial in extensions for extended in self._match_pattern(pattern, partial)]
+            if where is not None:
+                extensions = [extended for extended in extensions if self._evaluate(where, extended) is True]
+            if extensions:
+                matched.extend(extensions)
+            elif optional:
+                unbound = {
+                    variable
+                    for path_variable, elements in patterns
+                    for variable in [path_variable] + [element[1] for element in elements]
+                    if variable
+                } - set(row)
+                matched.append({**row, **{variable: None for variable in unbound}})
+        return matched
+
+    def _properties_match(self, entity, properties, row) -> bool:
+        if not properties:
+            return True
+        return all(entity.properties.get(key) == self._evaluate(value, row) for key, value in properties)
+
+    def _node_matches(self, node: _Node, pattern, row) -> bool:
+        _, _, labels, properties = pattern
+        return all(label in node.labels for label in labels) and self._properties_match(node, properties, row)
+
+    def _node_candidates(self, pattern, row, rel_pattern=None):
+        _, variable, labels, properties = pattern
+        if variable and variable in row:
+            bound = row[variable]
+            return [bound] if isinstance(bound, _Node) and self._node_matches(bound, pattern, row) else []
+        property_map = {key: self._evaluate(value, row) for key, value in properties or []}
+        # Scoped entity lookups by id hit the (run_id, id) index directly
+        if "id" in property_map and "run_id" in property_map:
+            candidates = [
+                node for label_set in (frozenset({"__Entity__"}), frozenset({"Document"}))
+                if (node := self.graph.nodes_by_key.get((label_set, property_map["run_id"], property_map["id"]))) is not None
+            ]
+            return [node for node in candidates if self._node_matches(node, pattern, row)]
+        candidate_ids = None
+        if labels:
+            candidate_ids = min((self.graph.nodes_by_label.get(label, set()) for label in labels), key=len)
+        # A typed first hop limits the start to endpoints of relationships of those types
+        if rel_pattern is not None and rel_pattern[2] and (rel_pattern[5] is None or rel_pattern[5][0] >= 1):
+            endpoint_ids = self._endpoints(rel_pattern)
+            if candidate_ids is None or len(endpoint_ids) < len(candidate_ids):
+                candidate_ids = endpoint_ids
+        if candidate_ids is None:
+            candidates = list(self.graph.nodes.values())
+        else:
+            candidates = [self.graph.nodes[node_id] for node_id in candidate_ids]
+        return [node for node in candidates if self._node_matches(node, pattern, row)]
+
+    def _endpoints(self, rel_pattern) -> set:
+        """Ids of the nodes a relationship pattern can start from, looked up in the relationship type index."""
+        _, _, types, _, direction, _ = rel_pattern
+        sides = {"out": ("start",), "in": ("end",), "both": ("start", "end")}[direction]
+        endpoint_ids = set()
+        for rel_type in types:
+            for rel_id in self.graph.relationships_by_type.get(rel_type, ()):
+                rel = self.graph.relationships[rel_id]
+                endpoint_ids.update(getattr(rel, side).id for side in sides)
+        return endpoint_ids
+
+    def _adjacent(self, index, node: _Node, types):
+        by_type = index.get(node.id)
+        if not by_type:
+            return []
+        if types:
+            return [rel_id for rel_type in types for rel_id in by_type.get(rel_type, ())]
+        return [rel_id for rel_ids in by_type.values() for rel_id in rel_ids]
+
+    def _expand(self, node: _Node, rel_pattern, row):
+        """Yield (relationship, neighbour) pairs for a single hop."""
+        _, _, types, properties, direction, _ = rel_pattern
+        hops = []
+        if direction in ("out", "both"):
+            hops.extend((self.graph.relationships[rel_id], "end") for rel_id in self._adjacent(self.graph.outgoing, node, types))
+        if direction in ("in", "both"):
+            hops.extend((self.graph.relationships[rel_id], "start") for rel_id in self._adjacent(self.graph.incoming, node, types))
+        for rel, side in hops:
+            if not self._properties_match(rel, properties, row):
+                continue
+            yield rel, getattr(rel, side)
+
+    def _paths(self, node: _Node, rel_pattern, row, used: set):
+        """Yield (relationships, end node) for a (possibly variable-length) relationship pattern."""
+        length = rel_pattern[5]
+        if length is None:
+            for rel, neighbour in self._expand(node, rel_pattern, row):
+                if rel.id not in used:
+                    yield [rel], neighbour
+            return
+        minimum, maximum = length
+        maximum = 10 if maximum is None else maximum
+        if minimum == 0:
+            yield [], node
+        stack = [(node, [])]
+        while stack:
+            current, path = stack.pop()
+            if len(path) >= maximum:
+                continue
+            for rel, neighbour in self._expand(current, rel_pattern, row):
+                if rel.id in used or any(r.id == rel.id for r in path):
+                    continue
+                extended = path + [rel]
+                if len(extended) >= max(minimum, 1):
+                    yield extended, neighbour
+                stack.append((neighbour, extended))
+
+    def _match_pattern(self, pattern, row):
+        path_variable, elements = pattern
+        matched = []
+        first = elements[0]
+        for start in self._node_candidates(first, row, elements[1] if len(elements) > 1 else None):
+            bound = dict(row)
+            if first[1]:
+                bound[first[1]] = start
+            results = []
+            self._extend_chain(elements, 1, start, bound, set(), results, [])
+            for result, walked in results:
+                if path_variable:
+                    result[path_variable] = _Path(start, walked)
+                matched.append(result)
+        return matched
+
+    def _extend_chain(self, pattern, index, current, row, used, results, walked):
+        if index >= len(pattern):
+            results.append((row, walked))
+            return
+        rel_pattern, node_pattern = pattern[index], pattern[index + 1]
+        rel_variable, node_variable = rel_pattern[1], node_pattern[1]
+        for rels, neighbour in self._paths(current, rel_pattern, row, used):
+            if node_variable and node_variable in row and row[node_variable] is not neighbour:
+                continue
+            if not self._node_matches(neighbour, node_pattern, row):
+                continue
+            rel_value = rels if rel_pattern[5] is not None else rels[0]
+            if rel_variable and rel_variable in row and row[rel_variable] is not rel_value and row[rel_variable] != rel_value:
+                continue
+            extended = dict(row)
+            if rel_variable:
+                extended[rel_variable] = rel_value
+            if node_variable:
+                extended[node_variable] = neighbour
+            self._extend_chain(pattern, index + 2, neighbour, extended, used | {rel.id for rel in rels}, results, walked + rels)
+
+    # WITH / RETURN
+
+    def _project(self, rows, distinct, items, order_by, skip, limit, where):
+        if items == [("*", None)]:
+            projected = [dict(row) for row in rows]
+            scopes = [dict(row) for row in rows]
+        elif any(_contains_aggregate(expression) for expression, _ in items):
+            projected = self._aggregate(rows, items)
+            scopes = [dict(row) for row in projected]
+        else:
+            projected = [{alias: self._evaluate(expression, row) for expression, alias in items} for row in rows]
+            # ORDER BY may refer to aliases as well as to variables that were not projected
+            scopes = [{**row, **values} for row, values in zip(rows, projected)]
+
+        if distinct:
+            seen = set()
+            unique, unique_scopes = [], []
+            for values, scope in zip(projected, scopes):
+                key = repr([self._export(v) for v in values.values()])
+                if key not in seen:
+                    seen.add(key)
+                    unique.append(values)
+                    unique_scopes.append(scope)
+            projected, scopes = unique, unique_scopes
+
+        if order_by:
+            order = list(range(len(projected)))
+            for expression, descending in reversed(order_by):
+                order.sort(key=lambda i: _sort_key(self._export(self._evaluate(expression, scopes[i]))), reverse=descending)
+            projected = [projected[i] for i in order]
+
+        start = self._evaluate(skip, {}) if skip is not None else 0
+        projected = projected[start:]
+        if limit is not None:
+            projected = projected[: self._evaluate(limit, {})]
+        if where is not None:
+            projected = [row for row in projected if self._evaluate(where, row) is True]
+        return projected
+
+    def _aggregate(self, rows, items):
+        keys = [(expression, alias) for expression, alias in items if not _contains_aggregate(expression)]
+        groups = {}
+        for row in rows:
+            key_values = [self._evaluate(expression, row) for expression, _ in keys]
+            group_key = repr([self._export(v) for v in key_values])
+            groups.setdefault(group_key, (key_values, []))[1].append(row)
+        if not groups and not keys:
+            groups[""] = ([], [])
+        projected = []
+        for key_values, group_rows in groups.values():
+            values = dict(zip((alias for _, alias in keys), key_values))
+            for expression, alias in items:
+                if _contains_aggregate(expression):
+                    values[alias] = self._evaluate(expression, group_rows[0] if group_rows else {}, group_rows)
+            projected.append(values)
+        return projected
+
+    def _aggregate_value(self, name, distinct, argument, group_rows):
+        if argument is None:
+            return len(group_rows)
+        values = [self._evaluate(argument, row) for row in group_rows]
+        values = [v for v in values if v is not None]
+        if distinct:
+            unique, seen = [], set()
+            for value in values:
+                key = repr(self._export(value))
+                if key not in seen:
+                    seen.add(key)
+                    unique.append(value)
+            values = unique
+        if name == "count":
+            return len(values)
+        if name == "collect":
+            return values
+        if not values:
+            return None
+        if name == "sum":
+            return sum(values)
+        if name == "avg":
+            return sum(values) / len(values)
+        if name == "min":
+            return min(values, key=_sort_key)
+        return max(values, key=_sort_key)
+
+    # expressions
+
+    def _evaluate(self, expression, row, group_rows=None):
+        kind = expression[0]
+        if kind == "literal":
+            return expression[1]
+        if kind == "param":
+            if expression[1] not in self.params:
+                raise CypherError(f"Missing parameter ${expression[1]}")
+            return self.params[expression[1]]
+        if kind == "variable":
+            if expression[1] not in row:
+                raise CypherError(f"Variable `{expression[1]}` not defined")
+            return row[expression[1]]
+        if kind == "aggregate":
+            if group_rows is None:
+                raise CypherError("Aggregation is only allowed in WITH and RETURN")
+            return self._aggregate_value(expression[1], expression[2], expression[3], group_rows)
+        if kind == "property":
+            target = self._evaluate(expression[1], row, group_rows)
+            if target is None:
+                return None
+            if isinstance(target, (_Node, _Relationship)):
+                return target.properties.get(expression[2])
+            if isinstance(target, dict):
+                return target.get(expression[2])
+            raise CypherError(f"Cannot read property {expression[2]} of {type(target).__name__}")
+        if kind == "index":
+            target = self._evaluate(expression[1], row, group_rows)
+            index = self._evaluate(expression[2], row, group_rows)
+            if target is None or index is None:
+                return None
+            if isinstance(target, dict):
+                return target.get(index)
+            return target[index] if -len(target) <= index < len(target) else None
+        if kind == "list":
+            return [self._evaluate(item, row, group_rows) for item in expression[1]]
+        if kind == "map":
+            return {key: self._evaluate(value, row, group_rows) for key, value in expression[1]}
+        if kind == "and":
+            left = self._evaluate(expression[1], row, group_rows)
+            right = self._evaluate(expression[2], row, group_rows)
+            if left is False or right is False:
+                return False
+            return None if left is None or right is None else True
+        if kind == "or":
+            left = self._evaluate(expression[1], row, group_rows)
+            right = self._evaluate(expression[2], row, group_rows)
+            if left is True or right is True:
+                return True
+            return None if left is None or right is None else False
+        if kind == "xor":
+            left = self._evaluate(expression[1], row, group_rows)
+            right = self._evaluate(expression[2], row, group_rows)
+            return None if left is None or right is None else left != right
+        if kind == "not":
+            value = self._evaluate(expression[1], row, group_rows)
+            return None if value is None else not value
+        if kind == "compare":
+            return self._compare(expression[1], self._evaluate(expression[2], row, group_rows), self._evaluate(expression[3], row, group_rows))
+        if kind == "in":
+            value = self._evaluate(expression[1], row, group_rows)
+            container = self._evaluate(expression[2], row, group_rows)
+            if value is None or container is None:
+                return None
+            return any(self._export(value) == self._export(item) for item in container)
+        if kind == "string":
+            left = self._evaluate(expression[2], row, group_rows)
+            right = self._evaluate(expression[3], row, group_rows)
+            if not isinstance(left, str) or not isinstance(right, str):
+                return None
+            return {"contains": right in left, "starts": left.startswith(right), "ends": left.endswith(right)}[expression[1]]
+        if kind == "is_null":
+            value = self._evaluate(expression[2], row, group_rows)
+            return (value is not None) if expression[1] else (value is None)
+        if kind == "arith":
+            return self._arithmetic(expression[1], self._evaluate(expression[2], row, group_rows), self._evaluate(expression[3], row, group_rows))
+        if kind == "negate":
+            value = self._evaluate(expression[1], row, group_rows)
+            return None if value is None else -value
+        if kind == "case":
+            return self._case(expression, row, group_rows)
+        if kind == "exists":
+            return bool(self._match([row], False, expression[1], expression[2]))
+        if kind == "call":
+            return self._call(expression[1], [self._evaluate(arg, row, group_rows) for arg in expression[2]])
+        raise CypherError(f"Unsupported expression {kind}")
+
+    @staticmethod
+    def _compare(op, left, right):
+        if left is None or right is None:
+            return None
+        if op == "=~":
+            return re.fullmatch(right, left) is not None if isinstance(left, str) else None
+        if isinstance(left, (_Node, _Relationship)) or isinstance(right, (_Node, _Relationship)):
+            if op not in ("=", "<>"):
+                return None
+            return (left is right) == (op == "=")
+        if op == "=":
+            return left == right
+        if op == "<>":
+            return left != right
+        numeric = all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in (left, right))
+        if not numeric and type(left) is not type(right):
+            return None
+        return {"<": left < right, ">": left > right, "<=": left <= right, ">=": left >= right}[op]
+
+    @staticmethod
+    def _arithmetic(op, left, right):
+        if left is None or right is None:
+            return None
+        if op == "+":
+            if isinstance(left, list) or isinstance(right, list):
+                return (left if isinstance(left, list) else [left]) + (right if isinstance(right, list) else [right])
+            if isinstance(left, str) or isinstance(right, str):
+                return f"{left}{right}"
+            return left + right
+        if op == "-":
+            return left - right
+        if op == "*":
+            return left * right
+        if op == "/":
+            if isinstance(left, int) and isinstance(right, int):
+                return int(left / right)
+            return left / right
+        if op == "%":
+            return left % right
+        # Exponentiation always yields a float in Cypher
+        return float(left) ** right
+
+    def _case(self, expression, row, group_rows):
+        _, subject, branches, default = expression
+        subject_value = self._evaluate(subject, row, group_rows) if subject is not None else None
+        for condition, result in branches:
+            value = self._evaluate(condition, row, group_rows)
+            if (subject is not None and value == subject_value) or (subject is None and value is True):
+                return self._evaluate(result, row, group_rows)
+        return self._evaluate(default, row, group_rows) if default is not None else None
+
+    def _call(self, name, args):
+        value = args[0] if args else None
+        if name == "coalesce":
+            return next((arg for arg in args if arg is not None), None)
+        if name in ("labels", "type", "id", "elementid", "properties", "keys", "startnode", "endnode", "nodes", "relationships") and value is None:
+            return None
+        if isinstance(value, _Path):
+            if name == "nodes":
+                return value.nodes
+            if name == "relationships":
+                return list(value.relationships)
+            if name == "length":
+                return len(value.relationships)
+            if name in ("startnode", "endnode"):
+                return value.start if name == "startnode" else value.nodes[-1]
+        if name == "labels":
+            return sorted(value.labels)
+        if name == "type":
+            return value.type
+        if name in ("id", "elementid"):
+            return value.id if name == "id" else str(value.id)
+        if name == "properties":
+            return dict(value.properties)
+        if name == "keys":
+            return sorted(value.properties if isinstance(value, (_Node, _Relationship)) else value)
+        if name == "startnode":
+            return value.start
+        if name == "endnode":
+            return value.end
+        if name == "exists":
+            return value is not None
+        if value is None:
+            return None
+        string_functions = {
+            "tolower": lambda: value.lower(),
+            "toupper": lambda: value.upper(),
+            "trim": lambda: value.strip(),
+            "ltrim": lambda: value.lstrip(),
+            "rtrim": lambda: value.rstrip(),
+            "reverse": lambda: value[::-1],
+            "split": lambda: value.split(args[1]),
+            "replace": lambda: value.replace(args[1], args[2]),
+            "substring": lambda: value[args[1]:args[1] + args[2]] if len(args) > 2 else value[args[1]:],
+            "left": lambda: value[:args[1]],
+            "right": lambda: value[-args[1]:] if args[1] else "",
+        }
+        if name in string_functions:
+            return string_functions[name]()
+        if name == "tostring":
+            return str(value).lower() if isinstance(value, bool) else str(value)
+        if name == "tointeger":
+            try:
+                return int(float(value))
+            except (TypeError, ValueError):
+                return None
+        if name == "tofloat":
+            try:
+                return float(value)
+            except (TypeError, ValueError):
+                return None
+        if name in ("size", "length"):
+            return len(value)
+        if name == "head":
+            return value[0] if value else None
+        if name == "last":
+            return value[-1] if value else None
+        if name == "tail":
+            return value[1:]
+        if name == "range":
+            step = args[2] if len(args) > 2 else 1
+            return list(range(args[0], args[1] + (1 if step > 0 else -1), step))
+        if name == "abs":
+            return abs(value)
+        if name == "round":
+            if len(args) == 1:
+                # Neo4j rounds half-way values up (towards positive infinity), not to even
+                return float(math.floor(value + 0.5))
+            mode = ROUNDING_MODES.get(str(args[2]).upper() if len(args) > 2 else "HALF_UP")
+            if mode is None:
+                raise CypherError(f"Unknown rounding mode {args[2]!r}")
+            return float(Decimal(str(value)).quantize(Decimal(1).scaleb(-args[1]), rounding=mode))
+        if name == "ceil":
+            return float(-(-value // 1))
+        if name == "floor":
+            return float(value // 1)
+        raise CypherError(f"Unsupported function {name}()")
@@ -0,0 +1,103 @@
+# history.py
+import threading
+from typing import Sequence, Union
+
+import tiktoken
+from langchain_core.messages import BaseMessage, SystemMessage
+from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.output_parsers import StrOutputParser
+
+from prompts import HISTORY_SUMMARY_PROMPT
+
+# Roughly four characters per token for English text, used when the tiktoken encoding is unavailable
+CHARS_PER_TOKEN = 4
+
+_encoding = None
+_encoding_lock = threading.Lock()
+
+def _get_encoding():
+    """Load cl100k_base on first use: tiktoken downloads it, so importing this module must not need the network."""
+    global _encoding
+    with _encoding_lock:
+        if _encoding is None:
+            try:
+                _encoding = tiktoken.get_encoding("cl100k_base")
+            except Exception as e:
+                print(f"tiktoken encoding unavailable ({type(e).__name__}); estimating {CHARS_PER_TOKEN} characters per token")
+                _encoding = False
+    return _encoding
+
+def _text_tokens(text: str) -> int:
+    encoding = _get_encoding()
+    if encoding:
+        return len(encoding.encode(text))
+    return -(-len(text) // CHARS_PER_TOKEN)
+
+def count_tokens(content: Union[str, Sequence[BaseMessage]]) -> int:
+    """Approximate prompt tokens of a string or a message list (4 tokens of framing per message, as in OpenAI's chat format)."""
+    if isinstance(content, str):
+        return _text_tokens(content)
+    return sum(4 + _text_tokens(str(message.content)) for message in content)
+
+class HistoryPolicy:
+    """
+    Bounds the AgentState.messages history sent to every node. The last `keep_turns` turns (a Router objective
+    plus the Aggregator synthesis) stay verbatim, older turns are folded into a rolling summary, and the verbatim
+    tail is shortened further whenever it exceeds `token_budget`.
+    """
+    def __init__(self, summarizer_llm, keep_turns: int = 2, token_budget: int = 2000, summary_words: int = 250):
+        self.keep_turns = keep_turns
+        self.token_budget = token_budget
+        self.savings = []
+        prompt = ChatPromptTemplate.from_messages([
+            ("system", HISTORY_SUMMARY_PROMPT),
+            ("human", "Existing summary:\n{summary}\n\nNew discussion turns:\n{turns}")
+        ]).partial(max_words=str(summary_words))
+        self.summarizer = prompt | summarizer_llm | StrOutputParser()
+
+    def render(self, state) -> list:
+        """Messages a node should see: the rolling summary followed by the verbatim tail."""
+        messages = list(state["messages"])[state.get("summarized_messages", 0):]
+        if state.get("history_summary"):
+            return [SystemMessage("Summary of the earlier discussion: " + state["history_summary"])] + messages
+        return messages
+
+    def _cutoff(self, state) -> int:
+        messages = list(state["messages"])
+        start = state.get("summarized_messages", 0)
+        cutoff = max(start, len(messages) - 2 * self.keep_turns)
+        # Always keep the newest message verbatim, even if it alone exceeds the budget
+        while cutoff < len(messages) - 1 and count_tokens(messages[cutoff:]) > self.token_budget:
+            cutoff += 1
+        return cutoff
+
+    def _summarizer_input(self, state, cutoff: int) -> dict:
+        folded = list(state["messages"])[state.get("summarized_messages", 0):cutoff]
+        return {
+            "summary": state.get("history_summary") or "(none yet)",
+            "turns": "\n\n".join(f"{message.type}: {message.content}" for message in folded),
+        }
+
+    def _report(self, state, update: dict) -> dict:
+        full_tokens = count_tokens(list(state["messages"]))
+        compacted_tokens = count_tokens(self.render({**state, **update}))
+        self.savings.append({"round": len(self.savings) + 1, "full_tokens": full_tokens, "compacted_tokens": compacted_tokens})
+        print(f"History round {len(self.savings)}: {full_tokens} -> {compacted_tokens} tokens per prompt ({full_tokens - compacted_tokens} saved)")
+        return update
+
+    def compact(self, state) -> dict:
+        """State update folding turns that fell out of the verbatim window into the summary (empty if nothing to fold)."""
+        cutoff = self._cutoff(state)
+        update = {}
+        if cutoff > state.get("summarized_messages", 0):
+            summary = self.summarizer.invoke(self._summarizer_input(state, cutoff))
+            update = {"history_summary": summary, "summarized_messages": cutoff}
+        return self._report(state, update)
+
+    async def acompact(self, state) -> dict:
+        cutoff = self._cutoff(state)
+        update = {}
+        if cutoff > state.get("summarized_messages", 0):
+            summary = await self.summarizer.ainvoke(self._summarizer_input(state, cutoff))
+            update = {"history_summary": summary, "summarized_messages": cutoff}
+        return self._report(state, update)
@@ -1,32 +1,46 @@
 import os
 import argparse
+import sqlite3
 from pathlib import Path
 
 from langchain_core.messages import HumanMessage
 from langchain_openai import ChatOpenAI
 from langchain_core.output_parsers.openai_functions import JsonOutputFunctionsParser
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+from langchain_core.runnables import RunnableLambda
 from langgraph.graph import END, StateGraph, START
+from langgraph.checkpoint.sqlite import SqliteSaver
+from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
 
 from agents import AgentState, Agent, Aggregator, Router, Critic
 from config_loader import load_config, get_all_config_values
+from cassette import install_cassette
+from history import HistoryPolicy
+from cache import ResponseCache
 from rag import RAGSystem, create_rag_tool
-from tools import KnowledgeBaseSystem, create_kb_tool
+from tools import KnowledgeBaseSystem, QueryPlanner, create_kb_tool
+from graph_backend import InMemoryGraphBackend
+from asp import ASPSession
 from prompts import AGGREGATOR_PROMPT, AGENT1_PROMPT, AGENT2_PROMPT, AGENT3_PROMPT , ROUTER_PROMPT, CRITIC_PROMPT, AGGREGATOR_NO_TOM, AGENT1_NO_TOM, AGENT2_NO_TOM, AGENT3_NO_TOM, ROUTER_NO_TOM, CRITIC_NO_TOM, AGENT1_NO_TOM_NO_CRITIC, AGENT2_NO_TOM_NO_CRITIC, AGENT3_NO_TOM_NO_CRITIC, AGGREGATOR_NO_TOM_NO_CRITIC, ROUTER_NO_TOM_NO_CRITIC, AGENT1_NO_CRITIC, AGENT2_NO_CRITIC, AGENT3_NO_CRITIC, AGGREGATOR_NO_CRITIC, ROUTER_NO_CRITIC
 
 from langchain_core.tools import tool
 
 class WorkflowManager:
-    def __init__(self, config):
-        self.use_ToM = True
-        self.use_critic = True
+    def __init__(self, config, use_ToM=True, use_critic=True, parallel_agents=True):
+        self.use_ToM = use_ToM
+        self.use_critic = use_critic
+        # Run the active agents concurrently (False keeps the original agent1 -> agent2 -> agent3 chain)
+        self.parallel_agents = parallel_agents
         self.config = config
         self.agent_llm = self._setup_agent_llm()
         self.advanced_llm = self._setup_advanced_llm()
         self.kb_system = self._setup_kb_system()
+        self.history_policy = self._setup_history_policy()
+        self.response_cache = self._setup_response_cache()
         # self.rag_system = self._setup_rag_system()
         # self.toolbox = self._setup_toolbox()
-        self.workflow = self._setup_workflow()
+        self.graph_builder = self._setup_workflow()
+        self.workflow = self.graph_builder.compile()
 
     def _setup_agent_llm(self):
         return ChatOpenAI(model='gpt-4o-mini')
@@ -38,7 +52,47 @@ class WorkflowManager:
         return KnowledgeBaseSystem(
             neo4j_url=self.config['NEO4J_URL'],
             neo4j_username=self.config['NEO4J_USERNAME'],
-            neo4j_password=self.config['NEO4J_PASSWORD']
+            neo4j_password=self.config['NEO4J_PASSWORD'],
+            cypher_cache_size=self.config['CYPHER_CACHE_SIZE'],
+            cypher_cache_path=self.config['CYPHER_CACHE_PATH'] if self.config['PERSIST_CYPHER_CACHE'] else None,
+            run_retention_hours=self.config['KB_RUN_RETENTION_HOURS'],
+            backend=InMemoryGraphBackend() if self.config['GRAPH_BACKEND'].lower() == 'memory' else None,
+            asp_session=ASPSession(
+                max_models=self.config['CLINGO_MAX_MODELS'],
+                timeout=self.config['CLINGO_TIMEOUT_SECONDS'],
+                optimal_only=self.config['CLINGO_OPTIMAL_ONLY'],
+                threads=self.config['CLINGO_THREADS']
+            ),
+            planner=QueryPlanner(
+                direct_max_rows=self.config['PLANNER_DIRECT_MAX_ROWS'],
+                row_penalty=self.config['PLANNER_ROW_PENALTY'],
+                numeric_penalty=self.config['PLANNER_NUMERIC_PENALTY']
+            ),
+            context_token_budget=self.config['KB_CONTEXT_TOKEN_BUDGET'],
+            max_value_chars=self.config['KB_MAX_VALUE_CHARS'],
+            asp_cache_size=self.config['CLINGO_CACHE_SIZE'],
+            query_log_path=self.config['KB_QUERY_LOG'],
+            query_log_max_bytes=self.config['KB_QUERY_LOG_MAX_MB'] * 1024 * 1024,
+            query_log_backups=self.config['KB_QUERY_LOG_BACKUPS']
+        )
+
+    def _setup_history_policy(self):
+        if not self.config.get('HISTORY_ENABLED', False):
+            return None
+        return HistoryPolicy(
+            self.agent_llm,
+            keep_turns=self.config['HISTORY_KEEP_TURNS'],
+            token_budget=self.config['HISTORY_TOKEN_BUDGET']
+        )
+
+    def _setup_response_cache(self):
+        # Disable for stochastic experiments: identical prompts would otherwise get identical answers
+        if not self.config.get('RESPONSE_CACHE_ENABLED', False):
+            return None
+        return ResponseCache(
+            self.config['RESPONSE_CACHE_DIR'],
+            max_entries=self.config['RESPONSE_CACHE_MAX_ENTRIES'],
+            max_disk_bytes=self.config['RESPONSE_CACHE_MAX_DISK_MB'] * 2**20
         )
 
     # def _setup_rag_system(self):
@@ -47,7 +101,9 @@ class WorkflowManager:
     #         mra_data_path=self.config['MRA_DATA_PATH'],
     #         pd_data_path=self.config['PD_DATA_PATH'],
     #         sm_data_path=self.config['SM_DATA_PATH'],
-    #         model_name=self.config['OPENAI_MODEL']
+    #         model_name=self.config['OPENAI_MODEL'],
+    #         grading_mode=self.config['RAG_GRADING_MODE'],
+    #         grading_concurrency=self.config['RAG_GRADING_CONCURRENCY']
     #     )
 
     # def _setup_toolbox(self):
@@ -81,8 +137,18 @@ class WorkflowManager:
             return "agent3"
         else:
             return "critic" if self.use_critic else "aggregator"
-    
 
+    def _fan_out_after_router(self, state):
+        active_agents = [name for name in ("agent1", "agent2", "agent3") if state[f"{name}_turn"]]
+        return active_agents or "aggregator"
+
+    def _node(self, node):
+        """Expose both the sync `__call__` and the async `acall` of a node, so the graph can run under stream and astream."""
+        return RunnableLambda(node.__call__, afunc=node.acall)
+
+    def _join_agents(self, state):
+        """Barrier between the parallel agent turns and the critic/aggregator."""
+        return None
 
     def _setup_workflow(self):
 
@@ -116,48 +182,43 @@ class WorkflowManager:
             critic_prompt = None
             router_prompt = ROUTER_NO_CRITIC
 
-        if self.use_critic:
-            workflow = StateGraph(AgentState)
-
-            workflow.add_node("agent1", Agent(self.agent_llm, agent1_prompt , "agent1", self.kb_system))
-            workflow.add_node("agent2", Agent(self.agent_llm, agent2_prompt, "agent2", self.kb_system))
-            workflow.add_node("agent3", Agent(self.agent_llm, agent3_prompt, "agent3", self.kb_system))
-            workflow.add_node("aggregator", Aggregator(self.advanced_llm, aggregator_prompt, [create_kb_tool(self.kb_system)], self.kb_system))
-            workflow.add_node("critic", Critic(self.agent_llm, critic_prompt, self.kb_system))
-            workflow.add_node("router", Router(self.advanced_llm, router_prompt))
+        workflow = StateGraph(AgentState)
 
-            workflow.add_edge(START, "router")
-            workflow.add_conditional_edges("agent1", self._route_after_agent1)
-            workflow.add_conditional_edges("agent2", self._route_after_agent2)
-            workflow.add_edge("agent3", "critic")
+        history = self.history_policy
+        cache = self.response_cache
+        workflow.add_node("agent1", self._node(Agent(self.agent_llm, agent1_prompt , "agent1", self.kb_system, history, cache)))
+        workflow.add_node("agent2", self._node(Agent(self.agent_llm, agent2_prompt, "agent2", self.kb_system, history, cache)))
+        workflow.add_node("agent3", self._node(Agent(self.agent_llm, agent3_prompt, "agent3", self.kb_system, history, cache)))
+        workflow.add_node("aggregator", self._node(Aggregator(self.advanced_llm, aggregator_prompt, [create_kb_tool(self.kb_system)], self.kb_system, history)))
+        workflow.add_node("router", self._node(Router(self.advanced_llm, router_prompt, history, cache)))
+        if self.use_critic:
+            workflow.add_node("critic", self._node(Critic(self.agent_llm, critic_prompt, self.kb_system, history, cache)))
             workflow.add_edge("critic", "aggregator")
-            workflow.add_conditional_edges("aggregator", lambda state: END if not state["agent1_turn"] and not state["agent2_turn"] and not state["agent3_turn"] else "router")
-            workflow.add_conditional_edges("router", self._route_after_router)
 
-            return workflow.compile()
-    
+        after_agents = "critic" if self.use_critic else "aggregator"
+        workflow.add_edge(START, "router")
+
+        if self.parallel_agents:
+            # Every active agent runs in the same step; the join node only fires once all of them have returned.
+            workflow.add_node("join", self._join_agents)
+            workflow.add_conditional_edges("router", self._fan_out_after_router)
+            workflow.add_edge("agent1", "join")
+            workflow.add_edge("agent2", "join")
+            workflow.add_edge("agent3", "join")
+            workflow.add_edge("join", after_agents)
         else:
-
-            workflow = StateGraph(AgentState)
-
-            workflow.add_node("agent1", Agent(self.agent_llm, agent1_prompt , "agent1", self.kb_system))
-            workflow.add_node("agent2", Agent(self.agent_llm, agent2_prompt, "agent2", self.kb_system))
-            workflow.add_node("agent3", Agent(self.agent_llm, agent3_prompt, "agent3", self.kb_system))
-            workflow.add_node("aggregator", Aggregator(self.advanced_llm, aggregator_prompt, [create_kb_tool(self.kb_system)], self.kb_system))
-            workflow.add_node("router", Router(self.advanced_llm, router_prompt))
-
-            workflow.add_edge(START, "router")
+            workflow.add_conditional_edges("router", self._route_after_router)
             workflow.add_conditional_edges("agent1", self._route_after_agent1)
             workflow.add_conditional_edges("agent2", self._route_after_agent2)
-            workflow.add_edge("agent3", "aggregator")
-            workflow.add_conditional_edges("aggregator", lambda state: END if not state["agent1_turn"] and not state["agent2_turn"] and not state["agent3_turn"] else "router")
-            workflow.add_conditional_edges("router", self._route_after_router)
+            workflow.add_edge("agent3", after_agents)
 
-            return workflow.compile()
+        workflow.add_conditional_edges("aggregator", lambda state: END if not state["agent1_turn"] and not state["agent2_turn"] and not state["agent3_turn"] else "router")
 
+        return workflow
 
-    def run_phase(self, problem: str):
-        initial_state = {
+
+    def _initial_state(self, problem: str):
+        return {
             "agent1_turn": True,
             "agent2_turn": True,
             "agent3_turn": True,
@@ -166,13 +227,130 @@ class WorkflowManager:
             "agent2_answer": "",
             "agent3_answer": "",
             "critic_answer": "",
-            "messages": []
+            "messages": [],
+            "history_summary": "",
+            "summarized_messages": 0
         }
-        
-        for s in self.workflow.stream(initial_state, {"recursion_limit": 50}):
-            if "__end__" not in s:
-                print(s)
-                print("----")
+
+    def _apply_update(self, state, update):
+        """Fold one streamed node update into the tracked state (messages are appended, like the add_messages reducer)."""
+        for node_update in update.values():
+            for key, value in (node_update or {}).items():
+                if key == "messages":
+                    state["messages"] = list(state["messages"]) + (list(value) if isinstance(value, (list, tuple)) else [value])
+                else:
+                    state[key] = value
+
+    def _run_config(self, run_id=None):
+        run_config = {"recursion_limit": 50}
+        if run_id is not None:
+            run_config["configurable"] = {"thread_id": run_id}
+        return run_config
+
+    def _checkpoint_input(self, snapshot, problem: str, run_id: str, resume: bool):
+        """
+        Decide how a checkpointed run starts: the initial state for a new run, None to continue
+        after the last completed node, or False when the stored run already reached END.
+        """
+        if not snapshot.values:
+            return self._initial_state(problem)
+        if not resume:
+            raise ValueError(f"Run '{run_id}' already has a checkpoint; pass resume=True to continue it or use a new run id")
+        if not snapshot.next:
+            print(f"Run '{run_id}' already finished, skipping")
+            return False
+        print(f"Resuming run '{run_id}' before {', '.join(snapshot.next)}")
+        return None
+
+    def _print_update(self, s, verbose: bool):
+        if verbose:
+            print(s)
+            print("----")
+
+    def _finish_run(self, state):
+        # Let the background knowledge base ingestion of this run finish before handing back the result
+        self.kb_system.flush()
+        if self.response_cache:
+            print(f"Response cache: {self.response_cache.stats()}")
+        print(f"Knowledge base caches: {self.kb_system.cache_stats()}")
+        return state
+
+    def close(self):
+        """Release the knowledge base (ingestion worker, extraction threads, graph connection); call once the manager is done."""
+        self.kb_system.close()
+
+    def run_phase(self, problem: str, verbose: bool = True, run_id: str = None, resume: bool = False):
+        """
+        Run the discussion for one problem. With a run_id the state is checkpointed after every node
+        into the CHECKPOINT_DB SQLite file, and resume=True continues an interrupted run from there.
+        """
+        if run_id is None:
+            state = self._initial_state(problem)
+            for s in self.workflow.stream(self._initial_state(problem), self._run_config()):
+                if "__end__" not in s:
+                    self._apply_update(state, s)
+                    self._print_update(s, verbose)
+            return self._finish_run(state)
+
+        run_config = self._run_config(run_id)
+        with SqliteSaver.from_conn_string(self.config['CHECKPOINT_DB']) as checkpointer:
+            workflow = self.graph_builder.compile(checkpointer=checkpointer)
+            graph_input = self._checkpoint_input(workflow.get_state(run_config), problem, run_id, resume)
+            if graph_input is not False:
+                for s in workflow.stream(graph_input, run_config):
+                    if "__end__" not in s:
+                        self._print_update(s, verbose)
+            return self._finish_run(dict(workflow.get_state(run_config).values))
+
+    async def arun_phase(self, problem: str, verbose: bool = True, run_id: str = None, resume: bool = False):
+        """Async counterpart of run_phase; many discussions can share one event loop."""
+        if run_id is None:
+            state = self._initial_state(problem)
+            async for s in self.workflow.astream(self._initial_state(problem), self._run_config()):
+                if "__end__" not in s:
+                    self._apply_update(state, s)
+                    self._print_update(s, verbose)
+            await self.kb_system.aflush()
+            return self._finish_run(state)
+
+        run_config = self._run_config(run_id)
+        async with AsyncSqliteSaver.from_conn_string(self.config['CHECKPOINT_DB']) as checkpointer:
+            workflow = self.graph_builder.compile(checkpointer=checkpointer)
+            graph_input = self._checkpoint_input(await workflow.aget_state(run_config), problem, run_id, resume)
+            if graph_input is not False:
+                async for s in workflow.astream(graph_input, run_config):
+                    if "__end__" not in s:
+                        self._print_update(s, verbose)
+            await self.kb_system.aflush()
+            return self._finish_run(dict((await workflow.aget_state(run_config)).values))
+
+def setup_environment(config_values):
+    install_cassette(config_values['CASSETTE_MODE'], config_values['CASSETTE_PATH'])
+    if config_values['CASSETTE_MODE'] != "replay":
+        os.environ["OPENAI_API_KEY"] = config_values['OPENAI_API_KEY']
+    if config_values['LANGCHAIN_TRACING_V2'] and config_values['LANGCHAIN_API_KEY']:
+        os.environ["LANGCHAIN_API_KEY"] = config_values['LANGCHAIN_API_KEY']
+        os.environ["LANGCHAIN_TRACING_V2"] = "true"
+        os.environ["LANGCHAIN_PROJECT"] = config_values['LANGCHAIN_PROJECT']
+    else:
+        # Remove LangChain environment variables if tracing is disabled
+        for var in ["LANGCHAIN_API_KEY", "LANGCHAIN_TRACING_V2", "LANGCHAIN_PROJECT"]:
+            os.environ.pop(var, None)
+
+def clear_checkpoints(checkpoint_db: str, run_id_prefix: str) -> int:
+    """Delete the stored checkpoints of every run whose id starts with `run_id_prefix`; returns the number of rows removed."""
+    if not Path(checkpoint_db).exists():
+        return 0
+    removed = 0
+    with sqlite3.connect(checkpoint_db) as conn:
+        tables = [row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
+        for table in tables:
+            columns = [row[1] for row in conn.execute(f'PRAGMA table_info("{table}")')]
+            if "thread_id" in columns:
+                removed += conn.execute(
+                    f'DELETE FROM "{table}" WHERE substr(thread_id, 1, ?) = ?', (len(run_id_prefix), run_id_prefix)
+                ).rowcount
+    return removed
 
 def main():
     # parser = argparse.ArgumentParser(description="Run multi-agent system for product development phases.")
@@ -183,22 +361,17 @@ def main():
     config_values = get_all_config_values(config)
 
     # Set environment variables
-    os.environ["OPENAI_API_KEY"] = config_values['OPENAI_API_KEY']
-    if config_values['LANGCHAIN_TRACING_V2']:
-        os.environ["LANGCHAIN_API_KEY"] = config_values['LANGCHAIN_API_KEY']
-        os.environ["LANGCHAIN_TRACING_V2"] = "true"
-        os.environ["LANGCHAIN_PROJECT"] = config_values['LANGCHAIN_PROJECT']
-    else:
-        # Remove LangChain environment variables if tracing is disabled
-        for var in ["LANGCHAIN_API_KEY", "LANGCHAIN_TRACING_V2", "LANGCHAIN_PROJECT"]:
-            os.environ.pop(var, None)
+    setup_environment(config_values)
 
     # problem = "The company is considering investing in one of three emerging technologies: Edge Computing, Quantum Computing, or Blockchain. Analyze the options and recommend an investment strategy, considering technical feasibility, market potential, and financial viability. Which technology should the company invest in?"
 
     problem = "Our mid-sized tech firm (annual R&D budget: $12M) must choose one emerging technology to prioritize: Edge Computing, Quantum Computing, or Blockchain. Which option offers the optimal balance of technical feasibility, market potential, and financial viability over a 3-5 year horizon, considering our current capabilities in distributed systems development?"
 
     workflow_manager = WorkflowManager(config_values)
-    workflow_manager.run_phase(problem)
+    try:
+        workflow_manager.run_phase(problem)
+    finally:
+        workflow_manager.close()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
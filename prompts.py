@@ -590,31 +590,38 @@ Organize your analysis as practical considerations followed by actionable recomm
 Explicitly state which phase of the Lean Startup Methodology your current task falls under (e.g., Build, Measure, Learn).
 """
 
-ASP_TRANSLATION_PROMPT = """
-Generate ASP (Answer Set Programming) rules and facts from the given Neo4j data following these instructions:
-
-### 1. General Guidelines
-- Lowercase: Use lowercase for all predicates and constants.
-- Naming: Replace spaces in multi-word names with underscores (e.g., "product design" → product_design).
-- Statements: End every statement with a period.
+ASP_RULES_PROMPT = """
+Write ASP (Answer Set Programming) rules for Clingo that answer the given query over facts that are already loaded. Do not restate the facts.
+
+### 1. Available Facts
+- The result of the knowledge graph query is compiled into facts. Every result row R has row(R); each column of the row is a predicate whose first argument is R (e.g. p_id(0, alice)).
+- Graph structure is available as node(Id, Type), edge(Source, Type, Target) and property(Id, Key, Value).
+- Short text values are lowercase constants with underscores (e.g. "Product Design" -> product_design), integers are numbers, and long text is a quoted string.
+
+### 2. General Guidelines
+- Use only the listed predicates plus new predicates that your rules define.
+- Lowercase: Use lowercase for new predicates and constants; variables start with an uppercase letter.
+- Statements: End every statement with a period and put each statement on its own line.
 - Negation & Constraints: Use 'not' for negation and ':-' for constraints.
-- Validation: Ensure ASP syntax correctness.
-
-### 2. Node Representation
-- Unary Predicates: Convert Neo4j node labels to unary predicates (e.g., node(product_design)).
-- Properties: Convert node properties to facts linking the node and property (e.g., description(product_design, "text...")).
-
-### 3. Relationship Representation
-- Binary Predicates: Convert relationships between nodes into binary predicates (e.g., related_to(product_design, research_and_discovery)).
-
-### 4. Examples
-- A node labeled "Product Design" with a description would be represented as:
-  - node(product_design).
-  - description(product_design, "product design is...").
-- A relationship between "Product Design" and "Research and Discovery" would be:
-  - related_to(product_design, research_and_discovery).
-
-### 5. Final Instructions
-- Ensure each node, property, and relationship is accurately translated.
-- Validate the output for correct ASP syntax, ready for use in Clingo.
-"""
\ No newline at end of file
+- Output: Add #show directives for the predicates that answer the query.
+
+### 3. Example
+- Facts p_id(0, product_design). edge(product_design, related_to, research_and_discovery).
+- Query "What is related to product design?":
+  - related(Y) :- p_id(_, X), edge(X, related_to, Y).
+  - #show related/1.
+"""
+ASP_REPAIR_PROMPT = """
+Some statements of an ASP (Answer Set Programming) program were rejected by Clingo. Fix each failing statement so that it parses and is safe: every variable must occur in a positive body literal, and the body may only use predicates of the loaded facts or predicates defined by other rules.
+Keep the intent of each statement and change as little as possible. Return exactly one corrected statement per failing statement, in the given order.
+"""
+# Vendored copy of the LangChain Hub prompt "rlm/rag-prompt", so RAG answers need no hub request
+RAG_PROMPT = """You are an assistant for question-answering tasks. Use the following pieces of retrieved context to answer the question. If you don't know the answer, just say that you don't know. Use three sentences maximum and keep the answer concise.
+Question: {question} 
+Context: {context} 
+Answer:"""
+HISTORY_SUMMARY_PROMPT = """
+You maintain the running summary of a multi-agent discussion between a Router (which sets the objective of each round) and an Aggregator (which synthesizes the specialized agents' answers).
+Update the existing summary with the new discussion turns. Keep the decisions made, open questions, unresolved conflicts, numbers and recommendations; drop repetition and wording.
+Write at most {max_words} words of plain prose. Return only the updated summary.
+"""
@@ -1,9 +1,11 @@
 import os
+import hashlib
+import json
+from typing import List
 from pathlib import Path
 from langchain_core.prompts import ChatPromptTemplate
 from pydantic import BaseModel, Field
 from langchain_openai import ChatOpenAI, OpenAIEmbeddings
-from langchain import hub
 from langchain_core.output_parsers import StrOutputParser
 from langchain_community.tools.tavily_search import TavilySearchResults
 from langchain_core.documents import Document
@@ -11,71 +13,180 @@ from langchain_community.document_loaders import TextLoader
 from langchain_chroma import Chroma
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain.tools import Tool
+from prompts import RAG_PROMPT
 
 class GradeDocuments(BaseModel):
     """Binary score for relevance check on retrieved documents."""
     binary_score: str = Field(description="Documents are relevant to the question, 'yes' or 'no'")
 
+class GradeDocumentsBatch(BaseModel):
+    """Binary relevance scores for a numbered list of retrieved documents."""
+    binary_scores: List[str] = Field(description="One 'yes' or 'no' per document, in the order the documents are numbered")
+
+GRADING_MODES = ("sequential", "batch", "concurrent")
+
+CHUNK_SIZE = 100
+CHUNK_OVERLAP = 50
+MANIFEST_NAME = "manifest.json"
+
+def _file_hash(path: Path) -> str:
+    return hashlib.sha256(path.read_bytes()).hexdigest()
+
+def _chunk_id(source: str, text: str) -> str:
+    """Stable Chroma id for a chunk: unchanged chunks keep their id, so only new text is embedded."""
+    return hashlib.sha256(f"{source}\0{text}".encode("utf-8")).hexdigest()
+
+GRADER_SYSTEM_PROMPT = """You are a grader assessing relevance of a retrieved document to a user question.
+        If the document contains keyword(s) or semantic meaning related to the question, grade it as relevant.
+        Give a binary score 'yes' or 'no' score to indicate whether the document is relevant to the question."""
+
 class RAGSystem:
-    def __init__(self, chroma_db_dir, mra_data_path, pd_data_path, sm_data_path, model_name="gpt-4o-mini"):
+    """
+    Corrective RAG over the per-agent document collections. Retrieved documents are graded for relevance
+    according to `grading_mode`: "sequential" (one grader call after another), "concurrent" (one call per
+    document, at most `grading_concurrency` in flight) or "batch" (all documents in one structured call).
+    """
+    def __init__(self, chroma_db_dir, mra_data_path, pd_data_path, sm_data_path, model_name="gpt-4o-mini",
+                 grading_mode: str = "sequential", grading_concurrency: int = 4):
+        if grading_mode not in GRADING_MODES:
+            raise ValueError(f"Unknown grading mode {grading_mode!r}; expected one of {GRADING_MODES}")
+        self.grading_mode = grading_mode
+        self.grading_concurrency = grading_concurrency
         self.CHROMA_DB_DIR = chroma_db_dir
         self.MRA_data_path = mra_data_path
         self.PD_data_path = pd_data_path
         self.SM_data_path = sm_data_path
         self.vectorstores = {}
         self.llm = ChatOpenAI(model=model_name)
-        
+        # Chains are built once and reused by every rag() call
+        self.retrieval_grader = self.create_retrieval_grader()
+        self.batch_retrieval_grader = self.create_batch_retrieval_grader()
+        self.question_rewriter = self.create_question_rewriter()
+        self.rag_chain = ChatPromptTemplate.from_messages([("human", RAG_PROMPT)]) | self.llm | StrOutputParser()
+        self._web_search_tool = None
+
+    @property
+    def web_search_tool(self):
+        # Created on first use, so offline runs that never fall back to web search need no Tavily setup
+        if self._web_search_tool is None:
+            self._web_search_tool = TavilySearchResults(k=3)
+        return self._web_search_tool
+
     def create_vectorstore(self, directory: str, name: str):
-        """Create a vectorstore if it doesn't exist, otherwise return the existing one."""
+        """Open the vectorstore for a collection, bringing it in line with the .txt files in `directory`."""
         chroma_db_path = Path(self.CHROMA_DB_DIR) / f"{name}_chroma_db"
         
         if name not in self.vectorstores:
-            if chroma_db_path.exists() and any(chroma_db_path.iterdir()):
-                print(f"Loading existing vectorstore for {name}")
-                self.vectorstores[name] = Chroma(
-                    persist_directory=str(chroma_db_path),
-                    embedding_function=OpenAIEmbeddings(),
-                    collection_name=f"rag-{name}-chroma"
-                )
-            else:
-                print(f"Creating new vectorstore for {name}")
-                docs = []
-                for file_path in Path(directory).glob('*.txt'):
-                    loader = TextLoader(str(file_path), encoding="utf-8")
-                    docs.extend(loader.load())
-
-                text_splitter = RecursiveCharacterTextSplitter.from_tiktoken_encoder(
-                    chunk_size=100, chunk_overlap=50
-                )
-                doc_splits = text_splitter.split_documents(docs)
-
-                chroma_db_path.mkdir(parents=True, exist_ok=True)
-
-                self.vectorstores[name] = Chroma.from_documents(
-                    documents=doc_splits,
-                    collection_name=f"rag-{name}-chroma",
-                    embedding=OpenAIEmbeddings(),
-                    persist_directory=str(chroma_db_path)
-                )
-                
-                self.vectorstores[name].persist()
+            chroma_db_path.mkdir(parents=True, exist_ok=True)
+            vectorstore = Chroma(
+                persist_directory=str(chroma_db_path),
+                embedding_function=OpenAIEmbeddings(),
+                collection_name=f"rag-{name}-chroma"
+            )
+            self.sync_vectorstore(vectorstore, Path(directory), chroma_db_path / MANIFEST_NAME, name)
+            self.vectorstores[name] = vectorstore
 
         return self.vectorstores[name].as_retriever()
 
+    def sync_vectorstore(self, vectorstore, directory: Path, manifest_path: Path, name: str):
+        """
+        Embed only the chunks of new or changed files and delete the chunks of changed or removed files.
+        The manifest maps each file to its content hash and the ids of its chunks.
+        """
+        splitting = {"chunk_size": CHUNK_SIZE, "chunk_overlap": CHUNK_OVERLAP}
+        manifest = {}
+        if manifest_path.exists():
+            with open(manifest_path, encoding="utf-8") as file:
+                manifest = json.load(file)
+        if manifest.get("splitting") != splitting:
+            # No manifest (or different chunking): the stored chunks cannot be matched to files, so rebuild
+            stale_ids = vectorstore.get(include=[])["ids"]
+            if stale_ids:
+                print(f"Rebuilding vectorstore for {name}")
+                vectorstore.delete(ids=stale_ids)
+            manifest = {}
+        indexed = manifest.get("files", {})
+
+        text_splitter = RecursiveCharacterTextSplitter.from_tiktoken_encoder(
+            chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP
+        )
+        files = {}
+        new_ids, new_docs, removed_ids = [], [], []
+        for file_path in sorted(directory.glob('*.txt')):
+            digest = _file_hash(file_path)
+            entry = indexed.get(file_path.name)
+            if entry and entry["sha256"] == digest:
+                files[file_path.name] = entry
+                continue
+            old_ids = set(entry["chunks"]) if entry else set()
+            chunk_ids = []
+            loader = TextLoader(str(file_path), encoding="utf-8")
+            for split in text_splitter.split_documents(loader.load()):
+                chunk_id = _chunk_id(file_path.name, split.page_content)
+                if chunk_id in chunk_ids:
+                    continue
+                chunk_ids.append(chunk_id)
+                if chunk_id not in old_ids:
+                    new_ids.append(chunk_id)
+                    new_docs.append(split)
+            removed_ids.extend(old_ids - set(chunk_ids))
+            files[file_path.name] = {"sha256": digest, "chunks": chunk_ids}
+        for file_name in indexed.keys() - files.keys():
+            removed_ids.extend(indexed[file_name]["chunks"])
+
+        if removed_ids:
+            vectorstore.delete(ids=removed_ids)
+        if new_docs:
+            vectorstore.add_documents(new_docs, ids=new_ids)
+        print(f"Vectorstore for {name}: {len(new_ids)} chunks embedded, {len(removed_ids)} removed, "
+              f"{sum(len(entry['chunks']) for entry in files.values())} indexed")
+
+        # Written after the vectorstore is updated, so an interrupted sync is redone on the next start
+        tmp_path = manifest_path.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp_path, 'w', encoding="utf-8") as file:
+            json.dump({"splitting": splitting, "files": files}, file, indent=2)
+        os.replace(tmp_path, manifest_path)
+
     def create_retrieval_grader(self):
         structured_llm_grader = self.llm.with_structured_output(GradeDocuments)
         
-        system = """You are a grader assessing relevance of a retrieved document to a user question.
-        If the document contains keyword(s) or semantic meaning related to the question, grade it as relevant.
-        Give a binary score 'yes' or 'no' score to indicate whether the document is relevant to the question."""
-        
         grade_prompt = ChatPromptTemplate.from_messages([
-            ("system", system),
+            ("system", GRADER_SYSTEM_PROMPT),
             ("human", "Retrieved document: \n\n {document} \n\n User question: {question}"),
         ])
         
         return grade_prompt | structured_llm_grader
 
+    def create_batch_retrieval_grader(self):
+        structured_llm_grader = self.llm.with_structured_output(GradeDocumentsBatch)
+
+        grade_prompt = ChatPromptTemplate.from_messages([
+            ("system", GRADER_SYSTEM_PROMPT + "\n        Grade every numbered document independently and return one score per document, in order."),
+            ("human", "Retrieved documents: \n\n {documents} \n\n User question: {question}"),
+        ])
+
+        return grade_prompt | structured_llm_grader
+
+    def grade_documents(self, question: str, docs: List[Document], mode: str = None) -> List[bool]:
+        """Relevance of each document to the question, using `mode` or the configured grading mode."""
+        mode = mode or self.grading_mode
+        if not docs:
+            return []
+        if mode == "batch":
+            numbered = "\n\n".join(f"[{i + 1}] {doc.page_content}" for i, doc in enumerate(docs))
+            grades = self.batch_retrieval_grader.invoke({"question": question, "documents": numbered})
+            scores = [score.strip().lower() == "yes" for score in grades.binary_scores]
+            if len(scores) == len(docs):
+                return scores
+            print(f"Batch grader returned {len(scores)} scores for {len(docs)} documents; grading individually")
+            mode = "concurrent"
+        inputs = [{"question": question, "document": doc.page_content} for doc in docs]
+        if mode == "concurrent":
+            grades = self.retrieval_grader.batch(inputs, config={"max_concurrency": self.grading_concurrency})
+        else:
+            grades = [self.retrieval_grader.invoke(grade_input) for grade_input in inputs]
+        return [grade.binary_score == "yes" for grade in grades]
+
     def create_question_rewriter(self):
         system = """You a question re-writer that converts an input question to a better version that is optimized
         for web search. Look at the input and try to reason about the underlying semantic intent / meaning."""
@@ -91,36 +202,27 @@ class RAGSystem:
         """
         Modified RAG function incorporating CRAG elements with web search fallback.
         """
-        retrieval_grader = self.create_retrieval_grader()
-        question_rewriter = self.create_question_rewriter()
-        web_search_tool = TavilySearchResults(k=3)
-        
-        docs = retriever.get_relevant_documents(question)
+        docs = retriever.invoke(question)
         
         relevant_docs = []
         used_web_search = False
         
-        if docs:
-            for doc in docs:
-                grade = retrieval_grader.invoke({"question": question, "document": doc.page_content})
-                if grade.binary_score == "yes":
-                    relevant_docs.append(doc)
+        for doc, relevant in zip(docs, self.grade_documents(question, docs)):
+            if relevant:
+                relevant_docs.append(doc)
         
         if not relevant_docs:
             used_web_search = True
-            improved_question = question_rewriter.invoke({"question": question})
-            web_results = web_search_tool.invoke({"query": improved_question})
+            improved_question = self.question_rewriter.invoke({"question": question})
+            web_results = self.web_search_tool.invoke({"query": improved_question})
             web_content = "\n".join([d["content"] for d in web_results])
             relevant_docs.append(Document(page_content=web_content))
         
         if not relevant_docs:
             return "IRRELEVANT_ANSWER: No relevant information found. Please try rephrasing your question or asking about a different topic."
         
-        prompt = hub.pull("rlm/rag-prompt")
-        rag_chain = prompt | self.llm | StrOutputParser()
-        
         formatted_docs = "\n\n".join(doc.page_content for doc in relevant_docs)
-        response = rag_chain.invoke({"context": formatted_docs, "question": question})
+        response = self.rag_chain.invoke({"context": formatted_docs, "question": question})
         
         source_message = "WEB SEARCH" if used_web_search else "RAG DATABASE"
         print(f"RAG RESPONSE (Source: {source_message}): {response}")
@@ -0,0 +1,27 @@
+# test_asp.py
+from asp import ASPSession
+
+KNAPSACK = """
+{ pick(I) : item(I, _) }.
+:- #sum { W, I : pick(I), item(I, W) } > 1000.
+:- pick(I), pick(J), I < J, I + J == 60.
+#maximize { W, I : pick(I), item(I, W) }.
+#show pick/1.
+"""
+
+def test_timeout_returns_best_model_found():
+    session = ASPSession(timeout=0.3)
+    session.add_facts([f"item({i}, {(i * 37) % 101})." for i in range(1, 120)])
+    solved = session.solve(KNAPSACK)
+    assert solved["stats"]["timed_out"]
+    assert solved["stats"]["optimality_proven"] is False
+    assert solved["stats"]["satisfiable"]
+    assert len(solved["models"]) == 1 and solved["models"][0]
+
+def test_proven_optimum():
+    session = ASPSession()
+    session.add_facts(["item(1, 3).", "item(2, 5)."])
+    solved = session.solve("{ pick(I) : item(I, _) }. #maximize { W, I : pick(I), item(I, W) }. #show pick/1.")
+    assert solved["models"] == [["pick(1)", "pick(2)"]]
+    assert solved["stats"]["optimality_proven"] is True
+    assert "optimality_proven" not in session.solve("a. #show a/0.")["stats"]
@@ -0,0 +1,219 @@
+# test_graph_backend.py
+import json
+import os
+import uuid
+
+import pytest
+
+from graph_backend import CypherError, GraphBackend, InMemoryGraphBackend
+
+def _documents(people):
+    """One source document mentioning `people` (id -> age), Acme, and who works where and knows whom."""
+    nodes = [{"id": name, "type": "Person", "properties": {"age": age}} for name, age in people.items()]
+    nodes.append({"id": "Acme", "type": "Company", "properties": {}})
+    relationships = [{"source": name, "target": "Acme", "type": "WORKS_AT", "properties": {}} for name in people]
+    names = list(people)
+    relationships += [
+        {"source": source, "target": target, "type": "KNOWS", "properties": {"since": 2020}}
+        for source, target in zip(names, names[1:])
+    ]
+    return [{"id": f"doc-{'-'.join(names)}", "text": "People at Acme.", "nodes": nodes, "relationships": relationships}]
+
+RUN_PEOPLE = {"Alice": 30, "Bob": 25}
+OTHER_RUN_PEOPLE = {"Carol": 41}
+
+# (query, expected rows, whether the query fixes the row order); every query is scoped by $run_id
+CASES = [
+    (
+        "MATCH (p:Person {run_id: $run_id}) RETURN p.id AS name ORDER BY name",
+        [{"name": "Alice"}, {"name": "Bob"}],
+        True,
+    ),
+    (
+        "MATCH (p:Person) WHERE p.run_id = $run_id RETURN count(p) AS people",
+        [{"people": 2}],
+        True,
+    ),
+    (
+        "MATCH (p:Person {run_id: $run_id}) WHERE p.age > 26 RETURN p.id AS name, p.age AS age",
+        [{"name": "Alice", "age": 30}],
+        True,
+    ),
+    (
+        "MATCH (p:Person)-[:WORKS_AT]->(c:Company) WHERE p.run_id = $run_id RETURN c.id AS company, count(p) AS employees",
+        [{"company": "Acme", "employees": 2}],
+        True,
+    ),
+    (
+        "MATCH (a)-[r:KNOWS]->(b) WHERE a.run_id = $run_id RETURN a.id AS source, type(r) AS type, r.since AS since, b.id AS target",
+        [{"source": "Alice", "type": "KNOWS", "since": 2020, "target": "Bob"}],
+        True,
+    ),
+    (
+        "MATCH (a:Person {id: 'Bob', run_id: $run_id})-[:KNOWS]-(b) RETURN b.id AS friend",
+        [{"friend": "Alice"}],
+        True,
+    ),
+    (
+        "MATCH (c:Company {run_id: $run_id}) OPTIONAL MATCH (c)<-[:KNOWS]-(x) RETURN c.id AS company, x AS other",
+        [{"company": "Acme", "other": None}],
+        True,
+    ),
+    (
+        "MATCH (d:Document {run_id: $run_id})-[:MENTIONS]->(:Person)-[:KNOWS|WORKS_AT*1..2]->(c:Company) "
+        "RETURN DISTINCT c.id AS company",
+        [{"company": "Acme"}],
+        True,
+    ),
+    (
+        "MATCH p = (:Person {id: 'Alice', run_id: $run_id})-[:KNOWS]->(:Person) "
+        "RETURN length(p) AS hops, size(nodes(p)) AS nodes, p AS path",
+        [{
+            "hops": 1,
+            "nodes": 2,
+            "path": [{"id": "Alice", "age": 30}, "KNOWS", {"id": "Bob", "age": 25}],
+        }],
+        True,
+    ),
+    (
+        "MATCH p = (:Person {run_id: $run_id})-[:WORKS_AT]->(:Company) RETURN count(p) AS paths",
+        [{"paths": 2}],
+        True,
+    ),
+    (
+        "MATCH (p:Person {run_id: $run_id}) WHERE (p)-[:KNOWS]->() RETURN p.id AS name",
+        [{"name": "Alice"}],
+        True,
+    ),
+    (
+        "MATCH (p:Person {run_id: $run_id}) WHERE NOT (p)-[:KNOWS]->(:Person) RETURN p.id AS name",
+        [{"name": "Bob"}],
+        True,
+    ),
+    (
+        "MATCH (p:Person {run_id: $run_id}) WHERE (p.age > 26) OR (p.id = 'Bob') RETURN count(*) AS people",
+        [{"people": 2}],
+        True,
+    ),
+    (
+        "MATCH (p:Person {run_id: $run_id}) WHERE EXISTS { MATCH (p)-[:KNOWS]-(q) WHERE q.age < 28 } RETURN p.id AS name",
+        [{"name": "Alice"}],
+        True,
+    ),
+    (
+        "MATCH (p:Person {run_id: $run_id}) RETURN min(p.age) AS youngest, max(p.age) AS oldest, sum(p.age) AS total, avg(p.age) AS mean",
+        [{"youngest": 25, "oldest": 30, "total": 55, "mean": 27.5}],
+        True,
+    ),
+    (
+        "MATCH (p:Person {run_id: $run_id}) "
+        "RETURN p.id AS name, CASE WHEN p.age >= 30 THEN 'senior' ELSE 'junior' END AS band ORDER BY p.age DESC",
+        [{"name": "Alice", "band": "senior"}, {"name": "Bob", "band": "junior"}],
+        True,
+    ),
+    (
+        "MATCH (p:Person {run_id: $run_id}) WITH p ORDER BY p.id SKIP 1 LIMIT 1 RETURN p.id AS name",
+        [{"name": "Bob"}],
+        True,
+    ),
+    (
+        "UNWIND [1, 2, 3] AS x WITH x WHERE x > 1 RETURN sum(x) AS total, collect(x) AS xs",
+        [{"total": 5, "xs": [2, 3]}],
+        True,
+    ),
+    (
+        "RETURN round(2.5) AS up, round(-2.5) AS negative, round(3.14159, 2) AS precise, round(-1.55, 1) AS away",
+        [{"up": 3.0, "negative": -2.0, "precise": 3.14, "away": -1.6}],
+        True,
+    ),
+    (
+        "RETURN toUpper('acme') AS upper, coalesce(null, 'x') AS value, 7 / 2 AS quotient, 'Acme' STARTS WITH 'Ac' AS prefix",
+        [{"upper": "ACME", "value": "x", "quotient": 3, "prefix": True}],
+        True,
+    ),
+    (
+        "RETURN 2 * 3 ^ 2 AS scaled, 2 ^ 3 ^ 2 AS nested, -2 ^ 2 AS negated, 2 ^ 3 AS power, 7 % 3 * 2 AS remainder",
+        [{"scaled": 18.0, "nested": 64.0, "negated": 4.0, "power": 8.0, "remainder": 2}],
+        True,
+    ),
+]
+
+def _normalize(rows, ordered: bool):
+    """Compare rows as JSON, dropping run_id (it differs per run) and sorting unordered results."""
+    def strip(value):
+        if isinstance(value, dict):
+            return {k: strip(v) for k, v in value.items() if k != "run_id"}
+        if isinstance(value, (list, tuple)):
+            return [strip(v) for v in value]
+        return value
+    rows = [json.loads(json.dumps(strip(row), default=str)) for row in rows]
+    return rows if ordered else sorted(rows, key=lambda row: json.dumps(row, sort_keys=True))
+
+def _load(backend: GraphBackend, run_id: str, other_run_id: str):
+    backend.register_run(run_id)
+    backend.add_graph_documents(_documents(RUN_PEOPLE), run_id)
+    backend.register_run(other_run_id)
+    backend.add_graph_documents(_documents(OTHER_RUN_PEOPLE), other_run_id)
+
+@pytest.fixture
+def memory_graph():
+    graph = InMemoryGraphBackend()
+    _load(graph, "run", "other")
+    return graph
+
+@pytest.mark.parametrize("query, expected, ordered", CASES)
+def test_in_memory_results(memory_graph, query, expected, ordered):
+    rows = memory_graph.query(query, {"run_id": "run"})
+    assert _normalize(rows, ordered) == _normalize(expected, ordered)
+
+def test_exists_function_on_pattern(memory_graph):
+    rows = memory_graph.query("MATCH (p:Person {run_id: $run_id}) WHERE exists((p)-[:KNOWS]->()) RETURN p.id AS name", {"run_id": "run"})
+    assert rows == [{"name": "Alice"}]
+
+def test_relationships_of_path(memory_graph):
+    rows = memory_graph.query(
+        "MATCH p = (:Person {id: 'Alice', run_id: $run_id})-[:KNOWS]->(b) RETURN relationships(p) AS rels",
+        {"run_id": "run"},
+    )
+    assert _normalize(rows, True) == [{"rels": [[{"id": "Alice", "age": 30}, "KNOWS", {"id": "Bob", "age": 25}]]}]
+
+def test_drop_run_keeps_indexes_consistent(memory_graph):
+    memory_graph.drop_run("other")
+    assert memory_graph.query("MATCH (p:Person) RETURN p.id AS name ORDER BY name") == [{"name": "Alice"}, {"name": "Bob"}]
+    relationship_ids = set(memory_graph.relationships)
+    for index in (memory_graph.outgoing, memory_graph.incoming):
+        assert all(rel_ids <= relationship_ids for by_type in index.values() for rel_ids in by_type.values())
+    assert all(rel_ids <= relationship_ids for rel_ids in memory_graph.relationships_by_type.values())
+
+@pytest.mark.parametrize("query", [
+    "CREATE (n:Person {id: 'Eve'}) RETURN n",
+    "MATCH p = shortestPath((a:Person)-[*]-(b:Person)) RETURN p",
+    "MATCH (n) RETURN foo(n)",
+])
+def test_unsupported_cypher_raises(memory_graph, query):
+    with pytest.raises(CypherError):
+        memory_graph.query(query)
+
+def test_backend_is_abstract():
+    with pytest.raises(TypeError):
+        GraphBackend()
+
+@pytest.fixture(scope="module")
+def neo4j_graph():
+    url = os.getenv("NEO4J_TEST_URL")
+    if not url:
+        pytest.skip("Set NEO4J_TEST_URL (and NEO4J_TEST_USERNAME, NEO4J_TEST_PASSWORD) to compare with Neo4j")
+    from graph_backend import Neo4jBackend
+    graph = Neo4jBackend(url, os.getenv("NEO4J_TEST_USERNAME", "neo4j"), os.getenv("NEO4J_TEST_PASSWORD", ""))
+    run_id, other_run_id = f"test-{uuid.uuid4().hex}", f"test-{uuid.uuid4().hex}"
+    _load(graph, run_id, other_run_id)
+    yield graph, run_id
+    graph.drop_run(run_id)
+    graph.drop_run(other_run_id)
+
+@pytest.mark.parametrize("query, expected, ordered", CASES)
+def test_matches_neo4j(neo4j_graph, query, expected, ordered):
+    graph, run_id = neo4j_graph
+    memory = InMemoryGraphBackend()
+    _load(memory, run_id, "other")
+    assert _normalize(memory.query(query, {"run_id": run_id}), ordered) == _normalize(graph.query(query, {"run_id": run_id}), ordered)
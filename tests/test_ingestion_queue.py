@@ -0,0 +1,25 @@
+# test_ingestion_queue.py
+import threading
+
+import pytest
+
+from tools import IngestionQueue
+
+def test_close_ingests_pending_texts_and_stops_the_worker():
+    ingested = []
+    release = threading.Event()
+
+    def handler(texts):
+        release.wait()
+        ingested.extend(texts)
+
+    ingestion = IngestionQueue(handler, max_batch=2)
+    for i in range(5):
+        ingestion.submit(f"text {i}")
+    release.set()
+    assert ingestion.close(timeout=5)
+    assert ingested == [f"text {i}" for i in range(5)]
+    assert ingestion.wait_for(timeout=0)
+    with pytest.raises(RuntimeError):
+        ingestion.submit("late")
+    assert ingestion.close(timeout=5)
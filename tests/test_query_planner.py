@@ -0,0 +1,32 @@
+# test_query_planner.py
+import pytest
+
+from tools import QueryPlanner
+
+ROWS = [{"name": f"Technology {i}", "description": "An emerging technology."} for i in range(8)]
+
+@pytest.mark.parametrize("query", [
+    "What are all the technologies mentioned?",
+    "List each risk of quantum computing",
+    "What should the company know about edge computing?",
+    "Which is the best known blockchain platform?",
+    "What exactly is edge computing?",
+    "Are there technologies without a known vendor?",
+])
+def test_lookup_questions_skip_asp(query):
+    decision = QueryPlanner().choose(query, ROWS)
+    assert decision["features"]["intent"] == "lookup"
+    assert decision["path"] in ("qa", "direct")
+
+@pytest.mark.parametrize("query", [
+    "Assign each engineer to at most 2 projects",
+    "Which combinations of technologies satisfy the budget constraint?",
+    "Schedule the pilots so that exactly one runs per quarter",
+])
+def test_constraint_questions_use_asp(query):
+    decision = QueryPlanner().choose(query, ROWS)
+    assert decision["features"]["intent"] == "reasoning"
+    assert decision["path"] == "asp"
+
+def test_aggregate_questions_use_qa():
+    assert QueryPlanner().choose("How many technologies are mentioned?", ROWS)["path"] == "qa"
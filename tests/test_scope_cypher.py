@@ -0,0 +1,59 @@
+# test_scope_cypher.py
+import pytest
+
+from graph_backend import InMemoryGraphBackend
+from tools import RUN_SCOPE_PARAM, scope_cypher
+
+SCOPE = f"run_id: ${RUN_SCOPE_PARAM}"
+
+@pytest.mark.parametrize("cypher, expected", [
+    (
+        "MATCH (p:Person {id: 'Alice'})-[:KNOWS]->(q) RETURN q.id",
+        f"MATCH (p:Person {{{SCOPE}, id: 'Alice'}})-[:KNOWS {{{SCOPE}}}]->(q {{{SCOPE}}}) RETURN q.id",
+    ),
+    (
+        "OPTIONAL MATCH (c)<-[r:KNOWS|WORKS_AT]-(x), (y) RETURN c",
+        f"OPTIONAL MATCH (c {{{SCOPE}}})<-[r:KNOWS|WORKS_AT {{{SCOPE}}}]-(x {{{SCOPE}}}), (y {{{SCOPE}}}) RETURN c",
+    ),
+    (
+        "MATCH p = (a)-[:KNOWS*1..2]->(b) RETURN p",
+        f"MATCH p = (a {{{SCOPE}}})-[:KNOWS*1..2]->(b {{{SCOPE}}}) RETURN p",
+    ),
+    (
+        "MATCH (p) WHERE NOT (p)-[:KNOWS]->() AND exists((p)<--(:Company)) RETURN p",
+        f"MATCH (p {{{SCOPE}}}) WHERE NOT (p {{{SCOPE}}})-[:KNOWS {{{SCOPE}}}]->({{{SCOPE}}}) "
+        f"AND exists((p {{{SCOPE}}})<--(:Company {{{SCOPE}}})) RETURN p",
+    ),
+    (
+        "MATCH (p) WHERE EXISTS { MATCH (p)-[:KNOWS]-(q) WHERE q.age < (q.limit) } RETURN p",
+        f"MATCH (p {{{SCOPE}}}) WHERE EXISTS {{ MATCH (p {{{SCOPE}}})-[:KNOWS {{{SCOPE}}}]-(q {{{SCOPE}}}) "
+        f"WHERE q.age < (q.limit) }} RETURN p",
+    ),
+    (
+        "MATCH (c:Company) RETURN c.id AS name ORDER BY (c) DESC",
+        f"MATCH (c:Company {{{SCOPE}}}) RETURN c.id AS name ORDER BY (c) DESC",
+    ),
+    (
+        "MATCH (s) RETURN (s) * 2, (s) - 1, count(s)",
+        f"MATCH (s {{{SCOPE}}}) RETURN (s) * 2, (s) - 1, count(s)",
+    ),
+    (
+        "MATCH (n {name: '(x)-[:R]->(y)'}) WITH n, {k: (n)} AS m RETURN m",
+        f"MATCH (n {{{SCOPE}, name: '(x)-[:R]->(y)'}}) WITH n, {{k: (n)}} AS m RETURN m",
+    ),
+])
+def test_scope_cypher(cypher, expected):
+    assert scope_cypher(cypher) == expected
+
+def test_scoped_query_only_sees_its_run():
+    graph = InMemoryGraphBackend()
+    for run_id, people in (("run", ["Alice", "Bob"]), ("other", ["Carol"])):
+        graph.register_run(run_id)
+        graph.add_graph_documents([{
+            "id": f"doc-{run_id}",
+            "text": "People at Acme.",
+            "nodes": [{"id": name, "type": "Person", "properties": {}} for name in people],
+            "relationships": [{"source": a, "target": b, "type": "KNOWS", "properties": {}} for a, b in zip(people, people[1:])],
+        }], run_id)
+    cypher = scope_cypher("MATCH (p:Person) WHERE NOT (p)-[:KNOWS]->() RETURN p.id AS name ORDER BY (name)")
+    assert graph.query(cypher, {RUN_SCOPE_PARAM: "run"}) == [{"name": "Bob"}]
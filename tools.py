@@ -1,25 +1,580 @@
 # tools.py
+import asyncio
+import atexit
+import hashlib
 import json
 import re
 import os
-from typing import Dict, Any
+import queue
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Any, List
 from pydantic import Field, BaseModel
 from langchain.tools import Tool
 from langchain_openai import ChatOpenAI
 from langchain.prompts import ChatPromptTemplate
 from langchain.output_parsers import PydanticOutputParser
-from langchain.chains import GraphCypherQAChain
-from langchain_community.graphs import Neo4jGraph
 from langchain_core.documents import Document
 from langchain_experimental.graph_transformers import LLMGraphTransformer
-from langchain_community.chains.graph_qa.prompts import CYPHER_QA_PROMPT
-from clingo import Control, MessageCode
-from prompts import ASP_TRANSLATION_PROMPT
+from langchain_community.chains.graph_qa.prompts import CYPHER_GENERATION_PROMPT, CYPHER_QA_PROMPT
+from langchain_community.chains.graph_qa.cypher import construct_schema, extract_cypher
+from langchain_core.output_parsers import StrOutputParser
+from langchain_community.chains.graph_qa.cypher_utils import CypherQueryCorrector, Schema
+from prompts import ASP_RULES_PROMPT, ASP_REPAIR_PROMPT
+from cache import LRUCache
+from history import count_tokens
+from graph_backend import GraphBackend, Neo4jBackend, _tokenize
+from asp import ASPError, ASPSession, compile_result_facts, describe_facts, graph_document_facts, validate_program
+
+RUN_SCOPE_PARAM = "kb_run_id"
+# Clauses whose parentheses are node patterns; the expression clauses switch back to ordinary parentheses
+_PATTERN_CLAUSES = {"MATCH"}
+_EXPRESSION_CLAUSES = {"WHERE", "RETURN", "WITH", "ORDER", "SKIP", "LIMIT", "UNWIND", "SET", "REMOVE", "DELETE", "CALL", "YIELD", "UNION"}
+# A parenthesis right after any other bare word opens a function call such as count(n)
+_KEYWORDS = _PATTERN_CLAUSES | _EXPRESSION_CLAUSES | {
+    "OPTIONAL", "AND", "OR", "XOR", "NOT", "IN", "BY", "AS", "DISTINCT", "CASE", "WHEN", "THEN", "ELSE"
+}
+# Words whose braces hold a pattern subquery, e.g. EXISTS { MATCH (p)-[:R]->(q) }
+_SUBQUERY_WORDS = {"EXISTS", "COUNT", "COLLECT"}
+
+def _add_scope(properties: str) -> str:
+    inner = properties.strip()[1:-1].strip() if properties else ""
+    scope = f"run_id: ${RUN_SCOPE_PARAM}"
+    return "{" + (f"{scope}, {inner}" if inner else scope) + "}"
+
+def _is_op(token, *values) -> bool:
+    return token[0] == "op" and token[1] in values
+
+def _closing(tokens, i: int):
+    """Index of the bracket that closes tokens[i], or None when the query ends first."""
+    opening, closing = tokens[i][1], {"(": ")", "[": "]", "{": "}"}[tokens[i][1]]
+    depth = 0
+    for j in range(i, len(tokens)):
+        if _is_op(tokens[j], opening):
+            depth += 1
+        elif _is_op(tokens[j], closing):
+            depth -= 1
+            if depth == 0:
+                return j
+    return None
+
+def _pattern_element(tokens, i: int, closing: str):
+    """
+    Parse a node pattern (var:Label {..}) or relationship detail [var:TYPE|OTHER {..}] opening at tokens[i].
+    Returns (closing index, property map span or None, whether it is typed), or None if it is not that shape.
+    """
+    j = i + 1
+    if tokens[j][0] == "name":
+        j += 1
+    typed = False
+    while _is_op(tokens[j], ":", "|"):
+        j += 1
+        if _is_op(tokens[j], ":"):
+            j += 1
+        if tokens[j][0] != "name":
+            return None
+        typed = True
+        j += 1
+    properties = None
+    if _is_op(tokens[j], "{"):
+        end = _closing(tokens, j)
+        if end is None:
+            return None
+        properties = (j, end)
+        j = end + 1
+    return (j, properties, typed) if _is_op(tokens[j], closing) else None
+
+def _pattern_chain(tokens, i: int):
+    """
+    Parse the pattern (a)-[r:TYPE]->(b)<--(c) starting at tokens[i]. Returns the index after it and its
+    (opening index, closing index, property span) elements to scope, or None if no node pattern starts here.
+    """
+    node = _pattern_element(tokens, i, ")")
+    if node is None:
+        return None
+    elements = [(i, node[0], node[1])]
+    relationships = 0
+    j = node[0] + 1
+    while _is_op(tokens[j], "-", "<-"):
+        k = j + 1
+        detail = None
+        if _is_op(tokens[k], "["):
+            detail = (k, _pattern_element(tokens, k, "]"))
+            end = _closing(tokens, k)
+            if end is None:
+                break
+            k = end + 1
+        if not _is_op(tokens[k], "-", "->") or not _is_op(tokens[k + 1], "("):
+            break
+        node = _pattern_element(tokens, k + 1, ")")
+        if node is None:
+            break
+        # Variable-length relationships are left alone
+        if detail and detail[1] and detail[1][2]:
+            elements.append((detail[0], detail[1][0], detail[1][1]))
+        elements.append((k + 1, node[0], node[1]))
+        relationships += 1
+        j = node[0] + 1
+    return j, elements, relationships
+
+def scope_cypher(cypher: str) -> str:
+    """
+    Restrict a generated Cypher query to one run by adding {run_id: $kb_run_id} to its node patterns and typed
+    relationship patterns. Only patterns are touched: everything after MATCH or OPTIONAL MATCH up to the next
+    clause, EXISTS { ... } subqueries, and pattern predicates such as WHERE (p)-[:KNOWS]->(); a parenthesized
+    expression like ORDER BY (c) or RETURN (s) * 2 is left as it is.
+    """
+    tokens = [token for token in _tokenize(cypher) if token[0] != "ws"]
+    words = [cypher[start:end].upper() if kind == "name" and cypher[start] != "`" else None for kind, _, start, end in tokens]
+    edits = []
+    in_pattern = False
+    # For each open brace, the pattern context to restore when it closes (None unless it opened a subquery)
+    braces = []
+    i = 0
+    while i < len(tokens):
+        if words[i] in _PATTERN_CLAUSES:
+            in_pattern = True
+        elif words[i] in _EXPRESSION_CLAUSES:
+            in_pattern = False
+        elif _is_op(tokens[i], "{"):
+            braces.append(in_pattern if i and words[i - 1] in _SUBQUERY_WORDS else None)
+            in_pattern = in_pattern or braces[-1] is not None
+        elif _is_op(tokens[i], "}") and braces:
+            restore = braces.pop()
+            in_pattern = in_pattern if restore is None else restore
+        elif _is_op(tokens[i], "(") and not (i and words[i - 1] and words[i - 1] not in _KEYWORDS):
+            chain = _pattern_chain(tokens, i)
+            # Outside a pattern clause a lone (x) is an expression; only a chain with a relationship is a pattern
+            if chain and (in_pattern or chain[2]):
+                for opening, closing, properties in chain[1]:
+                    head_end = tokens[properties[0]][2] if properties else tokens[closing][2]
+                    head = cypher[tokens[opening][3]:head_end].strip()
+                    scope = _add_scope(cypher[tokens[properties[0]][2]:tokens[properties[1]][3]] if properties else "")
+                    edits.append((tokens[opening][2], tokens[closing][3], f"{tokens[opening][1]}{head}{' ' if head else ''}{scope}{tokens[closing][1]}"))
+                i = chain[0]
+                continue
+        i += 1
+    for start, end, replacement in reversed(edits):
+        cypher = cypher[:start] + replacement + cypher[end:]
+    return cypher
+
+# Bookkeeping properties that never belong in a prompt
+HIDDEN_PROPERTIES = {"run_id", "embedding"}
+
+def _shape_value(value, max_chars: int):
+    if isinstance(value, str):
+        return value if len(value) <= max_chars else value[: max_chars - 1].rstrip() + "…"
+    if isinstance(value, dict):
+        shaped = {k: _shape_value(v, max_chars) for k, v in value.items() if k not in HIDDEN_PROPERTIES}
+        return {k: v for k, v in shaped.items() if v not in (None, "", [])}
+    if isinstance(value, (list, tuple)):
+        # Long numeric lists are vectors, not content
+        if len(value) > 32 and all(isinstance(v, float) for v in value):
+            return None
+        return [_shape_value(v, max_chars) for v in value]
+    return value
+
+def _compact_json(data) -> str:
+    return json.dumps(data, separators=(",", ":"), ensure_ascii=False, default=str)
+
+def shape_result(rows: List[dict], token_budget: int = 1500, max_chars: int = 300) -> dict:
+    """
+    Shrink Cypher rows before they go into a prompt: drop bookkeeping properties, empty values and columns
+    that are empty in every row, clip long strings, and serialize as compact JSON. If the result still exceeds
+    `token_budget`, strings are clipped harder (down to 60 characters) and then trailing rows are dropped.
+    Returns {"rows", "text", "tokens", "dropped_rows"}.
+    """
+    columns = [c for c in (rows[0].keys() if rows else []) if any(row.get(c) not in (None, "", []) for row in rows)]
+    projected = [{c: row.get(c) for c in columns} for row in rows]
+
+    limit = max_chars
+    while True:
+        shaped = [_shape_value(row, limit) for row in projected]
+        text = _compact_json(shaped)
+        tokens = count_tokens(text)
+        if tokens <= token_budget or limit <= 60:
+            break
+        limit = max(limit // 2, 60)
+
+    dropped = 0
+    if tokens > token_budget:
+        # Largest prefix of rows that fits the budget
+        low, high = 0, len(shaped)
+        while low < high:
+            middle = (low + high + 1) // 2
+            if count_tokens(_compact_json(shaped[:middle])) <= token_budget:
+                low = middle
+            else:
+                high = middle - 1
+        dropped = len(shaped) - low
+        shaped = shaped[:low]
+        text = _compact_json(shaped)
+        tokens = count_tokens(text)
+    return {"rows": shaped, "text": text, "tokens": tokens, "dropped_rows": dropped}
+
+# Queued by IngestionQueue.close() after the last text
+_STOP_INGESTION = object()
+
+class IngestionQueue:
+    """
+    Write-behind queue feeding texts to `handler` on a background thread, coalescing up to `max_batch`
+    pending texts per handler call. submit() returns a sequence number; wait_for(seq) blocks until every
+    text up to that number has been ingested (successfully or not). close() ingests what is pending and
+    stops the worker.
+    """
+    def __init__(self, handler: Callable[[List[str]], Any], maxsize: int = 256, max_batch: int = 8):
+        self.handler = handler
+        self.max_batch = max_batch
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._submit_lock = threading.Lock()
+        self._condition = threading.Condition()
+        self._submitted = 0
+        self._completed = 0
+        self.errors = 0
+        self._closed = False
+        self._worker = threading.Thread(target=self._run, name="kb-ingestion", daemon=True)
+        self._worker.start()
+
+    def submit(self, text: str) -> int:
+        # Sequence numbers are assigned under the lock so they match the queue order
+        with self._submit_lock:
+            self._check_open()
+            seq = self._submitted + 1
+            self._queue.put((seq, text))
+            self._submitted = seq
+        return seq
+
+    def try_submit(self, text: str):
+        """Non-blocking submit; returns None when the queue is full."""
+        with self._submit_lock:
+            self._check_open()
+            seq = self._submitted + 1
+            try:
+                self._queue.put_nowait((seq, text))
+            except queue.Full:
+                return None
+            self._submitted = seq
+        return seq
+
+    def wait_for(self, seq: int = None, timeout: float = None) -> bool:
+        target = self._submitted if seq is None else seq
+        with self._condition:
+            return self._condition.wait_for(lambda: self._completed >= target, timeout=timeout)
+
+    def close(self, timeout: float = None) -> bool:
+        """Ingest everything submitted so far, then stop the worker; returns False if it is still running after `timeout`."""
+        with self._submit_lock:
+            if not self._closed:
+                self._closed = True
+                self._queue.put(_STOP_INGESTION)
+        self._worker.join(timeout)
+        return not self._worker.is_alive()
+
+    def _check_open(self):
+        if self._closed:
+            raise RuntimeError("Ingestion queue is closed")
+
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        while len(batch) < self.max_batch and batch[-1] is not _STOP_INGESTION:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            # The stop marker is queued last, so everything before it in the batch is still ingested
+            stop = batch[-1] is _STOP_INGESTION
+            if stop:
+                batch.pop()
+            if batch:
+                self._ingest(batch)
+            if stop:
+                return
+
+    def _ingest(self, batch):
+        try:
+            self.handler([text for _, text in batch])
+        except Exception as e:
+            self.errors += len(batch)
+            print(f"Knowledge base ingestion of {len(batch)} texts failed: {e}")
+        finally:
+            with self._condition:
+                self._completed = batch[-1][0]
+                self._condition.notify_all()
+
+class GraphSchema:
+    """
+    In-process, versioned view of the graph schema. It is extended from the graph documents this process
+    writes, so Cypher generation sees new labels without re-introspecting Neo4j; `version` changes on every
+    extension or reload.
+    """
+    def __init__(self):
+        self.node_properties = {}
+        self.relationship_properties = {}
+        self.relationships = set()
+        self.version = 0
+        self._lock = threading.Lock()
+
+    def update_from_graph_documents(self, graph_documents) -> bool:
+        """Add the labels, relationship types and property keys of `graph_documents`; returns True if anything was new."""
+        with self._lock:
+            before = self._size()
+            for graph_document in graph_documents:
+                self.node_properties.setdefault("Document", set()).update({"id", "text"})
+                nodes = list(graph_document.nodes)
+                for rel in graph_document.relationships:
+                    nodes.extend([rel.source, rel.target])
+                    rel_type = rel.type.replace(" ", "_").upper()
+                    self.relationship_properties.setdefault(rel_type, set()).update(rel.properties)
+                    self.relationships.add((rel.source.type, rel_type, rel.target.type))
+                for node in nodes:
+                    self.node_properties.setdefault(node.type, set()).update({"id", *node.properties})
+                    self.relationships.add(("Document", "MENTIONS", node.type))
+            changed = self._size() != before
+            if changed:
+                self.version += 1
+            return changed
+
+    def load_structured_schema(self, structured_schema: dict):
+        """Replace the tracked schema with a full introspection result (GraphBackend.get_structured_schema)."""
+        # run_id and the run registry are scoping details that Cypher generation must not see
+        with self._lock:
+            self.node_properties = {
+                label: {p["property"] for p in props if p["property"] != "run_id"}
+                for label, props in structured_schema.get("node_props", {}).items() if label != "__KBRun__"
+            }
+            self.relationship_properties = {
+                rel_type: {p["property"] for p in props if p["property"] != "run_id"}
+                for rel_type, props in structured_schema.get("rel_props", {}).items()
+            }
+            self.relationships = {(r["start"], r["type"], r["end"]) for r in structured_schema.get("relationships", [])}
+            self.version += 1
+
+    def _size(self) -> int:
+        return (sum(len(props) + 1 for props in self.node_properties.values())
+                + sum(len(props) + 1 for props in self.relationship_properties.values())
+                + len(self.relationships))
+
+    def to_structured_schema(self) -> dict:
+        with self._lock:
+            return {
+                "node_props": {
+                    label: [{"property": p, "type": "STRING"} for p in sorted(props)]
+                    for label, props in sorted(self.node_properties.items())
+                },
+                "rel_props": {
+                    rel_type: [{"property": p, "type": "STRING"} for p in sorted(props)]
+                    for rel_type, props in sorted(self.relationship_properties.items())
+                },
+                "relationships": [{"start": start, "type": rel_type, "end": end} for start, rel_type, end in sorted(self.relationships)],
+            }
+
+    def render(self) -> str:
+        return construct_schema(self.to_structured_schema(), [], [])
+
+class CypherTranslationCache:
+    """
+    LRU cache of natural language -> Cypher translations, keyed on the normalized question and the schema
+    fingerprint. With a `path`, translations are appended to a JSONL file and reloaded on startup.
+    """
+    def __init__(self, max_entries: int = 256, path: str = None):
+        self.entries = LRUCache(max_entries)
+        self.path = path
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            with open(path, 'r', encoding="utf-8") as file:
+                for line in file:
+                    if line.strip():
+                        record = json.loads(line)
+                        self.entries.put(record["key"], record["cypher"])
+
+    @staticmethod
+    def make_key(query: str, schema_fingerprint: str) -> str:
+        normalized = re.sub(r"\s+", " ", query.strip().lower()).rstrip("?.! ")
+        return f"{schema_fingerprint}:{normalized}"
+
+    def get(self, key: str):
+        return self.entries.get(key)
+
+    def put(self, key: str, cypher: str):
+        self.entries.put(key, cypher)
+        if self.path:
+            with self._lock, open(self.path, 'a', encoding="utf-8") as file:
+                file.write(json.dumps({"key": key, "cypher": cypher}) + "\n")
+
+class QueryLog:
+    """
+    Append-only JSONL log of knowledge base queries. Records are buffered and written in one append per
+    flush, so the cost per query does not grow with the log; once the file exceeds `max_bytes` it is
+    rotated to `path.1` ... `path.<backups>`. Use QueryLog.shared(path) so that every knowledge base in a
+    process (e.g. concurrent batch runs) appends and rotates through one writer per file.
+    """
+    _instances = {}
+    _instances_lock = threading.Lock()
+
+    @classmethod
+    def shared(cls, path: str, max_bytes: int = 10 * 1024 * 1024, backups: int = 5):
+        """The process-wide writer for `path`; the first caller's rotation settings apply."""
+        key = os.path.abspath(path)
+        with cls._instances_lock:
+            if key not in cls._instances:
+                cls._instances[key] = cls(path, max_bytes, backups)
+            return cls._instances[key]
+
+    def __init__(self, path: str, max_bytes: int = 10 * 1024 * 1024, backups: int = 5, flush_every: int = 16, flush_interval: float = 5.0):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self._buffer = []
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        atexit.register(self.flush)
+
+    def write(self, record: dict):
+        line = json.dumps({"timestamp": time.time(), **record}, default=str, ensure_ascii=False) + "\n"
+        with self._lock:
+            self._buffer.append(line)
+            if len(self._buffer) < self.flush_every and time.monotonic() - self._last_flush < self.flush_interval:
+                return
+            self._flush_locked()
+
+    def flush(self):
+        with self._lock:
+            self._flush_locked()
+
+    def _flush_locked(self):
+        self._last_flush = time.monotonic()
+        if not self._buffer:
+            return
+        data = "".join(self._buffer)
+        self._buffer = []
+        try:
+            # A single append of whole lines: a crash can lose buffered records but never truncates the file
+            with open(self.path, 'a', encoding="utf-8") as file:
+                file.write(data)
+                size = file.tell()
+            if size >= self.max_bytes:
+                self._rotate()
+        except OSError as e:
+            print(f"Failed to write query log {self.path}: {e}")
+
+    def _rotate(self):
+        if self.backups <= 0:
+            os.remove(self.path)
+            return
+        for index in range(self.backups - 1, 0, -1):
+            source = f"{self.path}.{index}"
+            if os.path.exists(source):
+                os.replace(source, f"{self.path}.{index + 1}")
+        os.replace(self.path, f"{self.path}.1")
+
+class QueryPlanner:
+    """
+    Chooses how query_knowledge_base answers from the Cypher result: "direct" (return the rows, no LLM call),
+    "qa" (one CYPHER_QA_PROMPT call) or "asp" (rule generation and Clingo). Each path costs its observed
+    latency (an exponential moving average, seeded with `prior_seconds`) plus a penalty, in seconds, for
+    how poorly it fits the question and rows; the cheapest path wins.
+    """
+    # Constraint and optimisation language only; everyday words such as "all", "each" or "should" also start plain lookups
+    REASONING = re.compile(
+        r"\b((at least|at most|exactly|no more than|no fewer than|no less than)\s+(\d+|an?|one|two|three|four|five|six|seven|eight|nine|ten)|"
+        r"constraints?|assign\w*|schedul\w*|allocat\w*|optimal|optimi[sz]e|minimi[sz]e|maximi[sz]e|combinations?|consistent|"
+        r"satisf(y|ies|ied|ying))\b", re.IGNORECASE
+    )
+    AGGREGATE = re.compile(
+        r"\b(how many|count|number of|total|sum|average|mean|most|least|highest|lowest|top|rank\w*|compare|difference)\b", re.IGNORECASE
+    )
+
+    def __init__(self, direct_max_rows: int = 20, row_penalty: float = 1.0, numeric_penalty: float = 3.0,
+                 prior_seconds: Dict[str, float] = None, alpha: float = 0.2):
+        self.direct_max_rows = direct_max_rows
+        self.row_penalty = row_penalty
+        self.numeric_penalty = numeric_penalty
+        self.alpha = alpha
+        self.latency = dict(prior_seconds or {"direct": 0.0, "qa": 2.0, "asp": 8.0})
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _numbers(value):
+        if isinstance(value, bool):
+            return False
+        if isinstance(value, (int, float)):
+            return True
+        if isinstance(value, dict):
+            return any(QueryPlanner._numbers(v) for k, v in value.items() if k != "id")
+        if isinstance(value, (list, tuple)):
+            return any(QueryPlanner._numbers(v) for v in value)
+        return False
+
+    def features(self, query: str, rows: List[dict]) -> dict:
+        if self.REASONING.search(query):
+            intent = "reasoning"
+        elif self.AGGREGATE.search(query):
+            intent = "aggregate"
+        else:
+            intent = "lookup"
+        return {
+            "intent": intent,
+            "rows": len(rows),
+            "columns": len(rows[0]) if rows else 0,
+            "numeric": any(self._numbers(row) for row in rows),
+        }
+
+    def _penalties(self, features: dict) -> Dict[str, float]:
+        rows, intent = features["rows"], features["intent"]
+        numeric = self.numeric_penalty if features["numeric"] else 0.0
+        return {
+            # Rows are only handed back verbatim for plain lookups small enough to read
+            "direct": 0.0 if intent == "lookup" and rows <= self.direct_max_rows else float("inf"),
+            # A single QA call gets less reliable as a reasoning question spans more rows and numeric constraints
+            "qa": rows * self.row_penalty + numeric if intent == "reasoning" else 0.0,
+            "asp": 0.0 if intent == "reasoning" else float("inf"),
+        }
+
+    def choose(self, query: str, rows: List[dict]) -> dict:
+        features = self.features(query, rows)
+        penalties = self._penalties(features)
+        with self._lock:
+            costs = {path: self.latency[path] + penalty for path, penalty in penalties.items()}
+        path = min(costs, key=costs.get)
+        decision = {"path": path, "features": features, "costs": {k: round(v, 3) for k, v in costs.items() if v != float("inf")}}
+        print(f"Knowledge base plan: {decision}")
+        return decision
+
+    def record(self, path: str, seconds: float):
+        with self._lock:
+            self.latency[path] = (1 - self.alpha) * self.latency[path] + self.alpha * seconds
 
 class KnowledgeBaseSystem:
-    def __init__(self, neo4j_url, neo4j_username, neo4j_password):
-        self.graph = Neo4jGraph(url=neo4j_url, username=neo4j_username, password=neo4j_password)
-        self.graph.query("MATCH (n) DETACH DELETE n")
+    def __init__(self, neo4j_url=None, neo4j_username=None, neo4j_password=None, ingest_queue_size: int = 256, ingest_batch_size: int = 8,
+                 cypher_cache_size: int = 256, cypher_cache_path: str = None, run_id: str = None, run_retention_hours: float = 24,
+                 backend: GraphBackend = None, asp_session: ASPSession = None, planner: QueryPlanner = None,
+                 context_token_budget: int = 1500, max_value_chars: int = 300, asp_cache_size: int = 128, query_log_path: str = None, query_log_max_bytes: int = 10 * 1024 * 1024,
+                 query_log_backups: int = 5):
+        # Neo4j unless another backend (e.g. graph_backend.InMemoryGraphBackend) is passed in
+        self.graph = backend or Neo4jBackend(neo4j_url, neo4j_username, neo4j_password)
+        # Every node and relationship of this run carries run_id; queries are filtered by it instead of wiping the database
+        self.run_id = run_id or uuid.uuid4().hex
+        self.graph.register_run(self.run_id)
+        self._cleanup_thread = threading.Thread(
+            target=self._cleanup_expired_runs, args=(run_retention_hours,), name="kb-cleanup", daemon=True
+        )
+        self._cleanup_thread.start()
+        self._ingested_hashes = set()
+        self._ingested_lock = threading.Lock()
+        self._extraction_pool = ThreadPoolExecutor(max_workers=ingest_batch_size, thread_name_prefix="kb-extract")
+        self.ingestion = IngestionQueue(self.add_texts_to_kb, maxsize=ingest_queue_size, max_batch=ingest_batch_size)
         
         self.asp_llm = ChatOpenAI(model="gpt-4o-mini")
         self.qa_llm = ChatOpenAI(model="gpt-4o-mini")
@@ -31,143 +586,367 @@ class KnowledgeBaseSystem:
             relationship_properties=["description"]
         )
         
-        self.cypher_chain = GraphCypherQAChain.from_llm(
-            graph=self.graph,
-            cypher_llm=ChatOpenAI(temperature=0, model="gpt-4o-mini"),
-            qa_llm=ChatOpenAI(temperature=0, model="gpt-4o-mini"),
-            validate_cypher=True,
-            return_direct=True,
-            verbose=True,
-            top_k=20,
-            allow_dangerous_requests=True
-        )
+        # Cypher generation, validation and execution of GraphCypherQAChain, split up so translations can be memoized
+        self.cypher_generation_chain = CYPHER_GENERATION_PROMPT | ChatOpenAI(temperature=0, model="gpt-4o-mini") | StrOutputParser()
+        self.cypher_query_corrector = CypherQueryCorrector([])
+        self.cypher_cache = CypherTranslationCache(cypher_cache_size, cypher_cache_path)
+        self.top_k = 20
+        # Rows handed to the QA and ASP prompts are shaped to this many tokens
+        self.context_token_budget = context_token_budget
+        self.max_value_chars = max_value_chars
+        # Graph facts stay grounded in one Clingo control; each complex query is solved as a small added part
+        self.asp_session = asp_session or ASPSession()
+        self.planner = planner or QueryPlanner()
+        # Cypher rows -> ASP facts, keyed by a hash of the rows
+        self.fact_cache = LRUCache(128)
+        # (normalized query, rows hash) -> validated rules; program and session facts -> answer sets and interpretations
+        self.asp_program_cache = LRUCache(asp_cache_size)
+        self.asp_solution_cache = LRUCache(asp_cache_size)
+        self.query_log = QueryLog.shared(query_log_path, query_log_max_bytes, query_log_backups) if query_log_path else None
+
+        # This run's scope starts empty, so the empty in-process schema is accurate
+        self.schema = GraphSchema()
+        self._schema_stale = False
+        self._chain_schema_version = None
+        self.graph_schema = ""
+        self.schema_fingerprint = ""
+
+    def drop_run(self, run_id: str, batch_size: int = 5000):
+        """Delete everything written under `run_id`, in batches so that no single transaction grows with the run size."""
+        self.graph.drop_run(run_id, batch_size)
+
+    def _cleanup_expired_runs(self, retention_hours: float, batch_size: int = 5000):
+        """Background cleanup of runs older than the retention window, plus unscoped data left by older versions."""
+        try:
+            expired = self.graph.expired_runs(int(retention_hours * 3600 * 1000), self.run_id)
+            for run_id in expired:
+                self.drop_run(run_id, batch_size)
+            self.graph.delete_unscoped(batch_size)
+            if expired:
+                print(f"Removed {len(expired)} expired knowledge base runs")
+        except Exception as e:
+            print(f"Knowledge base cleanup failed: {e}")
 
     def process_text(self, text: str):
-        doc = Document(page_content=text)
+        doc = Document(page_content=text, metadata={"id": self._content_hash(text)})
         graph_documents = self.llm_transformer.convert_to_graph_documents([doc])
         return graph_documents[0] if graph_documents else None
 
+    @staticmethod
+    def _content_hash(text: str) -> str:
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def _claim_new_texts(self, texts: List[str]) -> List[str]:
+        """Drop texts that were already ingested (or repeat within the batch) and mark the rest as ingested."""
+        new_texts = []
+        with self._ingested_lock:
+            for text in texts:
+                content_hash = self._content_hash(text)
+                if text and content_hash not in self._ingested_hashes:
+                    self._ingested_hashes.add(content_hash)
+                    new_texts.append(text)
+        return new_texts
+
+    def _release_texts(self, texts: List[str]):
+        # A failed batch must stay retryable
+        with self._ingested_lock:
+            for text in texts:
+                self._ingested_hashes.discard(self._content_hash(text))
+
+    def _write_graph_documents(self, graph_documents):
+        documents = []
+        for graph_document in graph_documents:
+            nodes = {(node.id, node.type): node for node in graph_document.nodes}
+            for rel in graph_document.relationships:
+                nodes.setdefault((rel.source.id, rel.source.type), rel.source)
+                nodes.setdefault((rel.target.id, rel.target.type), rel.target)
+            documents.append({
+                "id": graph_document.source.metadata["id"],
+                "text": graph_document.source.page_content,
+                "nodes": [{"id": node.id, "type": node.type, "properties": node.properties} for node in nodes.values()],
+                "relationships": [
+                    {
+                        "source": rel.source.id,
+                        "target": rel.target.id,
+                        "type": rel.type.replace(" ", "_").upper(),
+                        "properties": rel.properties
+                    }
+                    for rel in graph_document.relationships
+                ],
+            })
+        if documents:
+            self.graph.add_graph_documents(documents, self.run_id)
+            # The graph write succeeded, so the schema must follow it even if the facts cannot be grounded
+            self.schema.update_from_graph_documents(graph_documents)
+            try:
+                self.asp_session.add_facts(graph_document_facts(documents))
+            except ASPError as e:
+                print(f"Failed to add graph facts to the ASP session: {e} {e.messages}")
+
+    def invalidate_schema(self):
+        """Force a full schema introspection before the next query (e.g. after writes by another process)."""
+        self._schema_stale = True
+
+    def _sync_schema(self):
+        if self._schema_stale:
+            self.schema.load_structured_schema(self.graph.get_structured_schema())
+            self._schema_stale = False
+        if self.schema.version == self._chain_schema_version:
+            return
+        structured_schema = self.schema.to_structured_schema()
+        self.graph_schema = construct_schema(structured_schema, [], [])
+        self.schema_fingerprint = hashlib.sha256(self.graph_schema.encode("utf-8")).hexdigest()[:16]
+        self.cypher_query_corrector = CypherQueryCorrector(
+            [Schema(r["start"], r["type"], r["end"]) for r in structured_schema["relationships"]]
+        )
+        self._chain_schema_version = self.schema.version
+
+    def _run_cypher_query(self, query: str) -> Dict[str, Any]:
+        """
+        Translate the question to Cypher (memoized per schema fingerprint) and run it against the current graph.
+        Returns {"query": ..., "cypher": ..., "result": rows}; "query" and "result" have the shape
+        GraphCypherQAChain produced with return_direct.
+        """
+        key = self.cypher_cache.make_key(query, self.schema_fingerprint)
+        cypher = self.cypher_cache.get(key)
+        cached = cypher is not None
+        if not cached:
+            generated = self.cypher_generation_chain.invoke({"question": query, "schema": self.graph_schema})
+            cypher = self.cypher_query_corrector(extract_cypher(generated))
+        print(f"Generated Cypher{' (cached)' if cached else ''}:\n{cypher}")
+
+        rows = self.graph.query(scope_cypher(cypher), {RUN_SCOPE_PARAM: self.run_id})[: self.top_k] if cypher else []
+        # Only translations that executed are worth reusing
+        if cypher and not cached:
+            self.cypher_cache.put(key, cypher)
+        return {"query": query, "cypher": cypher, "result": rows}
+
+    def add_texts_to_kb(self, texts: List[str]):
+        """
+        Ingest a batch of texts: skip already ingested content, extract the rest concurrently
+        and write all resulting graph documents in one transaction.
+        """
+        new_texts = self._claim_new_texts(texts)
+        if not new_texts:
+            return []
+        try:
+            graph_documents = [doc for doc in self._extraction_pool.map(self.process_text, new_texts) if doc is not None]
+            self._write_graph_documents(graph_documents)
+        except Exception:
+            self._release_texts(new_texts)
+            raise
+        return graph_documents
+
     def add_to_kb(self, text):
-        graph_document = self.process_text(text)
-        self.graph.add_graph_documents([graph_document], baseEntityLabel=True, include_source=True)
-        return graph_document
+        graph_documents = self.add_texts_to_kb([text])
+        return graph_documents[0] if graph_documents else None
+
+    def submit(self, text: str) -> int:
+        """Queue a text for background ingestion, so the calling agent turn does not wait on graph extraction."""
+        return self.ingestion.submit(text)
+
+    async def asubmit(self, text: str) -> int:
+        seq = self.ingestion.try_submit(text)
+        if seq is None:
+            # Queue is full: apply backpressure without blocking the event loop
+            seq = await asyncio.to_thread(self.ingestion.submit, text)
+        return seq
+
+    def flush(self, seq: int = None, timeout: float = None) -> bool:
+        """Wait until every text submitted so far (or up to `seq`) has been written to the graph."""
+        return self.ingestion.wait_for(seq, timeout)
+
+    async def aflush(self, seq: int = None, timeout: float = None) -> bool:
+        return await asyncio.to_thread(self.ingestion.wait_for, seq, timeout)
+
+    def close(self):
+        """
+        Ingest the pending texts, then stop the ingestion worker and extraction threads and release the graph
+        connection and the Clingo control. The knowledge base cannot be used afterwards.
+        """
+        self.ingestion.close()
+        self._extraction_pool.shutdown()
+        self.graph.close()
+        self.asp_session.close()
+        if self.query_log:
+            self.query_log.flush()
 
     def query_knowledge_base(self, query: str):
         """
         Query the knowledge base to retrieve data and process complex logical questions.
         """
-        self.graph.refresh_schema()
-        graph_data = self.cypher_chain.invoke({"query": query})
+        # Only writes submitted before this query have to land; later ones keep flowing in the background
+        self.flush()
+        self._sync_schema()
+        graph_data = self._run_cypher_query(query)
+        plan = None
 
         if not graph_data["result"]:
             result = {"result": "No relevant data was found in the database.", "source": "graph_database"}
         else:
-            result_complexity = self._assess_result_complexity(graph_data["result"])
-            if result_complexity == "simple":
+            plan = self.planner.choose(query, graph_data["result"])
+            started = time.perf_counter()
+            shaped = shape_result(graph_data["result"], self.context_token_budget, self.max_value_chars)
+            plan["context_tokens"] = shaped["tokens"]
+            plan["dropped_rows"] = shaped["dropped_rows"]
+            if plan["path"] == "direct":
+                result = {"result": shaped["text"], "source": "graph_database"}
+            elif plan["path"] == "qa":
                 qa_chain = CYPHER_QA_PROMPT | self.qa_llm
-                answer = qa_chain.invoke({"question": query, "context": graph_data})
-                result = {"result": answer, "source": "graph_database"}
+                answer = qa_chain.invoke({"question": query, "context": shaped["text"]})
+                result = {"result": answer.content, "source": "graph_database"}
             else:
-                clingo_result = self._solve_with_clingo(query, graph_data)
-                result = {"result": clingo_result, "source": "clingo_solver with graph_database"}
-
-        self._save_to_file({
-            "question": query,
-            "retrieved_data": graph_data["result"],
-            "result_complexity": result_complexity,
-            "answer": result["result"],
-            "source": result["source"]
-        })
+                clingo_result, solver_stats = self._solve_with_clingo(query, shaped["rows"])
+                result = {"result": clingo_result, "source": "clingo_solver with graph_database", "solver_stats": solver_stats}
+            plan["seconds"] = round(time.perf_counter() - started, 3)
+            self.planner.record(plan["path"], plan["seconds"])
 
-        return result
+        if self.query_log:
+            self.query_log.write({
+                "run_id": self.run_id,
+                "question": query,
+                "cypher": graph_data["cypher"],
+                "retrieved_data": graph_data["result"],
+                "plan": plan,
+                "answer": result["result"],
+                "source": result["source"],
+                "solver_stats": result.get("solver_stats")
+            })
 
-    def _assess_result_complexity(self, result: str) -> str:
-        return "complex" if len(result) >= 10 else "simple"
+        return result
 
-    def _save_to_file(self, data: dict):
-        filename = "C:/Users/adam/Desktop/knowledge_base_queries.json"
-        try:
-            with open(filename, 'r') as file:
-                existing_data = json.load(file)
-        except FileNotFoundError:
-            existing_data = []
-        existing_data.append(data)
-        with open(filename, 'w') as file:
-            json.dump(existing_data, file, indent=2)
-        print(f"Query data saved to {filename}")
-
-    def _solve_with_clingo(self, query: str, graph_data: Dict[str, Any]) -> str:
-        asp_parser = PydanticOutputParser(pydantic_object=ASPInput)
-        try:
-            asp_representation = self._generate_asp_representation(query, graph_data, asp_parser)
-        except ValueError as e:
-            return str(e)
+    def _solve_with_clingo(self, query: str, rows: List[dict]):
+        """
+        Returns the interpreted answer and the solver statistics (None if no program could be solved).
+        Validated rules are cached per (normalized query, rows) and answer sets per program and session facts,
+        so a repeated question over unchanged rows needs neither the LLM nor Clingo.
+        """
+        compiled = self._compile_facts(rows)
+        program_key = CypherTranslationCache.make_key(query, compiled["hash"])
+        asp_rules = self.asp_program_cache.get(program_key)
+        cache_level = "program" if asp_rules is not None else None
+        if asp_rules is None:
+            asp_parser = PydanticOutputParser(pydantic_object=ASPInput)
+            try:
+                asp_rules = self._generate_asp_representation(query, compiled, asp_parser)
+            except ValueError as e:
+                return str(e), None
+            self.asp_program_cache.put(program_key, asp_rules)
 
-        print(f"Final ASP representation:\n{asp_representation}")
+        print(f"Final ASP rules:\n{asp_rules}")
 
-        ctl = Control()
-        error_handler = ClingoErrorHandler()
-        
-        max_clingo_attempts = 3
-        for attempt in range(max_clingo_attempts):
+        program = "\n".join(compiled["facts"] + [asp_rules])
+        # Rules may also read the session's graph facts, which only ever grow
+        solution_key = hashlib.sha256(f"{self.asp_session.fact_version()}\n{program}".encode("utf-8")).hexdigest()
+        solved = self.asp_solution_cache.get(solution_key)
+        if solved is not None:
+            cache_level = "solution"
+        else:
             try:
-                ctl.register_observer(error_handler)
-                ctl.add("base", [], asp_representation)
-                ctl.ground([("base", [])])
-                break
-            except RuntimeError as e:
-                print(f"Attempt {attempt + 1}: Error in Clingo processing: {str(e)}")
-                if attempt < max_clingo_attempts - 1:
-                    asp_representation = self._improve_asp_representation(asp_representation, error_handler.error_messages)
-                else:
-                    return "Error in processing the ASP representation after maximum attempts"
-
-        solution = []
-        with ctl.solve(yield_=True) as handle:
-            for model in handle:
-                solution.append(str(model))
-        
+                solved = self.asp_session.solve(program)
+            except ASPError as e:
+                # Statements were validated one by one, so what is left is a whole-program grounding failure
+                print(f"Error in Clingo processing: {str(e)} {e.messages}")
+                return "Error in processing the ASP representation", None
+            solved["interpretations"] = {}
+            # A search cut off by the timeout depends on machine load, so it is not reused
+            if not solved["stats"]["timed_out"]:
+                self.asp_solution_cache.put(solution_key, solved)
+
+        stats = {**solved["stats"], "cache": cache_level}
+        solution = [" ".join(atoms) for atoms in solved["models"]]
+
         print(f"Solutions found: {solution}")
+        print(f"Solver stats: {stats}")
 
         if not solution or solution == [""]:
-            return "No solution found"
+            return ("No solution found within the solve budget" if stats["timed_out"] else "No solution found"), stats
 
-        return self._interpret_solution(query, solution)
+        if stats.get("optimality_proven") is False:
+            solution.append("(best answer set found before the solve budget ran out; it is not proven optimal)")
+        elif stats["timed_out"] or stats["truncated"]:
+            solution.append(f"(search stopped after {len(solution)} answer sets; more may exist)")
+        interpretation = solved["interpretations"].get(program_key)
+        if interpretation is None:
+            interpretation = self._interpret_solution(query, solution)
+            solved["interpretations"][program_key] = interpretation
+        return interpretation, stats
 
-    def _generate_asp_representation(self, query: str, graph_data: Dict[str, Any], asp_parser, max_attempts: int = 3) -> str:
+    def _compile_facts(self, rows: List[dict]) -> dict:
+        key = hashlib.sha256(json.dumps(rows, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+        compiled = self.fact_cache.get(key)
+        if compiled is None:
+            compiled = {**compile_result_facts(rows), "hash": key}
+            self.fact_cache.put(key, compiled)
+        return compiled
+
+    def cache_stats(self) -> dict:
+        return {
+            "cypher": self.cypher_cache.entries.stats(),
+            "asp_program": self.asp_program_cache.stats(),
+            "asp_solution": self.asp_solution_cache.stats(),
+        }
+
+    def _generate_asp_representation(self, query: str, compiled: dict, asp_parser, max_attempts: int = 3) -> str:
+        """Ask the LLM for the query-specific rules only; the facts come from compile_result_facts."""
         asp_prompt = ChatPromptTemplate.from_messages([
-            ("system", ASP_TRANSLATION_PROMPT),
-            ("human", """Query: {query}\n\nRelevant Knowledge: {relevant_kb}\n\nProvide an ASP representation for this query. 
+            ("system", ASP_RULES_PROMPT),
+            ("human", """Query: {query}\n\nLoaded facts:\n{predicates}\n\nProvide the ASP rules that answer this query. 
              Ensure each statement is on a separate line and validate the ASP syntax before finalizing the output.\n\n{format_instructions}""")
         ])
 
+        asp_rules = None
         for attempt in range(max_attempts):
-            asp_chain = asp_prompt | self.asp_llm
-            asp_result = asp_chain.invoke({
-                "query": query,
-                "relevant_kb": json.dumps(graph_data, indent=2),
-                "format_instructions": asp_parser.get_format_instructions()
-            })
-            
-            try:
-                parsed_asp_result = asp_parser.parse(asp_result.content)
-                if self._validate_asp_syntax(parsed_asp_result.asp_representation):
-                    return parsed_asp_result.asp_representation
-                else:
-                    print(f"Attempt {attempt + 1}: Invalid ASP syntax. Retrying...")
-            except Exception as e:
-                print(f"Attempt {attempt + 1}: Error parsing ASP output: {e}")
-        
+            if asp_rules is None:
+                asp_chain = asp_prompt | self.asp_llm
+                asp_result = asp_chain.invoke({
+                    "query": query,
+                    "predicates": describe_facts(compiled["predicates"]),
+                    "format_instructions": asp_parser.get_format_instructions()
+                })
+                try:
+                    asp_rules = asp_parser.parse(asp_result.content).asp_representation
+                except Exception as e:
+                    print(f"Attempt {attempt + 1}: Error parsing ASP output: {e}")
+                    continue
+
+            errors = validate_program(asp_rules, self._known_signatures(compiled))
+            if not errors:
+                return asp_rules
+            print(f"Attempt {attempt + 1}: {len(errors)} invalid ASP statement(s): {errors}")
+            if attempt < max_attempts - 1:
+                asp_rules = self._repair_asp_statements(asp_rules, errors, compiled)
+
         raise ValueError("Failed to generate valid ASP representation after maximum attempts")
 
-    def _improve_asp_representation(self, asp_representation: str, error_messages: list) -> str:
-        improvement_prompt = ChatPromptTemplate.from_messages([
-            ("system", "Improve the ASP representation to fix the Clingo error. Ensure each statement is on a separate line and follows ASP syntax rules."),
-            ("human", f"Original ASP:\n{asp_representation}\nClingo Errors:\n{', '.join(error_messages)}\n\nProvide an improved ASP representation that addresses these errors.")
+    def _known_signatures(self, compiled: dict):
+        signatures = self.asp_session.fact_signatures()
+        for signature in compiled["predicates"]:
+            name, _, arity = signature.rpartition("/")
+            signatures.add((name, int(arity)))
+        return signatures
+
+    def _repair_asp_statements(self, asp_rules: str, errors: List[dict], compiled: dict) -> str:
+        """Send only the failing statements and their Clingo errors to the LLM and splice the fixes back in."""
+        repair_parser = PydanticOutputParser(pydantic_object=ASPRepair)
+        repair_prompt = ChatPromptTemplate.from_messages([
+            ("system", ASP_REPAIR_PROMPT),
+            ("human", "Loaded facts:\n{predicates}\n\nFailing statements:\n{failures}\n\n{format_instructions}")
         ])
-        improvement_chain = improvement_prompt | self.asp_llm
-        improvement_result = improvement_chain.invoke({})
-        return self._preprocess_asp(improvement_result.content)
+        failures = "\n".join(f"{i + 1}. {error['statement']}\n   Error: {error['error']}" for i, error in enumerate(errors))
+        try:
+            repaired = (repair_prompt | self.asp_llm).invoke({
+                "predicates": describe_facts(compiled["predicates"]),
+                "failures": failures,
+                "format_instructions": repair_parser.get_format_instructions()
+            })
+            fixes = repair_parser.parse(repaired.content).statements
+        except Exception as e:
+            print(f"Error parsing ASP repair: {e}")
+            return asp_rules
+        for error, fix in zip(errors, fixes):
+            asp_rules = asp_rules.replace(error["statement"], fix, 1)
+        return asp_rules
 
     def _interpret_solution(self, query: str, solution: list) -> str:
         interpretation_prompt = ChatPromptTemplate.from_messages([
@@ -183,38 +962,13 @@ class KnowledgeBaseSystem:
 
         return interpretation_result.content
 
-    def _validate_asp_syntax(self, asp_representation: str) -> bool:
-        statements = asp_representation.strip().split('\n')
-        fact_pattern = r'^[a-z_]+\([a-z0-9_, ]+\)\.$'
-        rule_pattern = r'^[a-z_]+\([a-z0-9_, ]+\)\s*:-\s*[a-z_]+\([a-z0-9_, ]+\)(\s*,\s*[a-z_]+\([a-z0-9_, ]+\))*\.$'
-        constraint_pattern = r'^:-\s*[a-z_]+\([a-z0-9_, ]+\)(\s*,\s*[a-z_]+\([a-z0-9_, ]+\))*\.$'
-        
-        for statement in statements:
-            statement = statement.strip()
-            if not (re.match(fact_pattern, statement) or 
-                    re.match(rule_pattern, statement) or 
-                    re.match(constraint_pattern, statement)):
-                print(f"Invalid ASP statement: {statement}")
-                return False
-        return True
-
-    def _preprocess_asp(self, asp_representation: str) -> str:
-        asp_representation = re.sub(r'([^.\s])(\s*\n)', r'\1.\2', asp_representation)
-        asp_representation = re.sub(r'\.\.', '.', asp_representation)
-        asp_representation = re.sub(r'\s*:-\s*', ' :- ', asp_representation)
-        return asp_representation
-
 class ASPInput(BaseModel):
     """Input for generating ASP representation."""
-    asp_representation: str = Field(description="ASP query representation")
-
-class ClingoErrorHandler:
-    def __init__(self):
-        self.error_messages = []
+    asp_representation: str = Field(description="ASP rules answering the query over the loaded facts")
 
-    def on_message(self, code, msg):
-        if code in [MessageCode.RuntimeError, MessageCode.SyntaxError, MessageCode.LogicError]:
-            self.error_messages.append(f"{code}: {msg}")
+class ASPRepair(BaseModel):
+    """Repaired versions of failing ASP statements."""
+    statements: List[str] = Field(description="One corrected statement per failing statement, in the same order (empty string to drop it)")
 
 def create_kb_tool(kb_system: KnowledgeBaseSystem) -> Tool:
     return Tool(